@@ -1,66 +1,165 @@
-from flask import Flask, request
-from queue import Queue
-from services.webhook import send_webhook
-import threading
+from flask import Flask, request, g
+from services.webhook import send_webhook, dispatcher
+from services.job_executor import JobExecutor
+from services.job_store import JobStore
+from services.job_scheduler import job_lane
+from services.admission import check_admission, check_rate_limit, Rejection, MAX_QUEUE_LENGTH, RETRY_AFTER_MIN
+from services.tenants import Tenant, DEFAULT_TENANT
+from services import job_control
+from services import scratch
+from services import metrics
+from services.idempotency import idempotency_key, wait_for_job
+from services.batch import send_job_webhooks
+from services.file_management import check_input_urls, InputNotAllowed
+from app_utils import TASKS, task_name, queued_endpoints
 import uuid
 import os
 import time
+import threading
 from version import BUILD_NUMBER  # Import the BUILD_NUMBER
 
-MAX_QUEUE_LENGTH = int(os.environ.get('MAX_QUEUE_LENGTH', 0))
+QUEUE_WORKERS = int(os.environ.get('QUEUE_WORKERS', 1))
+JOB_DRAIN_TIMEOUT = int(os.environ.get('JOB_DRAIN_TIMEOUT', 60))
+# Seconds jobs stopped by a drain get to wind down before they are handed back to the queue
+JOB_STOP_GRACE = 5
+# Longest a synchronous request waits for its job; keep it below gunicorn's --timeout
+SYNC_WAIT_TIMEOUT = float(os.environ.get('SYNC_WAIT_TIMEOUT', 240))
+
+def job_state(code, context):
+    """Final state of a job, as recorded in the job store."""
+    return context.state or ('done' if code == 200 else 'failed')
 
 def create_app():
     app = Flask(__name__)
 
-    # Create a queue to hold tasks
-    task_queue = Queue()
-    queue_id = id(task_queue)  # Generate a single queue_id for this worker
-
-    # Function to process tasks from the queue
-    def process_queue():
-        while True:
-            job_id, data, task_func, queue_start_time = task_queue.get()
-            queue_time = time.time() - queue_start_time
-            run_start_time = time.time()
-            pid = os.getpid()  # Get the PID of the actual processing thread
-            response = task_func()
-            run_time = time.time() - run_start_time
-            total_time = time.time() - queue_start_time
-
-            webhook_url = data.get("webhook_url")
-            record_id = None
-            if webhook_url:
-                from urllib.parse import urlparse, parse_qs
-                parsed_url = urlparse(webhook_url)
-                query_params = parse_qs(parsed_url.query)
-                record_id = query_params.get('record_id', [None])[0]
-
-            response_data = {
-                "endpoint": response[1],
-                "code": response[2],
-                "id": data.get("id"),
-                "job_id": job_id,
-                "response": response[0] if response[2] == 200 else None,
-                "message": "success" if response[2] == 200 else response[0],
-                "pid": pid,
-                "queue_id": queue_id,
-                "run_time": round(run_time, 3),
-                "queue_time": round(queue_time, 3),
-                "total_time": round(total_time, 3),
-                "queue_length": task_queue.qsize(),
-                "build_number": BUILD_NUMBER,  # Add build number to response
-                "record_id": record_id
-            }
-
-            send_webhook(data.get("webhook_url"), response_data)
-
-            task_queue.task_done()
-
-    # Start the queue processing in a separate thread
-    threading.Thread(target=process_queue, daemon=True).start()
+    # Persistent record of every job, shared by all workers in the container
+    job_store = JobStore()
+    app.job_store = job_store
+
+    # Function to process a single task claimed from the shared queue
+    def process_job(job, slot):
+        job_id, data = job.job_id, job.data
+        queue_time = job.started_at - job.queued_at
+        run_start_time = time.time()
+        pid = os.getpid()  # Get the PID of the actual processing thread
+        try:
+            context = job_control.start_job(job_id, data.get('timeout'), job_store)
+        except OSError as e:
+            # No workspace (disk full, permissions): fail the job like any other error instead of leaving it running
+            context = job_control.JobContext(job_id)
+            response = (f"Could not create the job's workspace - {str(e)}", job.endpoint, 500)
+        else:
+            try:
+                task_func = TASKS.get(job.task)
+                if task_func is None:
+                    raise ValueError(f"Unknown task {job.task}")
+                response = task_func(job_id=job_id, data=data, **job.kwargs)
+            except Exception as e:
+                response = (str(e), job.endpoint, 500)
+            finally:
+                job_control.end_job(context)
+                # Outputs are uploaded by now; nothing in the workspace outlives the job
+                context.cleanup_files()
+        if context.reason == 'requeued':
+            if response[2] != 200:
+                # Handed back to the queue by drain(); another worker runs it again
+                return
+            # Finished in the grace period after drain() stopped it: its outputs are
+            # uploaded, so record the result instead of running it again
+            context.reason = None
+        if context.stopped:
+            # Whatever the task returned after its processes were killed, report why it stopped
+            response = (context.message, job.endpoint, job_control.STOP_CODES[context.reason])
+        run_time = time.time() - run_start_time
+        total_time = time.time() - job.queued_at
+
+        webhook_url = data.get("webhook_url")
+        record_id = None
+        if webhook_url:
+            from urllib.parse import urlparse, parse_qs
+            parsed_url = urlparse(webhook_url)
+            query_params = parse_qs(parsed_url.query)
+            record_id = query_params.get('record_id', [None])[0]
+
+        response_data = {
+            "endpoint": response[1],
+            "code": response[2],
+            "id": data.get("id"),
+            "job_id": job_id,
+            "response": response[0] if response[2] == 200 else None,
+            "message": "success" if response[2] == 200 else response[0],
+            "pid": pid,
+            "queue_id": queue_id,
+            "worker_slot": slot.slot_id,
+            "run_time": round(run_time, 3),
+            "queue_time": round(queue_time, 3),
+            "total_time": round(total_time, 3),
+            "downloads": context.downloads,
+            "uploads": context.uploads,
+            "queue_length": executor.qsize(),
+            "lane": job.lane,
+            "lane_stats": job_store.lane_stats(job.lane),
+            "build_number": BUILD_NUMBER,  # Add build number to response
+            "record_id": record_id
+        }
+
+        completed_batches = job_store.finish(job_id, response[2], response_data, state=context.state)
+        metrics.record_job(job.endpoint, job_state(response[2], context), queue_time, run_time, job.tenant)
+        waiter = sync_waiters.get(job_id)
+        if waiter is not None:
+            waiter.set()
+
+        send_job_webhooks(job_store, [response_data], completed_batches)
+
+    # Pool of queue processing threads, started once all tasks are registered
+    executor = JobExecutor(process_job, job_store, workers=QUEUE_WORKERS)
+    queue_id = job_store.queue_id  # Shared by every worker in the container
+    app.executor = executor
+    # Synchronous requests of this process waiting for their job, by job ID
+    sync_waiters = {}
+
+    def processing_response(job_id, data):
+        return {
+            "code": 202,
+            "id": data.get("id"),
+            "job_id": job_id,
+            "message": "processing",
+            "pid": os.getpid(),
+            "queue_id": queue_id,
+            "queue_length": executor.qsize(),
+            "build_number": BUILD_NUMBER
+        }
+
+    def sync_response(job_id, data, headers=None):
+        """Wait up to SYNC_WAIT_TIMEOUT for a job and answer with its result, or with 202 if it's still going."""
+        waiter = sync_waiters.setdefault(job_id, threading.Event())
+        try:
+            job = wait_for_job(job_store, job_id, SYNC_WAIT_TIMEOUT, waiter)
+        finally:
+            sync_waiters.pop(job_id, None)
+        if job['finished_at'] is None:
+            # Still queued or running: the client can follow it with /v1/toolkit/job/<job_id>/events
+            return processing_response(job_id, data), 202, headers or {}
+        result = job['result'] or {"code": job['code'], "job_id": job['job_id'], "message": job['error']}
+        return result, job['code'], headers or {}
+
+    def duplicate_response(existing, data):
+        """Answer a request that duplicates `existing`, a job that is still in flight or finished successfully."""
+        headers = {"Idempotent-Replayed": "true"}
+        if existing['state'] != 'done' and 'webhook_url' not in data:
+            # A sync duplicate of an in-flight job waits for it like the original request
+            return sync_response(existing['job_id'], data, headers)
+        if existing['state'] == 'done':
+            # Same response as the original request
+            result = existing['result'] or {"code": existing['code'], "job_id": existing['job_id'], "message": existing['error']}
+            if 'webhook_url' in data and data['webhook_url'] != existing['webhook_url']:
+                send_webhook(data['webhook_url'], dict(result))
+            return result, existing['code'], headers
+        # Its webhook was attached to the in-flight job
+        return processing_response(existing['job_id'], data), 202, headers
 
     # Decorator to add tasks to the queue or bypass it
-    def queue_task(bypass_queue=False):
+    def queue_task(bypass_queue=False, deterministic=True):
         def decorator(f):
             def wrapper(*args, **kwargs):
                 job_id = str(uuid.uuid4())
@@ -68,11 +167,52 @@ def create_app():
                 pid = os.getpid()  # Get PID for non-queued tasks
                 start_time = time.time()
                 
-                if bypass_queue or 'webhook_url' not in data:
-                    
+                queued = 'webhook_url' in data
+                # Set by @authenticate from the request's API key
+                tenant = g.get('tenant') or Tenant(DEFAULT_TENANT)
+                key = None
+                if not bypass_queue:
+                    try:
+                        check_input_urls(data)
+                    except InputNotAllowed as e:
+                        return {
+                            "code": 400,
+                            "id": data.get("id"),
+                            "job_id": job_id,
+                            "message": str(e),
+                            "build_number": BUILD_NUMBER
+                        }, 400
+
+                    key = idempotency_key(request.path, data, request.headers.get('Idempotency-Key'), tenant.name,
+                                          deterministic)
+                    existing = job_store.find_duplicate(key, data.get('webhook_url'))
+                    if existing:
+                        return duplicate_response(existing, data)
+
+                    if executor.draining.is_set():
+                        rejection = Rejection(503, "Worker is shutting down", RETRY_AFTER_MIN)
+                    else:
+                        rejection = check_admission(job_store, request.path) or check_rate_limit(tenant)
+                    if rejection:
+                        metrics.inc("nca_jobs_rejected_total", endpoint=request.path, tenant=tenant.name,
+                                    code=str(rejection.code))
+                        return {
+                            "code": rejection.code,
+                            "id": data.get("id"),
+                            "job_id": job_id,
+                            "message": rejection.message,
+                            "retry_after": rejection.retry_after,
+                            "pid": pid,
+                            "queue_id": queue_id,
+                            "queue_length": executor.qsize(),
+                            "build_number": BUILD_NUMBER  # Add build number to response
+                        }, rejection.code, {"Retry-After": str(rejection.retry_after)}
+
+                if bypass_queue:
+                    # Cheap requests that are never queued, such as authentication
                     response = f(job_id=job_id, data=data, *args, **kwargs)
                     run_time = time.time() - start_time
-                    return {
+                    response_data = {
                         "code": response[2],
                         "id": data.get("id"),
                         "job_id": job_id,
@@ -83,24 +223,21 @@ def create_app():
                         "total_time": round(run_time, 3),
                         "pid": pid,
                         "queue_id": queue_id,
-                        "queue_length": task_queue.qsize(),
+                        "queue_length": executor.qsize(),
                         "build_number": BUILD_NUMBER  # Add build number to response
-                    }, response[2]
+                    }
+                    return response_data, response[2]
                 else:
-                    if MAX_QUEUE_LENGTH > 0 and task_queue.qsize() >= MAX_QUEUE_LENGTH:
-                        return {
-                            "code": 429,
-                            "id": data.get("id"),
-                            "job_id": job_id,
-                            "message": f"MAX_QUEUE_LENGTH ({MAX_QUEUE_LENGTH}) reached",
-                            "pid": pid,
-                            "queue_id": queue_id,
-                            "queue_length": task_queue.qsize(),
-                            "build_number": BUILD_NUMBER  # Add build number to response
-                        }, 429
-                    
-                    task_queue.put((job_id, data, lambda: f(job_id=job_id, data=data, *args, **kwargs), start_time))
-                    
+                    # Sync requests go through the same queue, so all jobs share the executor's slots
+                    existing = job_store.create(job_id, task_name(f), request.path, data, kwargs,
+                                                queued_at=start_time, idempotency_key=key,
+                                                tenant=tenant.name, weight=tenant.weight)
+                    if existing:
+                        return duplicate_response(existing, data)
+                    executor.notify()
+                    if not queued:
+                        return sync_response(job_id, data)
+
                     return {
                         "code": 202,
                         "id": data.get("id"),
@@ -109,7 +246,9 @@ def create_app():
                         "pid": pid,
                         "queue_id": queue_id,
                         "max_queue_length": MAX_QUEUE_LENGTH if MAX_QUEUE_LENGTH > 0 else "unlimited",
-                        "queue_length": task_queue.qsize(),
+                        "queue_length": executor.qsize(),
+                        "lane": job_lane(request.path),
+                        "lane_queue_length": job_store.queue_length(job_lane(request.path)),
                         "build_number": BUILD_NUMBER  # Add build number to response
                     }, 202
             return wrapper
@@ -117,6 +256,35 @@ def create_app():
 
     app.queue_task = queue_task
 
+    def drain(timeout=JOB_DRAIN_TIMEOUT):
+        """Shut down job processing in this worker without losing jobs.
+
+        Stops claiming jobs, gives running ones `timeout` seconds to finish,
+        then kills the child processes of the rest and hands those that
+        stopped within JOB_STOP_GRACE back to the queue for another worker.
+        Queued jobs stay in the shared job store.
+        Pending webhooks get whatever time is left, at least 5 seconds.
+        """
+        end = time.time() + timeout
+        running = executor.drain(timeout)
+        if running:
+            # Stop the jobs before releasing them, so another worker never runs
+            # a job while this one is still writing its outputs
+            for job_id in running:
+                job_control.stop_job(job_id, 'requeued')
+            # A job whose thread is still going may yet finish and record its result, so it is
+            # not released here; once this process has exited, recover() in another worker does
+            still_running = executor.drain(JOB_STOP_GRACE)
+            stopped = [job_id for job_id in running if job_id not in still_running]
+            requeued, finished, completed_batches = job_store.release(stopped)
+            app.logger.warning(f"Drain timed out, requeued {requeued} of {len(running)} running jobs, "
+                               f"{len(still_running)} still winding down")
+            send_job_webhooks(job_store, finished, completed_batches)
+        if not dispatcher.flush(max(5, end - time.time())):
+            app.logger.warning("Drain timed out with webhooks still pending")
+
+    app.drain = drain
+
     # Import blueprints
     from routes.media_to_mp3 import convert_bp
     from routes.transcribe_media import transcribe_bp
@@ -124,6 +292,7 @@ def create_app():
     from routes.audio_mixing import audio_mixing_bp
     from routes.gdrive_upload import gdrive_upload_bp
     from routes.authenticate import auth_bp
+    from routes.metrics import metrics_bp
     from routes.caption_video import caption_bp 
     from routes.extract_keyframes import extract_keyframes_bp
     from routes.image_to_video import image_to_video_bp
@@ -136,6 +305,7 @@ def create_app():
     app.register_blueprint(audio_mixing_bp)
     app.register_blueprint(gdrive_upload_bp)
     app.register_blueprint(auth_bp)
+    app.register_blueprint(metrics_bp)
     app.register_blueprint(caption_bp)
     app.register_blueprint(extract_keyframes_bp)
     app.register_blueprint(image_to_video_bp)
@@ -152,6 +322,11 @@ def create_app():
     from routes.v1.toolkit.test import v1_toolkit_test_bp
     from routes.v1.toolkit.authenticate import v1_toolkit_auth_bp
     from routes.v1.code.execute.execute_python import v1_code_execute_bp
+    from routes.v1.toolkit.queue_status import v1_toolkit_queue_status_bp
+    from routes.v1.toolkit.job_status import v1_toolkit_job_status_bp
+    from routes.v1.toolkit.job_cancel import v1_toolkit_job_cancel_bp
+    from routes.v1.toolkit.job_events import v1_toolkit_job_events_bp
+    from routes.v1.toolkit.batch import v1_toolkit_batch_bp
 
     app.register_blueprint(v1_ffmpeg_compose_bp)
     app.register_blueprint(v1_media_transcribe_bp)
@@ -162,6 +337,25 @@ def create_app():
     app.register_blueprint(v1_toolkit_test_bp)
     app.register_blueprint(v1_toolkit_auth_bp)
     app.register_blueprint(v1_code_execute_bp)
+    app.register_blueprint(v1_toolkit_queue_status_bp)
+    app.register_blueprint(v1_toolkit_job_status_bp)
+    app.register_blueprint(v1_toolkit_job_cancel_bp)
+    app.register_blueprint(v1_toolkit_job_events_bp)
+    app.register_blueprint(v1_toolkit_batch_bp)
+
+    # Endpoints that /v1/toolkit/batch can submit requests to
+    app.queued_endpoints = queued_endpoints(app)
+
+    # Requeue jobs left running by a worker that exited before finishing them
+    job_store.purge()
+    _, finished, completed_batches = job_store.recover()
+    send_job_webhooks(job_store, finished, completed_batches)
+    executor.start()
+
+    # Enforce job timeouts and cancellations; Whisper is imported by now
+    job_control.install_whisper_hook()
+    job_control.start_watchdog(job_store)
+    scratch.start_janitor(job_store)
 
     return app
 
@@ -1,8 +1,24 @@
-from flask import request, jsonify, current_app
+from flask import request, jsonify, current_app, g
 from functools import wraps
 import jsonschema
+from services.tenants import owns
+
+# Scheduling options accepted by every queued endpoint in addition to its own payload
+JOB_OPTIONS_SCHEMA = {
+    "priority": {"type": "integer", "minimum": 0, "maximum": 10},
+    "deadline": {"type": "number", "exclusiveMinimum": 0},
+    "timeout": {"type": "number", "exclusiveMinimum": 0}
+}
+
+def with_job_options(schema):
+    """Add the job options to the schema of a queued endpoint (one that accepts a webhook_url)."""
+    properties = schema.get("properties", {})
+    if "webhook_url" not in properties:
+        return schema
+    return dict(schema, properties=dict(JOB_OPTIONS_SCHEMA, **properties))
 
 def validate_payload(schema):
+    schema = with_job_options(schema)
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
@@ -14,12 +30,56 @@ def validate_payload(schema):
                 return jsonify({"message": f"Invalid payload: {validation_error.message}"}), 400
             
             return f(*args, **kwargs)
+        decorated_function.schema = schema
         return decorated_function
     return decorator
 
-def queue_task_wrapper(bypass_queue=False):
+# Task functions by name, so jobs persisted in the job store can be rebuilt after a restart
+TASKS = {}
+
+def task_name(f):
+    return f"{f.__module__}.{f.__name__}"
+
+def queue_task_wrapper(bypass_queue=False, deterministic=True):
+    """Run an endpoint as a queued job. Set `deterministic=False` for endpoints whose result
+    isn't fully determined by their payload; requests to them are never deduplicated by payload."""
     def decorator(f):
+        TASKS[task_name(f)] = f
         def wrapper(*args, **kwargs):
-            return current_app.queue_task(bypass_queue=bypass_queue)(f)(*args, **kwargs)
+            return current_app.queue_task(bypass_queue=bypass_queue, deterministic=deterministic)(f)(*args, **kwargs)
+        if not bypass_queue:
+            wrapper.task = f
+            wrapper.deterministic = deterministic
         return wrapper
-    return decorator
\ No newline at end of file
+    return decorator
+
+class QueuedEndpoint:
+    """A registered endpoint whose requests run as queued jobs, with its compiled payload validator."""
+    def __init__(self, path, task, schema, deterministic=True):
+        self.path = path
+        self.task = task
+        self.deterministic = deterministic
+        self.validator = jsonschema.validators.validator_for(schema)(schema)
+
+def queued_endpoints(app):
+    """Every POST endpoint of `app` that validates its payload and queues a task, by URL path."""
+    endpoints = {}
+    for rule in app.url_map.iter_rules():
+        view = app.view_functions[rule.endpoint]
+        if 'POST' in rule.methods and not rule.arguments and hasattr(view, 'task') and hasattr(view, 'schema'):
+            endpoints[rule.rule] = QueuedEndpoint(rule.rule, view.task, view.schema, getattr(view, 'deterministic', True))
+    return endpoints
+
+def tenant_job(job_id):
+    """The job `job_id` if the tenant of the current request submitted it, else None.
+
+    Jobs of other tenants are answered exactly like jobs that don't exist,
+    so a tenant can neither read them nor find out which IDs are taken.
+    """
+    job = current_app.job_store.get(job_id)
+    if job is None or not owns(g.tenant, job):
+        return None
+    return job
+
+def job_not_found(job_id):
+    return jsonify({"code": 404, "job_id": job_id, "message": "Job not found"}), 404
@@ -2,7 +2,9 @@ import os
 
 # Retrieve the API key from environment variables
 API_KEY = os.environ.get('API_KEY')
-if not API_KEY:
+# More keys, each with its own tenant name, scheduling weight and rate limit (see services/tenants.py)
+API_KEYS = os.environ.get('API_KEYS', '')
+if not API_KEY and not API_KEYS:
     raise ValueError("API_KEY environment variable is not set")
 
 # GCP environment variables
@@ -0,0 +1,19 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Anything created at import time, like the app's job store, goes to a throwaway directory too
+os.environ.setdefault('JOB_DB_PATH', os.path.join(tempfile.mkdtemp(), 'jobs.db'))
+
+# Add the current directory to the Python path
+sys.path.append('.')
+
+from services import metrics, scratch
+
+@pytest.fixture(autouse=True)
+def job_sandbox(tmp_path, monkeypatch):
+    """Keep job workspaces and metrics of every test out of the real /tmp/jobs and /tmp/jobs.db."""
+    monkeypatch.setattr(scratch, 'SCRATCH_PATH', str(tmp_path / 'jobs'))
+    monkeypatch.setattr(metrics, '_store', metrics.MetricsStore(str(tmp_path / 'jobs.db')))
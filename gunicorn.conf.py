@@ -0,0 +1,18 @@
+# Picked up automatically by gunicorn from the working directory.
+import os
+
+# Seconds a worker may spend finishing its running jobs after SIGTERM (see app.drain)
+JOB_DRAIN_TIMEOUT = int(os.environ.get('JOB_DRAIN_TIMEOUT', 60))
+
+# Leave room for handing unfinished jobs back to the queue and flushing webhooks
+graceful_timeout = JOB_DRAIN_TIMEOUT + 15
+
+# Runs in the worker process once it has stopped accepting requests. The
+# worker's heartbeat has stopped by then, so gunicorn's --timeout must be
+# longer than JOB_DRAIN_TIMEOUT too.
+def worker_exit(server, worker):
+    app = getattr(worker, 'wsgi', None)
+    if app is None or not hasattr(app, 'drain'):
+        return
+    server.log.info(f"Worker {worker.pid}: draining jobs for up to {JOB_DRAIN_TIMEOUT}s")
+    app.drain(JOB_DRAIN_TIMEOUT)
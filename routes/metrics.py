@@ -0,0 +1,10 @@
+from flask import Blueprint, Response, current_app
+from services.authentication import authenticate
+from services.metrics import render
+
+metrics_bp = Blueprint('metrics', __name__)
+
+@metrics_bp.route('/metrics', methods=['GET'])
+@authenticate
+def metrics_endpoint():
+    return Response(render(current_app.job_store), mimetype='text/plain; version=0.0.4')
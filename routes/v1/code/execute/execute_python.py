@@ -3,6 +3,7 @@ import logging
 from flask import Blueprint, request
 from services.authentication import authenticate
 from app_utils import validate_payload, queue_task_wrapper
+from services.job_control import run_subprocess
 import subprocess
 import tempfile
 import json
@@ -24,7 +25,8 @@ logger = logging.getLogger(__name__)
     "required": ["code"],
     "additionalProperties": False
 })
-@queue_task_wrapper(bypass_queue=False)
+# Scripts may read the clock, the network or random numbers, so a rerun is a new run
+@queue_task_wrapper(bypass_queue=False, deterministic=False)
 def execute_python(job_id, data):
     logger.info(f"Job {job_id}: Received Python code execution request")
     
@@ -77,7 +79,7 @@ print(json.dumps(result))
             logger.debug(f"Generated code:\n{final_code}")
             
             try:
-                result = subprocess.run(
+                result = run_subprocess(
                     ['python3', temp_file.name],
                     capture_output=True,
                     text=True,
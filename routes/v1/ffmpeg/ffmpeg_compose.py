@@ -1,11 +1,11 @@
 import os
 import logging
-import subprocess
 from flask import Blueprint, request, jsonify
 from app_utils import *
 from services.v1.ffmpeg.ffmpeg_compose import process_ffmpeg_compose
 from services.authentication import authenticate
 from services.cloud_storage import upload_file
+from services.job_control import run_subprocess
 
 v1_ffmpeg_compose_bp = Blueprint('v1_ffmpeg_compose', __name__)
 logger = logging.getLogger(__name__)
@@ -107,7 +107,7 @@ def ffmpeg_api(job_id, data):
 
         # Execute the FFmpeg command and log outputs
         try:
-            result = subprocess.run(ffmpeg_command, capture_output=True, text=True)
+            result = run_subprocess(ffmpeg_command, capture_output=True, text=True)
             logger.debug(f"Job {job_id}: FFmpeg Output: {result.stdout}")
             logger.debug(f"Job {job_id}: FFmpeg Error: {result.stderr}")
         except Exception as ffmpeg_error:
@@ -4,6 +4,7 @@ import logging
 from services.v1.image.transform.image_to_video import process_image_to_video
 from services.authentication import authenticate
 from services.cloud_storage import upload_file
+from services.result_cache import cache_result
 
 v1_image_transform_video_bp = Blueprint('v1_image_transform_video', __name__)
 logger = logging.getLogger(__name__)
@@ -24,6 +25,7 @@ logger = logging.getLogger(__name__)
     "additionalProperties": False
 })
 @queue_task_wrapper(bypass_queue=False)
+@cache_result(url_fields=['image_url'], defaults={'length': 5, 'frame_rate': 30, 'zoom_speed': 3})
 def image_to_video(job_id, data):
     image_url = data.get('image_url')
     length = data.get('length', 5)
@@ -5,6 +5,7 @@ import logging
 from services.v1.media.transform.media_to_mp3 import process_media_to_mp3
 from services.authentication import authenticate
 from services.cloud_storage import upload_file
+from services.result_cache import cache_result
 import os
 
 v1_media_transform_mp3_bp = Blueprint('v1_media_transform', __name__)
@@ -24,6 +25,7 @@ logger = logging.getLogger(__name__)
     "additionalProperties": False
 })
 @queue_task_wrapper(bypass_queue=False)
+@cache_result(url_fields=['media_url'], defaults={'bitrate': '128k'})
 def convert_media_to_mp3(job_id, data):
     media_url = data['media_url']
     webhook_url = data.get('webhook_url')
@@ -0,0 +1,121 @@
+import os
+import uuid
+from flask import Blueprint, request, jsonify, current_app, g
+from jsonschema.exceptions import best_match
+from app_utils import validate_payload, task_name, JOB_OPTIONS_SCHEMA
+from services.authentication import authenticate
+from services.admission import check_admission, check_rate_limit, Rejection, RETRY_AFTER_MIN
+from services.batch import batch_result, send_batch_webhook, WEBHOOK_MODES
+from services.idempotency import idempotency_key
+from services.file_management import check_input_urls, InputNotAllowed
+from services.tenants import Tenant, DEFAULT_TENANT, owns
+from services import metrics
+from version import BUILD_NUMBER
+
+v1_toolkit_batch_bp = Blueprint('v1_toolkit_batch', __name__)
+
+BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', 1000))
+
+@v1_toolkit_batch_bp.route('/v1/toolkit/batch', methods=['POST'])
+@authenticate
+@validate_payload({
+    "type": "object",
+    "properties": {
+        "requests": {
+            "type": "array",
+            "minItems": 1,
+            "maxItems": BATCH_MAX_SIZE,
+            "items": {
+                "type": "object",
+                "properties": {
+                    "endpoint": {"type": "string"},
+                    "payload": {"type": "object"}
+                },
+                "required": ["endpoint", "payload"],
+                "additionalProperties": False
+            }
+        },
+        "webhook_url": {"type": "string", "format": "uri"},
+        "webhook_mode": {"type": "string", "enum": list(WEBHOOK_MODES)},
+        "id": {"type": "string"}
+    },
+    "required": ["requests"],
+    "additionalProperties": False
+})
+def batch_submit():
+    data = request.json
+    job_store = current_app.job_store
+    tenant = g.get('tenant') or Tenant(DEFAULT_TENANT)
+    batch_id = str(uuid.uuid4())
+    webhook_mode = data.get('webhook_mode', 'batch')
+    header = request.headers.get('Idempotency-Key')
+
+    jobs = []
+    for index, item in enumerate(data['requests']):
+        endpoint = current_app.queued_endpoints.get(item['endpoint'])
+        if endpoint is None:
+            return jsonify({"message": f"Invalid payload: requests[{index}] has unknown endpoint {item['endpoint']}"}), 400
+        payload = dict(item['payload'])
+        allowed = endpoint.validator.schema.get('properties', {})
+        # Batch-wide scheduling options apply to items that don't set their own
+        for option in JOB_OPTIONS_SCHEMA:
+            if option in data and option in allowed:
+                payload.setdefault(option, data[option])
+        if webhook_mode != 'batch' and 'webhook_url' in data and 'webhook_url' in allowed:
+            payload.setdefault('webhook_url', data['webhook_url'])
+        error = best_match(endpoint.validator.iter_errors(payload))
+        if error is not None:
+            return jsonify({"message": f"Invalid payload: requests[{index}]: {error.message}"}), 400
+        try:
+            check_input_urls(payload)
+        except InputNotAllowed as e:
+            return jsonify({"message": f"Invalid payload: requests[{index}]: {str(e)}"}), 400
+        jobs.append({
+            "job_id": str(uuid.uuid4()),
+            "task": task_name(endpoint.task),
+            "endpoint": endpoint.path,
+            "data": payload,
+            "idempotency_key": idempotency_key(endpoint.path, payload, f"{header}:{index}" if header else None, tenant.name,
+                                              endpoint.deterministic)
+        })
+
+    if current_app.executor.draining.is_set():
+        rejection = Rejection(503, "Worker is shutting down", RETRY_AFTER_MIN)
+    else:
+        # The whole batch is admitted at once, so its jobs' costs add up
+        rejection = check_admission(job_store, [job['endpoint'] for job in jobs]) or check_rate_limit(tenant, len(jobs))
+    if rejection:
+        metrics.inc("nca_jobs_rejected_total", endpoint=request.path, tenant=tenant.name, code=str(rejection.code))
+        return jsonify({
+            "code": rejection.code,
+            "id": data.get("id"),
+            "message": rejection.message,
+            "retry_after": rejection.retry_after,
+            "build_number": BUILD_NUMBER
+        }), rejection.code, {"Retry-After": str(rejection.retry_after)}
+
+    batch_data = {k: v for k, v in data.items() if k != 'requests'}
+    job_ids = job_store.create_batch(batch_id, batch_data, jobs, tenant=tenant.name, weight=tenant.weight)
+    current_app.executor.notify()
+    # Every item may be a duplicate of a job that is already done
+    if job_store.complete_batch(batch_id):
+        send_batch_webhook(job_store, batch_id)
+
+    return jsonify({
+        "code": 202,
+        "id": data.get("id"),
+        "batch_id": batch_id,
+        "job_ids": job_ids,
+        "message": "processing",
+        "total": len(job_ids),
+        "queue_length": current_app.executor.qsize(),
+        "build_number": BUILD_NUMBER
+    }), 202
+
+@v1_toolkit_batch_bp.route('/v1/toolkit/batch/<batch_id>', methods=['GET'])
+@authenticate
+def batch_status(batch_id):
+    batch = current_app.job_store.batch(batch_id)
+    if batch is None or not owns(g.tenant, batch):
+        return jsonify({"code": 404, "batch_id": batch_id, "message": "Batch not found"}), 404
+    return jsonify(batch_result(batch)), 200
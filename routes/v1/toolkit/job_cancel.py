@@ -0,0 +1,63 @@
+import time
+from flask import Blueprint, request, jsonify, current_app
+from app_utils import validate_payload, tenant_job, job_not_found
+from services.authentication import authenticate
+from services.batch import send_job_webhooks
+from version import BUILD_NUMBER
+
+v1_toolkit_job_cancel_bp = Blueprint('v1_toolkit_job_cancel', __name__)
+
+@v1_toolkit_job_cancel_bp.route('/v1/toolkit/job/cancel', methods=['POST'])
+@authenticate
+@validate_payload({
+    "type": "object",
+    "properties": {
+        "job_id": {"type": "string"}
+    },
+    "required": ["job_id"],
+    "additionalProperties": False
+})
+def job_cancel():
+    job_id = request.json['job_id']
+    job_store = current_app.job_store
+    job = job_store.cancel(job_id) if tenant_job(job_id) is not None else None
+    if job is None:
+        return job_not_found(job_id)
+
+    if job['state'] == 'queued':
+        # Never started, so nobody else will report it: send the webhook from here
+        total_time = time.time() - job['queued_at']
+        response_data = {
+            "endpoint": job['endpoint'],
+            "code": 499,
+            "id": job['data'].get('id'),
+            "job_id": job_id,
+            "response": None,
+            "message": "cancelled",
+            "run_time": 0,
+            "queue_time": round(total_time, 3),
+            "total_time": round(total_time, 3),
+            "build_number": BUILD_NUMBER
+        }
+        completed_batches = job_store.finish(job_id, 499, response_data, state='cancelled')
+        send_job_webhooks(job_store, [response_data], completed_batches)
+        state = 'cancelled'
+    elif job['state'] == 'running':
+        # The worker running the job stops it and sends the webhook
+        state = 'cancelling'
+    else:
+        return jsonify({
+            "code": 409,
+            "job_id": job_id,
+            "state": job['state'],
+            "message": "Job has already finished"
+        }), 409
+
+    return jsonify({
+        "code": 200,
+        "job_id": job_id,
+        "id": job['data'].get('id'),
+        "endpoint": job['endpoint'],
+        "state": state,
+        "build_number": BUILD_NUMBER
+    }), 200
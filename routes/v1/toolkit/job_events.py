@@ -0,0 +1,91 @@
+import json
+import time
+from flask import Blueprint, Response, request, jsonify, current_app
+from app_utils import tenant_job, job_not_found
+from services.authentication import authenticate
+from services.job_store import TERMINAL_STATES
+from version import BUILD_NUMBER
+
+v1_toolkit_job_events_bp = Blueprint('v1_toolkit_job_events', __name__)
+
+# Seconds between job store lookups while waiting for a change
+POLL_INTERVAL = 0.5
+# Longest a long-poll request waits for a change
+MAX_WAIT = 30
+# An event stream is closed after this many seconds; clients reconnect with Last-Event-ID.
+# Every open stream holds a gunicorn worker, so streams are kept short.
+STREAM_DURATION = 60
+# Seconds between comment lines that keep proxies from closing an idle stream
+HEARTBEAT_INTERVAL = 15
+
+def job_event(job):
+    """Current progress of a job; includes its result once it has finished."""
+    event = {
+        "job_id": job['job_id'],
+        "id": job['data'].get('id'),
+        "endpoint": job['endpoint'],
+        "state": job['state'],
+        "stage": job['stage'],
+        "progress": job['progress'],
+        "updated_at": max(t for t in (job['queued_at'], job['started_at'], job['updated_at'], job['finished_at']) if t)
+    }
+    if job['state'] in TERMINAL_STATES:
+        event["result"] = job['result']
+    return event
+
+def parse_since(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0
+
+@v1_toolkit_job_events_bp.route('/v1/toolkit/job/<job_id>/events', methods=['GET'])
+@authenticate
+def job_events(job_id):
+    job_store = current_app.job_store
+    job = tenant_job(job_id)
+    if job is None:
+        return job_not_found(job_id)
+
+    if 'text/event-stream' in request.headers.get('Accept', ''):
+        since = parse_since(request.headers.get('Last-Event-ID') or request.args.get('since'))
+        return Response(event_stream(job_store, job_id, since), mimetype='text/event-stream',
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    # Long polling: answer as soon as the job changes after `since`, or when `wait` runs out
+    since = parse_since(request.args.get('since'))
+    try:
+        wait = min(max(float(request.args.get('wait', 0)), 0), MAX_WAIT)
+    except ValueError:
+        wait = 0
+    end = time.time() + wait
+    event = job_event(job)
+    while event['updated_at'] <= since and event['state'] not in TERMINAL_STATES and time.time() < end:
+        time.sleep(POLL_INTERVAL)
+        job = job_store.get(job_id)
+        if job is None:
+            return job_not_found(job_id)
+        event = job_event(job)
+    return jsonify(dict(event, code=200, build_number=BUILD_NUMBER)), 200
+
+def event_stream(job_store, job_id, since):
+    """Server-sent events for every change of a job until it finishes or STREAM_DURATION runs out."""
+    end = time.time() + STREAM_DURATION
+    last_sent = time.time()
+    yield f"retry: {int(POLL_INTERVAL * 2000)}\n\n"
+    while time.time() < end:
+        job = job_store.get(job_id)
+        if job is None:
+            return
+        event = job_event(job)
+        finished = event['state'] in TERMINAL_STATES
+        if event['updated_at'] > since or finished:
+            since = event['updated_at']
+            last_sent = time.time()
+            yield f"id: {since}\nevent: {'done' if finished else 'progress'}\ndata: {json.dumps(event, default=str)}\n\n"
+            if finished:
+                return
+        elif time.time() - last_sent >= HEARTBEAT_INTERVAL:
+            last_sent = time.time()
+            yield ": keep-alive\n\n"
+        time.sleep(POLL_INTERVAL)
@@ -0,0 +1,38 @@
+from flask import Blueprint, request, jsonify
+from app_utils import validate_payload, tenant_job, job_not_found
+from services.authentication import authenticate
+from version import BUILD_NUMBER
+
+v1_toolkit_job_status_bp = Blueprint('v1_toolkit_job_status', __name__)
+
+@v1_toolkit_job_status_bp.route('/v1/toolkit/job/status', methods=['POST'])
+@authenticate
+@validate_payload({
+    "type": "object",
+    "properties": {
+        "job_id": {"type": "string"}
+    },
+    "required": ["job_id"],
+    "additionalProperties": False
+})
+def job_status():
+    job_id = request.json['job_id']
+    job = tenant_job(job_id)
+    if job is None:
+        return job_not_found(job_id)
+
+    return jsonify({
+        "code": 200,
+        "job_id": job_id,
+        "id": job['data'].get('id'),
+        "endpoint": job['endpoint'],
+        "state": job['state'],
+        "stage": job['stage'],
+        "progress": job['progress'],
+        "queued_at": job['queued_at'],
+        "started_at": job['started_at'],
+        "finished_at": job['finished_at'],
+        "result": job['result'],
+        "error": job['error'],
+        "build_number": BUILD_NUMBER
+    }), 200
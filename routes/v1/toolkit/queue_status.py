@@ -0,0 +1,24 @@
+import os
+from flask import Blueprint, jsonify, current_app, g
+from services.authentication import authenticate
+from services.tenants import DEFAULT_TENANT
+from services.webhook import dispatcher
+from version import BUILD_NUMBER
+
+v1_toolkit_queue_status_bp = Blueprint('v1_toolkit_queue_status', __name__)
+
+@v1_toolkit_queue_status_bp.route('/v1/toolkit/queue/status', methods=['GET'])
+@authenticate
+def queue_status():
+    stats = current_app.executor.stats()
+    # Only the caller's own tenant: other tenants' names and loads are theirs
+    tenants = {name or DEFAULT_TENANT: tenant_stats for name, tenant_stats in current_app.job_store.tenant_stats().items()
+               if (name or DEFAULT_TENANT) == g.tenant.name}
+    stats.update({
+        "webhooks": dispatcher.stats(),
+        "tenants": tenants,
+        "pid": os.getpid(),
+        "queue_id": current_app.job_store.queue_id,
+        "build_number": BUILD_NUMBER
+    })
+    return jsonify(stats), 200
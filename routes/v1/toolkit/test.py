@@ -3,13 +3,12 @@ import logging
 from flask import Blueprint
 from services.authentication import authenticate
 from services.cloud_storage import upload_file
+from services.job_control import scratch_dir
 from app_utils import queue_task_wrapper
 
 v1_toolkit_test_bp = Blueprint('v1_toolkit_test', __name__)
 logger = logging.getLogger(__name__)
 
-STORAGE_PATH = "/tmp/"
-
 @v1_toolkit_test_bp.route('/v1/toolkit/test', methods=['GET'])
 @authenticate
 @queue_task_wrapper(bypass_queue=False)
@@ -18,7 +17,7 @@ def test_api(job_id, data):
     
     try:
         # Create test file
-        test_filename = os.path.join(STORAGE_PATH, "success.txt")
+        test_filename = os.path.join(scratch_dir(), "success.txt")
         with open(test_filename, 'w') as f:
             f.write("You have successfully installed the NCA Toolkit API, great job!")
         
@@ -4,6 +4,7 @@ import logging
 from services.v1.video.caption_video import process_captioning_v1
 from services.authentication import authenticate
 from services.cloud_storage import upload_file
+from services.result_cache import cache_result
 import os
 import requests  # Ensure requests is imported for webhook handling
 
@@ -75,6 +76,7 @@ logger = logging.getLogger(__name__)
     "additionalProperties": False
 })
 @queue_task_wrapper(bypass_queue=False)
+@cache_result(url_fields=['video_url', 'captions'], defaults={'settings': {}, 'replace': [], 'language': 'auto'})
 def caption_video_v1(job_id, data):
     video_url = data['video_url']
     captions = data.get('captions')
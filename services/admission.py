@@ -0,0 +1,147 @@
+import os
+import json
+import math
+import logging
+import psutil
+from services.rate_limit import get_limiter
+from services import scratch
+
+logger = logging.getLogger(__name__)
+
+STORAGE_PATH = os.environ.get('STORAGE_PATH', '/tmp/')
+MAX_QUEUE_LENGTH = int(os.environ.get('MAX_QUEUE_LENGTH', 0))
+MIN_FREE_DISK_MB = int(os.environ.get('MIN_FREE_DISK_MB', 1024))
+MIN_FREE_MEMORY_MB = int(os.environ.get('MIN_FREE_MEMORY_MB', 512))
+MAX_LOAD_PER_CPU = float(os.environ.get('MAX_LOAD_PER_CPU', 0))
+RETRY_AFTER_MIN = int(os.environ.get('RETRY_AFTER_MIN', 5))
+RETRY_AFTER_MAX = int(os.environ.get('RETRY_AFTER_MAX', 600))
+
+# Rough scratch disk and memory a single job of each endpoint needs while it runs, in MB
+ENDPOINT_COSTS = {
+    '/v1/toolkit/test': {"disk_mb": 1, "memory_mb": 50},
+    '/v1/code/execute/python': {"disk_mb": 10, "memory_mb": 200},
+    '/v1/media/transform/mp3': {"disk_mb": 500, "memory_mb": 200},
+    '/media-to-mp3': {"disk_mb": 500, "memory_mb": 200},
+    '/extract-keyframes': {"disk_mb": 1000, "memory_mb": 300},
+    '/v1/image/transform/video': {"disk_mb": 500, "memory_mb": 1500},
+    '/image-to-video': {"disk_mb": 500, "memory_mb": 1500},
+    '/v1/video/concatenate': {"disk_mb": 4000, "memory_mb": 300},
+    '/combine-videos': {"disk_mb": 4000, "memory_mb": 300},
+    '/audio-mixing': {"disk_mb": 2000, "memory_mb": 300},
+    '/v1/ffmpeg/compose': {"disk_mb": 4000, "memory_mb": 1000},
+    '/gdrive-upload': {"disk_mb": 0, "memory_mb": 200},
+    '/v1/media/transcribe': {"disk_mb": 1000, "memory_mb": 2000},
+    '/transcribe-media': {"disk_mb": 1000, "memory_mb": 2000},
+    '/v1/video/caption': {"disk_mb": 2000, "memory_mb": 2500},
+    '/caption-video': {"disk_mb": 2000, "memory_mb": 2500},
+}
+ENDPOINT_COSTS.update(json.loads(os.environ.get('ENDPOINT_COSTS', '{}')))
+DEFAULT_ENDPOINT_COST = {"disk_mb": 1000, "memory_mb": 500}
+# Jobs the container runs at once: every gunicorn worker runs QUEUE_WORKERS of them
+JOB_SLOTS = int(os.environ.get('GUNICORN_WORKERS', 2)) * int(os.environ.get('QUEUE_WORKERS', 1))
+
+class Rejection:
+    """Why a job was not admitted, and when the client should try again."""
+    def __init__(self, code, message, retry_after):
+        self.code = code
+        self.message = message
+        self.retry_after = retry_after
+
+def endpoint_cost(endpoint):
+    return dict(DEFAULT_ENDPOINT_COST, **ENDPOINT_COSTS.get(endpoint, {}))
+
+def retry_after(job_store, jobs_ahead=1):
+    """Estimate the seconds until `jobs_ahead` running or queued jobs have finished."""
+    average_run_time = job_store.average_run_time() or RETRY_AFTER_MIN
+    parallelism = max(1, job_store.running_count())
+    estimate = math.ceil(average_run_time * jobs_ahead / parallelism)
+    return min(RETRY_AFTER_MAX, max(RETRY_AFTER_MIN, estimate))
+
+def pending_cost(job_store, endpoints):
+    """Estimated disk and memory, in MB, that jobs will take before the ones queued now are done.
+
+    Queued jobs, including the new ones for `endpoints`, take nothing until a
+    slot starts them, and at most the free slots start at once. So for each
+    resource, the most expensive of them are charged, one per free slot.
+    Running jobs are charged their disk cost less the scratch space all
+    workspaces already take, since that part shows up in the free disk
+    space; their memory is in use already and is not counted again.
+    """
+    waiting = [endpoint_cost(path) for path in endpoints]
+    running = 0
+    running_disk_mb = 0
+    for lane, counts in job_store.active_counts().items():
+        cost = endpoint_cost(lane)
+        waiting.extend([cost] * counts["queued"])
+        running += counts["running"]
+        running_disk_mb += cost["disk_mb"] * counts["running"]
+    free_slots = max(0, JOB_SLOTS - running)
+    pending = {resource: sum(sorted((c[resource] for c in waiting), reverse=True)[:free_slots])
+               for resource in ("disk_mb", "memory_mb")}
+    scratch_mb = scratch.scratch_usage() / (1024 * 1024)
+    pending["disk_mb"] += max(0, running_disk_mb - scratch_mb)
+    return pending
+
+def check_admission(job_store, endpoint, queued=True):
+    """Return a Rejection if new jobs for `endpoint` should not be accepted right now, else None.
+
+    `endpoint` is the path of a single job, or the list of the paths of
+    every job of a batch. Queued jobs are limited by MAX_QUEUE_LENGTH. The
+    jobs that can start next, among those queued and the new ones, must
+    leave MIN_FREE_DISK_MB of disk under STORAGE_PATH and MIN_FREE_MEMORY_MB
+    of memory free after their estimated cost (see pending_cost), the new
+    jobs' summed cost must fit in SCRATCH_QUOTA_MB next to the workspaces of
+    running jobs, and the load average per CPU must be under
+    MAX_LOAD_PER_CPU. Zero disables the limits of SCRATCH_QUOTA_MB and
+    MAX_LOAD_PER_CPU.
+    """
+    endpoints = [endpoint] if isinstance(endpoint, str) else list(endpoint)
+    jobs = len(endpoints)
+    name = ", ".join(sorted(set(endpoints)))
+    if jobs > 1:
+        name = f"{jobs} jobs of {name}"
+
+    if queued and MAX_QUEUE_LENGTH > 0:
+        queue_length = job_store.queue_length()
+        if queue_length + jobs > MAX_QUEUE_LENGTH:
+            return Rejection(429, f"MAX_QUEUE_LENGTH ({MAX_QUEUE_LENGTH}) reached",
+                             retry_after(job_store, queue_length + jobs - MAX_QUEUE_LENGTH))
+
+    costs = [endpoint_cost(path) for path in endpoints]
+    cost = {"disk_mb": sum(c["disk_mb"] for c in costs), "memory_mb": sum(c["memory_mb"] for c in costs)}
+
+    if scratch.SCRATCH_QUOTA_MB > 0:
+        scratch_mb = scratch.scratch_usage() / (1024 * 1024)
+        if scratch_mb + cost["disk_mb"] > scratch.SCRATCH_QUOTA_MB:
+            logger.warning(f"Rejecting {name}: {scratch_mb:.0f} MB of scratch space in use, jobs need {cost['disk_mb']} MB")
+            return Rejection(503, f"SCRATCH_QUOTA_MB ({scratch.SCRATCH_QUOTA_MB}) reached", retry_after(job_store))
+
+    pending = pending_cost(job_store, endpoints)
+
+    free_disk_mb = psutil.disk_usage(STORAGE_PATH).free / (1024 * 1024)
+    if free_disk_mb - pending["disk_mb"] < MIN_FREE_DISK_MB:
+        logger.warning(f"Rejecting {name}: {free_disk_mb:.0f} MB free under {STORAGE_PATH}, "
+                       f"jobs starting next need {pending['disk_mb']:.0f} MB")
+        return Rejection(503, f"Insufficient disk space under {STORAGE_PATH}", retry_after(job_store))
+
+    available_memory_mb = psutil.virtual_memory().available / (1024 * 1024)
+    if available_memory_mb - pending["memory_mb"] < MIN_FREE_MEMORY_MB:
+        logger.warning(f"Rejecting {name}: {available_memory_mb:.0f} MB memory available, "
+                       f"jobs starting next need {pending['memory_mb']:.0f} MB")
+        return Rejection(503, "Insufficient memory", retry_after(job_store))
+
+    if MAX_LOAD_PER_CPU > 0:
+        load_per_cpu = psutil.getloadavg()[0] / (psutil.cpu_count() or 1)
+        if load_per_cpu > MAX_LOAD_PER_CPU:
+            return Rejection(429, f"Server load ({load_per_cpu:.2f} per CPU) above MAX_LOAD_PER_CPU ({MAX_LOAD_PER_CPU})",
+                             retry_after(job_store))
+
+    return None
+
+def check_rate_limit(tenant, jobs=1):
+    """Return a Rejection if the tenant has used up its rate limit, else None."""
+    wait = get_limiter().take(tenant, jobs)
+    if wait:
+        return Rejection(429, f"Rate limit of API key {tenant.name} exceeded ({tenant.rate:g} jobs per second)",
+                         max(1, math.ceil(wait)))
+    return None
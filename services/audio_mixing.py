@@ -1,18 +1,17 @@
 import os
-import subprocess
-from services.file_management import download_file
-
-STORAGE_PATH = "/tmp/"
+from services.file_management import download_files
+from services.job_control import run_subprocess, scratch_dir
+from services.media_probe import probe, ProbeError
 
 def get_duration(file_path):
-    cmd = ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1', file_path]
-    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-    return float(result.stdout)
+    duration = probe(file_path).duration
+    if duration is None:
+        raise ProbeError(f"Cannot determine the duration of {file_path}")
+    return duration
 
 def process_audio_mixing(video_url, audio_url, video_vol, audio_vol, output_length, job_id, webhook_url=None):
-    video_path = download_file(video_url, STORAGE_PATH)
-    audio_path = download_file(audio_url, STORAGE_PATH)
-    output_path = os.path.join(STORAGE_PATH, f"{job_id}.mp4")
+    video_path, audio_path = download_files([video_url, audio_url], scratch_dir())
+    output_path = os.path.join(scratch_dir(), f"{job_id}.mp4")
 
     video_duration = get_duration(video_path)
     audio_duration = get_duration(audio_path)
@@ -57,7 +56,7 @@ def process_audio_mixing(video_url, audio_url, video_vol, audio_vol, output_leng
     cmd.append(output_path)
 
     # Run FFmpeg command
-    subprocess.run(cmd, check=True)
+    run_subprocess(cmd, check=True)
 
     # Clean up input files
     os.remove(video_path)
@@ -1,13 +1,14 @@
 from functools import wraps
-from flask import request, jsonify
-from config import API_KEY
+from flask import request, jsonify, g
+from services.tenants import tenant_for_key
 
 def authenticate(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
-        api_key = request.headers.get('X-API-Key')
+        tenant = tenant_for_key(request.headers.get('X-API-Key'))
         
-        if api_key != API_KEY:
+        if tenant is None:
             return jsonify({"message": "Unauthorized"}), 401
+        g.tenant = tenant
         return func(*args, **kwargs)
     return wrapper
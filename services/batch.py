@@ -0,0 +1,64 @@
+import logging
+from services.job_store import TERMINAL_STATES
+from services.webhook import send_webhook
+from version import BUILD_NUMBER
+
+logger = logging.getLogger(__name__)
+
+# Where the results of a batch are sent: one aggregated webhook, one per item, or both
+WEBHOOK_MODES = ('batch', 'items', 'both')
+
+def batch_result(batch):
+    """Aggregated state of a batch, with the outcome of every finished item."""
+    items = []
+    succeeded = failed = 0
+    for index, job in enumerate(batch['jobs']):
+        item = {"index": index, "job_id": job['job_id'], "state": job['state']}
+        if job['state'] is not None:
+            item.update(id=job['data'].get('id'), endpoint=job['endpoint'])
+        if job['state'] in TERMINAL_STATES:
+            result = job['result'] or {}
+            item.update(code=job['code'], response=result.get('response'), message=result.get('message', job['error']))
+            if job['code'] == 200:
+                succeeded += 1
+            else:
+                failed += 1
+        items.append(item)
+    finished = batch['finished_at'] is not None
+    if not finished:
+        message = "processing"
+    elif failed:
+        message = f"{failed} of {len(items)} requests failed"
+    else:
+        message = "success"
+    return {
+        "code": 200,
+        "id": batch['data'].get('id'),
+        "batch_id": batch['batch_id'],
+        "state": "done" if finished else "running",
+        "message": message,
+        "total": len(items),
+        "succeeded": succeeded,
+        "failed": failed,
+        "pending": len(items) - succeeded - failed,
+        "created_at": batch['created_at'],
+        "finished_at": batch['finished_at'],
+        "items": items,
+        "build_number": BUILD_NUMBER
+    }
+
+def send_batch_webhook(job_store, batch_id):
+    """Send the aggregated webhook of a batch that just finished, if it asked for one."""
+    batch = job_store.batch(batch_id)
+    if batch is None or not batch['webhook_url'] or batch['data'].get('webhook_mode', 'batch') == 'items':
+        return False
+    logger.info(f"Batch {batch_id}: All {len(batch['jobs'])} requests finished")
+    return send_webhook(batch['webhook_url'], batch_result(batch))
+
+def send_job_webhooks(job_store, results, completed_batches):
+    """Send the webhooks of jobs that just finished, then those of the batches they completed."""
+    for result in results:
+        for webhook_url in job_store.webhooks(result['job_id']):
+            send_webhook(webhook_url, dict(result))
+    for batch_id in completed_batches:
+        send_batch_webhook(job_store, batch_id)
@@ -4,9 +4,7 @@ import logging
 import requests
 import subprocess
 from services.file_management import download_file
-
-# Set the default local storage directory
-STORAGE_PATH = "/tmp/"
+from services.job_control import run_ffmpeg, scratch_dir
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -90,11 +88,11 @@ def process_captioning(file_url, caption_srt, caption_type, options, job_id):
     """Process video captioning using FFmpeg."""
     try:
         logger.info(f"Job {job_id}: Starting download of file from {file_url}")
-        video_path = download_file(file_url, STORAGE_PATH)
+        video_path = download_file(file_url, scratch_dir())
         logger.info(f"Job {job_id}: File downloaded to {video_path}")
 
         subtitle_extension = '.' + caption_type
-        srt_path = os.path.join(STORAGE_PATH, f"{job_id}{subtitle_extension}")
+        srt_path = os.path.join(scratch_dir(), f"{job_id}{subtitle_extension}")
         options = convert_array_to_collection(options)
         caption_style = ""
 
@@ -132,7 +130,7 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
                 srt_file.write(subtitle_content)
             logger.info(f"Job {job_id}: SRT file created at {srt_path}")
 
-        output_path = os.path.join(STORAGE_PATH, f"{job_id}_captioned.mp4")
+        output_path = os.path.join(scratch_dir(), f"{job_id}_captioned.mp4")
         logger.info(f"Job {job_id}: Output path set to {output_path}")
 
         # Ensure font_name is converted to the full font path
@@ -187,11 +185,11 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
             logger.info(f"Job {job_id}: Running FFmpeg with filter: {subtitle_filter}")
 
             # Run FFmpeg to add subtitles to the video
-            ffmpeg.input(video_path).output(
+            run_ffmpeg(ffmpeg.input(video_path).output(
                 output_path,
                 vf=subtitle_filter,
                 acodec='copy'
-            ).run()
+            ))
             logger.info(f"Job {job_id}: FFmpeg processing completed, output file at {output_path}")
         except ffmpeg.Error as e:
             # Log the FFmpeg stderr output
@@ -1,46 +1,98 @@
 import os
+import time
 import logging
+import threading
 from abc import ABC, abstractmethod
 from services.gcp_toolkit import upload_to_gcs
 from services.s3_toolkit import upload_to_s3
 from config import validate_env_vars
+from services.metrics import stage_timer, inc, observe, LATENCY_BUCKETS
+from services.job_control import add_uploaded_bytes, report_progress, record_upload
 
 logger = logging.getLogger(__name__)
 
+UPLOAD_PARALLELISM = int(os.environ.get('UPLOAD_PARALLELISM', 8))
+UPLOAD_PART_SIZE = int(os.environ.get('UPLOAD_PART_SIZE_MB', 64)) * 1024 * 1024
+# Most parts S3 and GCS multipart uploads accept
+MAX_UPLOAD_PARTS = 10000
+
+def upload_parts(size):
+    """Number and size of the parts a file of `size` bytes is uploaded in."""
+    if size <= UPLOAD_PART_SIZE:
+        return 1, UPLOAD_PART_SIZE
+    part_size = max(UPLOAD_PART_SIZE, -(-size // MAX_UPLOAD_PARTS))
+    return -(-size // part_size), part_size
+
 class CloudStorageProvider(ABC):
     @abstractmethod
     def upload_file(self, file_path: str) -> str:
         pass
 
 class GCPStorageProvider(CloudStorageProvider):
+    name = 'gcp'
+
     def __init__(self):
         self.bucket_name = os.getenv('GCP_BUCKET_NAME')
 
     def upload_file(self, file_path: str) -> str:
-        return upload_to_gcs(file_path, self.bucket_name)
+        _, part_size = upload_parts(os.path.getsize(file_path))
+        return upload_to_gcs(file_path, self.bucket_name, part_size=part_size, parallelism=UPLOAD_PARALLELISM)
 
 class S3CompatibleProvider(CloudStorageProvider):
+    name = 's3'
+
     def __init__(self):
         self.endpoint_url = os.getenv('S3_ENDPOINT_URL')
         self.access_key = os.getenv('S3_ACCESS_KEY')
         self.secret_key = os.getenv('S3_SECRET_KEY')
 
     def upload_file(self, file_path: str) -> str:
-        return upload_to_s3(file_path, self.endpoint_url, self.access_key, self.secret_key)
+        _, part_size = upload_parts(os.path.getsize(file_path))
+        return upload_to_s3(file_path, self.endpoint_url, self.access_key, self.secret_key,
+                            part_size=part_size, parallelism=UPLOAD_PARALLELISM)
+
+_provider = None
+_provider_lock = threading.Lock()
 
 def get_storage_provider() -> CloudStorageProvider:
-    try:
-        validate_env_vars('GCP')
-        return GCPStorageProvider()
-    except ValueError:
-        validate_env_vars('S3')
-        return S3CompatibleProvider()
+    """The storage provider of this process, chosen from the environment on first use."""
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                try:
+                    validate_env_vars('GCP')
+                    _provider = GCPStorageProvider()
+                except ValueError:
+                    validate_env_vars('S3')
+                    _provider = S3CompatibleProvider()
+    return _provider
 
 def upload_file(file_path: str) -> str:
     provider = get_storage_provider()
     try:
         logger.info(f"Uploading file to cloud storage: {file_path}")
-        url = provider.upload_file(file_path)
+        size = os.path.getsize(file_path)
+        report_progress("upload")
+        started = time.time()
+        result = "error"
+        try:
+            with stage_timer("upload"):
+                url = provider.upload_file(file_path)
+            result = "ok"
+        finally:
+            seconds = time.time() - started
+            observe("nca_upload_seconds", seconds, LATENCY_BUCKETS, provider=provider.name, result=result)
+        report_progress("upload", 100)
+        inc("nca_uploaded_bytes_total", size)
+        add_uploaded_bytes(size)
+        record_upload({
+            "url": url,
+            "bytes": size,
+            "parts": upload_parts(size)[0],
+            "seconds": round(seconds, 3),
+            "mbps": round(size * 8 / seconds / 1e6, 2) if seconds > 0 and size else None
+        })
         logger.info(f"File uploaded successfully: {url}")
         return url
     except Exception as e:
@@ -1,35 +1,28 @@
 import os
-import subprocess
 import json
-from services.file_management import download_file
-
-STORAGE_PATH = "/tmp/"
+import glob
+from services.file_management import streamed_input
+from services.job_control import run_subprocess, scratch_dir
 
 def process_keyframe_extraction(video_url, job_id):
-    video_path = download_file(video_url, STORAGE_PATH)
-
-    # Extract keyframes
-    output_pattern = os.path.join(STORAGE_PATH, f"{job_id}_%03d.jpg")
-    cmd = [
-        'ffmpeg',
-        '-i', video_path,
-        '-vf', f"select='eq(pict_type,I)',scale=iw*sar:ih,setsar=1",
-        '-vsync', 'vfr',
-        output_pattern
-    ]
+    # Extract keyframes, while the video downloads
+    output_pattern = os.path.join(scratch_dir(), f"{job_id}_%03d.jpg")
+    with streamed_input(video_url, scratch_dir()) as (video_path, pass_fds):
+        cmd = [
+            'ffmpeg',
+            '-i', video_path,
+            '-vf', f"select='eq(pict_type,I)',scale=iw*sar:ih,setsar=1",
+            '-vsync', 'vfr',
+            output_pattern
+        ]
 
-    print(f"Images: {cmd}")
+        print(f"Images: {cmd}")
 
-    subprocess.run(cmd, check=True)
+        run_subprocess(cmd, check=True, pass_fds=pass_fds)
 
     # Upload keyframes to GCS and get URLs
     output_filenames = []
-    for filename in sorted(os.listdir(STORAGE_PATH)):
-        if filename.startswith(f"{job_id}_") and filename.endswith(".jpg"):
-            file_path = os.path.join(STORAGE_PATH, filename)
-            output_filenames.append(file_path)
-
-    # Clean up input file
-    os.remove(video_path)
+    for file_path in sorted(glob.glob(os.path.join(scratch_dir(), f"{job_id}_*.jpg"))):
+        output_filenames.append(file_path)
 
     return output_filenames
\ No newline at end of file
@@ -1,40 +1,717 @@
 import os
+import glob
+import json
+import time
 import uuid
+import shutil
+import hashlib
+import logging
+import threading
 import requests
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from urllib.parse import urlparse, parse_qs
+from services.job_control import register_file, checkpoint, report_progress, record_download, current_job, run_in_job
+from services.metrics import stage_timer, inc
+from services import gcp_toolkit, s3_toolkit
+
+logger = logging.getLogger(__name__)
+
+INPUT_CACHE_PATH = os.environ.get('INPUT_CACHE_PATH', os.path.join(os.environ.get('STORAGE_PATH', '/tmp/'), 'input_cache'))
+INPUT_CACHE_MAX_MB = int(os.environ.get('INPUT_CACHE_MAX_MB', 5120))
+DOWNLOAD_CHUNK_SIZE = int(os.environ.get('DOWNLOAD_CHUNK_SIZE_KB', 1024)) * 1024
+DOWNLOAD_TIMEOUT = float(os.environ.get('DOWNLOAD_TIMEOUT', 60))
+DOWNLOAD_MAX_RETRIES = int(os.environ.get('DOWNLOAD_MAX_RETRIES', 5))
+DOWNLOAD_RETRY_BACKOFF = float(os.environ.get('DOWNLOAD_RETRY_BACKOFF', 1))
+DOWNLOAD_POOL_SIZE = int(os.environ.get('DOWNLOAD_POOL_SIZE', 16))
+DOWNLOAD_PARALLELISM = int(os.environ.get('DOWNLOAD_PARALLELISM', 4))
+DOWNLOAD_PART_SIZE = int(os.environ.get('DOWNLOAD_PART_SIZE_MB', 16)) * 1024 * 1024
+DOWNLOAD_CONCURRENCY = int(os.environ.get('DOWNLOAD_CONCURRENCY', 4))
+STREAM_INPUTS = os.environ.get('STREAM_INPUTS', 'false').lower() == 'true'
+# Comma-separated gs://bucket and s3://bucket prefixes inputs may be read from; defaults to the output buckets
+INPUT_BUCKETS = os.environ.get('INPUT_BUCKETS', '')
+CONNECT_TIMEOUT = 10
+# Temporary cache files untouched this long belong to downloads whose worker died
+STALE_DOWNLOAD_AGE = 3600
+RETRY_BACKOFF_MAX = 30
+# Seconds the signed URLs of gs:// and s3:// inputs stay valid, resumes included
+SIGNED_URL_EXPIRY = 6 * 3600
+# Bytes of a streamed input inspected to decide whether it can be read front to back
+STREAM_PEEK_SIZE = 256 * 1024
+# MP4/QuickTime top-level boxes, whose order tells whether the index comes before the media data
+MP4_BOXES = (b'ftyp', b'moov', b'mdat', b'free', b'skip', b'wide', b'pdin', b'uuid')
+
+# Failures after which a download is resumed (or restarted) rather than failed
+TRANSIENT_ERRORS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.Timeout
+)
+
+# Response headers that identify the content of a URL, most specific first
+CONTENT_VALIDATORS = ('ETag', 'Repr-Digest', 'Digest', 'Content-MD5', 'x-goog-hash', 'x-amz-checksum-sha256')
+
+def headers_fingerprint(headers):
+    """Identify the content of a response from its headers, or None if they give nothing to go on.
+
+    Uses an ETag or content digest header when present, and falls back to
+    Last-Modified together with Content-Length.
+    """
+    length = headers.get('Content-Length')
+    for header in CONTENT_VALIDATORS:
+        if headers.get(header):
+            return f"{header.lower()}:{headers[header]}:{length}"
+    if headers.get('Last-Modified') and length:
+        return f"last-modified:{headers['Last-Modified']}:{length}"
+    return None
+
+class InputCache:
+    """Downloaded inputs shared by every job on this node, keyed by URL and content fingerprint.
+
+    Jobs get a hard link to a cached file, so they can move or delete their
+    copy as usual. A file whose link count is above one is in use by a job
+    and is never evicted; the others are evicted least recently used first
+    once the cache holds more than `max_bytes`.
+    """
+    def __init__(self, path=INPUT_CACHE_PATH, max_bytes=INPUT_CACHE_MAX_MB * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    @staticmethod
+    def _hash(value):
+        return hashlib.sha256(value.encode()).hexdigest()
+
+    def entry_path(self, url, fingerprint):
+        return os.path.join(self.path, f"{self._hash(url)[:32]}-{self._hash(fingerprint)[:32]}")
+
+    def latest(self, url):
+        """Path and validators of the most recently used cached copy of a URL, or (None, None)."""
+        entries = glob.glob(os.path.join(self.path, f"{self._hash(url)[:32]}-*.json"))
+        for meta_path in sorted(entries, key=lambda p: os.path.getmtime(p) if os.path.exists(p) else 0, reverse=True):
+            path = meta_path[:-len('.json')]
+            try:
+                with open(meta_path) as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if os.path.exists(path):
+                return path, meta
+        return None, None
+
+    def link(self, path, destination):
+        """Give a job its own link to a cached file. Returns False if the entry is gone."""
+        try:
+            os.link(path, destination)
+        except FileNotFoundError:
+            return False
+        except OSError:
+            # Job scratch space on another filesystem: the copy isn't protected from eviction, nor needs to be
+            shutil.copyfile(path, destination)
+        now = time.time()
+        for touched in (path, f"{path}.json"):
+            try:
+                os.utime(touched, (now, now))
+            except OSError:
+                pass
+        return True
+
+    def store(self, temp_path, url, fingerprint, headers):
+        """Move a finished download into the cache and return its path."""
+        path = self.entry_path(url, fingerprint)
+        meta = {"url": url, "fingerprint": fingerprint,
+                "etag": headers.get('ETag'), "last_modified": headers.get('Last-Modified')}
+        with open(f"{temp_path}.json", 'w') as f:
+            json.dump(meta, f)
+        os.replace(temp_path, path)
+        os.replace(f"{temp_path}.json", f"{path}.json")
+        return path
+
+    def temp_path(self):
+        os.makedirs(self.path, exist_ok=True)
+        return os.path.join(self.path, f".download-{uuid.uuid4()}")
+
+    def evict(self):
+        """Delete unused entries, least recently used first, until the cache fits in max_bytes.
+
+        Downloads in progress count towards the size. Those left behind by a
+        worker that was killed mid-download, untouched for STALE_DOWNLOAD_AGE
+        seconds, are deleted.
+        """
+        entries = []
+        total = 0
+        for path in glob.glob(os.path.join(self.path, '.download-*')):
+            try:
+                stat = os.stat(path)
+                if stat.st_mtime < time.time() - STALE_DOWNLOAD_AGE:
+                    os.remove(path)
+                    logger.info(f"Removed abandoned download {path} from the input cache")
+                elif not path.endswith('.json'):
+                    total += stat.st_size
+            except FileNotFoundError:
+                continue
+        for path in glob.glob(os.path.join(self.path, '*-*')):
+            if path.endswith('.json'):
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            total += stat.st_size
+            if stat.st_nlink == 1:
+                entries.append((stat.st_mtime, stat.st_size, path))
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            for removed in (path, f"{path}.json"):
+                try:
+                    os.remove(removed)
+                except FileNotFoundError:
+                    pass
+            total -= size
+            logger.info(f"Evicted {path} from the input cache")
+
+input_cache = InputCache()
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """The requests.Session shared by every download in this process.
+
+    Connections to a host are kept alive and reused across jobs, so repeated
+    downloads from the same storage skip the TCP and TLS handshakes. Failed
+    connections and 429/5xx answers are retried with backoff before any
+    body is read; failures in the middle of a body are resumed by
+    download_file.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                retry = Retry(
+                    total=DOWNLOAD_MAX_RETRIES,
+                    backoff_factor=DOWNLOAD_RETRY_BACKOFF,
+                    status_forcelist=(429, 500, 502, 503, 504),
+                    allowed_methods=frozenset(['GET', 'HEAD']),
+                    raise_on_status=False
+                )
+                adapter = HTTPAdapter(pool_connections=DOWNLOAD_POOL_SIZE, pool_maxsize=DOWNLOAD_POOL_SIZE, max_retries=retry)
+                session = requests.Session()
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                # Byte offsets for Range requests must refer to the stored file, not a compressed transfer
+                session.headers['Accept-Encoding'] = 'identity'
+                _session = session
+    return _session
+
+def _get(url, headers=None):
+    return get_session().get(url, stream=True, headers=headers, timeout=(CONNECT_TIMEOUT, DOWNLOAD_TIMEOUT))
+
+def _content_length(response):
+    length = response.headers.get('Content-Length')
+    return int(length) if length and length.isdigit() else None
+
+def _resume_validator(headers):
+    """Strong validator to send in If-Range, so a resumed download never mixes two versions of a file."""
+    etag = headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return headers.get('Last-Modified')
+
+class InputNotAllowed(ValueError):
+    """A gs:// or s3:// input outside the buckets listed in INPUT_BUCKETS."""
+
+def input_buckets():
+    """The gs://bucket and s3://bucket prefixes inputs may be read from with the service's credentials."""
+    if INPUT_BUCKETS:
+        return {bucket.strip().rstrip('/') for bucket in INPUT_BUCKETS.split(',') if bucket.strip()}
+    buckets = set()
+    if os.getenv('GCP_BUCKET_NAME'):
+        buckets.add(f"gs://{os.getenv('GCP_BUCKET_NAME')}")
+    if os.getenv('S3_ENDPOINT_URL'):
+        buckets.add(f"s3://{s3_toolkit.parse_s3_url(os.getenv('S3_ENDPOINT_URL'))[0]}")
+    return buckets
+
+def check_input_url(url):
+    """Raise InputNotAllowed if `url` is a storage URI of a bucket inputs may not be read from."""
+    parsed = urlparse(url)
+    if parsed.scheme in ('gs', 's3') and f"{parsed.scheme}://{parsed.netloc}" not in input_buckets():
+        raise InputNotAllowed(f"Reading {parsed.scheme}://{parsed.netloc} is not allowed (see INPUT_BUCKETS)")
+
+def check_input_urls(data):
+    """Check every gs:// and s3:// URI in a request payload, however deeply nested, with check_input_url."""
+    if isinstance(data, dict):
+        data = list(data.values())
+    if isinstance(data, list):
+        for value in data:
+            check_input_urls(value)
+    elif isinstance(data, str) and data.startswith(('gs://', 's3://')):
+        check_input_url(data)
+
+def source_url(url):
+    """HTTP(S) URL to fetch an input from.
+
+    gs:// and s3:// URIs are turned into URLs signed for SIGNED_URL_EXPIRY seconds with the
+    credentials of services/gcp_toolkit.py and services/s3_toolkit.py, so
+    private objects are read straight from the bucket by the same ranged,
+    resumable downloader as public URLs. Other URLs are returned as is.
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ('gs', 's3'):
+        return url
+    key = parsed.path.lstrip('/')
+    if not parsed.netloc or not key:
+        raise ValueError(f"Invalid storage URI: {url}")
+    check_input_url(url)
+    if parsed.scheme == 'gs':
+        return gcp_toolkit.signed_download_url(parsed.netloc, key, SIGNED_URL_EXPIRY)
+    if not os.getenv('S3_ENDPOINT_URL'):
+        raise ValueError("S3_ENDPOINT_URL is not set. Cannot read s3:// URLs.")
+    return s3_toolkit.presigned_download_url(parsed.netloc, key, os.getenv('S3_ENDPOINT_URL'),
+                                             os.getenv('S3_ACCESS_KEY'), os.getenv('S3_SECRET_KEY'), SIGNED_URL_EXPIRY)
+
+class DownloadAborted(Exception):
+    """Raised in a download that was abandoned because another input of the same job failed."""
+
+_downloads = threading.local()
+
+def _check():
+    """Stop a download if its job was stopped or another input downloaded alongside it failed."""
+    checkpoint()
+    aborted = getattr(_downloads, 'aborted', None)
+    if aborted is not None and aborted.is_set():
+        raise DownloadAborted("Another input failed to download")
+
+def _backoff(attempt, check=_check):
+    delay = min(DOWNLOAD_RETRY_BACKOFF * 2 ** (attempt - 1), RETRY_BACKOFF_MAX)
+    deadline = time.time() + delay
+    while time.time() < deadline:
+        check()
+        time.sleep(min(0.5, max(0, deadline - time.time())))
+
+class ContentChanged(Exception):
+    """The file behind a URL changed while it was being downloaded, or the download can't be resumed."""
+
+def _body_chunks(response, url, stats):
+    """Yield the body of a response, resuming with Range requests after transient failures.
+
+    A resumed request carries If-Range, so a server whose content changed
+    answers with the whole new file; ContentChanged is raised then, and when
+    the server sends no validator or ignores ranges.
+    """
+    total = _content_length(response)
+    validator = _resume_validator(response.headers)
+    downloaded = 0
+    attempt = 0
+    while True:
+        try:
+            if response is None:
+                if not validator:
+                    raise ContentChanged(f"{url} can't be resumed without an ETag or Last-Modified")
+                response = _get(url, {'Range': f"bytes={downloaded}-", 'If-Range': validator})
+                if response.status_code != 206 or not response.headers.get('Content-Range', '').startswith(f"bytes {downloaded}-"):
+                    response.close()
+                    response.raise_for_status()
+                    raise ContentChanged(f"{url} no longer matches {validator}")
+                stats["resumes"] += 1
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                _check()
+                downloaded += len(chunk)
+                yield chunk
+            if total is not None and downloaded < total:
+                raise requests.exceptions.ChunkedEncodingError(f"Connection closed after {downloaded} of {total} bytes")
+            return
+        except TRANSIENT_ERRORS as e:
+            if response is not None:
+                response.close()
+                response = None
+            attempt += 1
+            if attempt > DOWNLOAD_MAX_RETRIES:
+                raise
+            logger.warning(f"Download of {url} interrupted after {downloaded} bytes, retrying ({attempt}/{DOWNLOAD_MAX_RETRIES}) - {str(e)}")
+            _backoff(attempt)
+
+def _write_body(response, url, target, stats):
+    """Write a response body to `target`, resuming it after transient failures and starting over if it can't be resumed.
+
+    Returns the number of bytes written and the headers of the response the
+    body came from.
+    """
+    with open(target, 'wb', buffering=DOWNLOAD_CHUNK_SIZE) as f:
+        while True:
+            total = _content_length(response)
+            downloaded = 0
+            report_progress("download", 0 if total else None)
+            try:
+                for chunk in _body_chunks(response, url, stats):
+                    f.write(chunk)
+                    downloaded += len(chunk)
+                    if total:
+                        report_progress("download", downloaded / total * 100)
+                return downloaded, response.headers
+            except ContentChanged as e:
+                if stats["restarts"] >= DOWNLOAD_MAX_RETRIES:
+                    raise
+                logger.warning(f"Restarting download - {str(e)}")
+                stats["restarts"] += 1
+                f.seek(0)
+                f.truncate()
+                response = _get(url)
+                response.raise_for_status()
+
+def _parallel_parts(response):
+    """Byte ranges to download concurrently, or None if the response should be read as a single stream."""
+    total = _content_length(response)
+    if (DOWNLOAD_PARALLELISM < 2 or response.status_code != 200 or total is None or total <= DOWNLOAD_PART_SIZE
+            or response.headers.get('Accept-Ranges') != 'bytes' or not _resume_validator(response.headers)):
+        return None
+    return [(start, min(start + DOWNLOAD_PART_SIZE, total) - 1) for start in range(0, total, DOWNLOAD_PART_SIZE)]
+
+class _PartProgress:
+    """Progress and failure state shared by the threads downloading the parts of one file."""
+    def __init__(self, total, stats):
+        self.context = current_job()
+        self.aborted = getattr(_downloads, 'aborted', None)
+        self.total = total
+        self.stats = stats
+        self.downloaded = 0
+        self.failed = threading.Event()
+        self.lock = threading.Lock()
+
+    def check(self):
+        if self.failed.is_set():
+            raise ContentChanged("Another part of the download failed")
+        if self.context is not None:
+            self.context.checkpoint()
+        if self.aborted is not None and self.aborted.is_set():
+            raise DownloadAborted("Another input failed to download")
+
+    def add(self, size):
+        with self.lock:
+            self.downloaded += size
+            if self.context is not None:
+                self.context.report_progress("download", self.downloaded / self.total * 100)
+
+    def resumed(self):
+        with self.lock:
+            self.stats["resumes"] += 1
+
+def _fetch_part(url, target, start, end, validator, progress):
+    """Download bytes start..end of a URL into their place in `target`, resuming after transient failures."""
+    position = start
+    attempt = 0
+    with open(target, 'r+b', buffering=DOWNLOAD_CHUNK_SIZE) as f:
+        while position <= end:
+            progress.check()
+            try:
+                f.seek(position)
+                with _get(url, {'Range': f"bytes={position}-{end}", 'If-Range': validator}) as response:
+                    if response.status_code != 206 or not response.headers.get('Content-Range', '').startswith(f"bytes {position}-"):
+                        response.raise_for_status()
+                        raise ContentChanged(f"{url} no longer matches {validator}")
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        progress.check()
+                        chunk = chunk[:end + 1 - position]
+                        f.write(chunk)
+                        position += len(chunk)
+                        progress.add(len(chunk))
+                        if position > end:
+                            break
+                if position <= end:
+                    raise requests.exceptions.ChunkedEncodingError(f"Connection closed at byte {position} of part {start}-{end}")
+            except TRANSIENT_ERRORS as e:
+                attempt += 1
+                if attempt > DOWNLOAD_MAX_RETRIES:
+                    raise
+                logger.warning(f"Download of bytes {start}-{end} of {url} interrupted at {position}, retrying ({attempt}/{DOWNLOAD_MAX_RETRIES}) - {str(e)}")
+                _backoff(attempt, progress.check)
+                progress.resumed()
+
+def _write_parts(url, target, parts, headers, stats):
+    """Download `parts` of a URL over concurrent connections into a preallocated `target`.
+
+    Every request carries If-Range with the validator of the first response,
+    so parts of two versions of a file are never combined; ContentChanged is
+    raised instead.
+    """
+    total = parts[-1][1] + 1
+    with open(target, 'wb') as f:
+        try:
+            os.posix_fallocate(f.fileno(), 0, total)
+        except (AttributeError, OSError):
+            f.truncate(total)
+    validator = _resume_validator(headers)
+    progress = _PartProgress(total, stats)
+    connections = min(DOWNLOAD_PARALLELISM, len(parts))
+    stats["connections"] = connections
+    report_progress("download", 0)
+    with ThreadPoolExecutor(max_workers=connections, thread_name_prefix='download') as pool:
+        futures = [pool.submit(_fetch_part, url, target, start, end, validator, progress) for start, end in parts]
+        try:
+            for future in as_completed(futures):
+                future.result()
+        except BaseException:
+            progress.failed.set()
+            for future in futures:
+                future.cancel()
+            raise
+    return total, headers
 
 def download_file(url, storage_path="/tmp/"):
     # Parse the URL to extract the file ID from the query parameters
     parsed_url = urlparse(url)
     query_params = parse_qs(parsed_url.query)
-    
+
     # Use the 'id' parameter as the filename if it exists
     file_id = str(uuid.uuid4())
-    
+
     #if not file_id:
     #    raise ValueError("Invalid URL: 'id' parameter not found in the URL")
-    
+
     # Ensure the storage directory exists
     if not os.path.exists(storage_path):
         os.makedirs(storage_path)
-    
+
     # Use the file ID as the filename and save it in the specified storage path
     local_filename = os.path.join(storage_path, f"{file_id}.mp4")  # Assuming mp4; adjust extension if needed
-    
+
     # Download the file
-    response = requests.get(url, stream=True)
-    response.raise_for_status()
-    
-    with open(local_filename, 'wb') as f:
-        for chunk in response.iter_content(chunk_size=8192):
-            f.write(chunk)
-    
+    started = time.time()
+    stats = {"url": url, "bytes": 0, "connections": 1, "resumes": 0, "restarts": 0, "cache": None, "streamed": False}
+    with stage_timer("download"):
+        # Storage URIs are cached and reported under their own name, not the signed URL they are read from
+        source = source_url(url)
+        # Revalidate the cached copy of this URL, if any, instead of downloading it again
+        cached_path, cached_meta = input_cache.latest(url) if input_cache.enabled else (None, None)
+        headers = {}
+        if cached_meta and cached_meta.get('etag'):
+            headers['If-None-Match'] = cached_meta['etag']
+        elif cached_meta and cached_meta.get('last_modified'):
+            headers['If-Modified-Since'] = cached_meta['last_modified']
+        response = _get(source, headers)
+
+        register_file(local_filename)
+        if response.status_code == 304:
+            response.close()
+            if input_cache.link(cached_path, local_filename):
+                inc("nca_input_cache_total", result="hit")
+                _record(stats, "hit", started)
+                return local_filename
+            # Evicted since the lookup
+            response = _get(source)
+        response.raise_for_status()
+
+        fingerprint = headers_fingerprint(response.headers) if input_cache.enabled else None
+        if fingerprint and input_cache.link(input_cache.entry_path(url, fingerprint), local_filename):
+            # The server ignored the conditional request, but the content is already cached
+            response.close()
+            inc("nca_input_cache_total", result="hit")
+            _record(stats, "hit", started)
+            return local_filename
+        cache_result = "miss" if fingerprint else "uncacheable"
+        inc("nca_input_cache_total", result=cache_result)
+
+        target = input_cache.temp_path() if fingerprint else local_filename
+        register_file(target)
+        try:
+            parts = _parallel_parts(response)
+            if parts:
+                # The first response only served to find out the size; each part gets its own request
+                response.close()
+                try:
+                    stats["bytes"], body_headers = _write_parts(source, target, parts, response.headers, stats)
+                except ContentChanged as e:
+                    logger.warning(f"Restarting download - {str(e)}")
+                    stats["restarts"] += 1
+                    stats["connections"] = 1
+                    response = _get(source)
+                    response.raise_for_status()
+                    stats["bytes"], body_headers = _write_body(response, source, target, stats)
+            else:
+                stats["bytes"], body_headers = _write_body(response, source, target, stats)
+        except BaseException:
+            # Partial downloads are useless, and no other job knows of the temporary cache file
+            if os.path.exists(target):
+                os.remove(target)
+            raise
+    inc("nca_downloaded_bytes_total", stats["bytes"])
+
+    if fingerprint:
+        # Link the job's copy first, so the new entry is never unused and evictable
+        input_cache.link(target, local_filename)
+        # A download that had to start over may have fetched a newer version
+        fingerprint = headers_fingerprint(body_headers)
+        if fingerprint:
+            input_cache.store(target, url, fingerprint, body_headers)
+            input_cache.evict()
+        else:
+            os.remove(target)
+
+    _record(stats, cache_result, started)
     return local_filename
 
+def _record(stats, cache_result, started):
+    """Add the size, duration and throughput of a finished download to the current job's timing."""
+    seconds = time.time() - started
+    stats.update(
+        cache=cache_result,
+        seconds=round(seconds, 3),
+        mbps=round(stats["bytes"] * 8 / seconds / 1e6, 2) if seconds > 0 and stats["bytes"] else None
+    )
+    logger.info(f"Downloaded {stats['url']}: {stats['bytes']} bytes in {stats['seconds']}s ({stats['cache']}, {stats['resumes']} resumes)")
+    record_download(stats)
+
+def _download_in_group(url, storage_path, aborted):
+    _downloads.aborted = aborted
+    try:
+        return download_file(url, storage_path)
+    finally:
+        _downloads.aborted = None
+
+def download_files(urls, storage_path="/tmp/"):
+    """Download several inputs concurrently and return their local paths in the order of `urls`.
+
+    `storage_path` is either one directory for all inputs or a list with one
+    directory per URL. Up to DOWNLOAD_CONCURRENCY inputs are fetched at a
+    time. If one fails, the others are abandoned, the inputs already
+    downloaded are removed, and its error is raised.
+    """
+    paths = list(storage_path) if isinstance(storage_path, (list, tuple)) else [storage_path] * len(urls)
+    if len(urls) < 2 or DOWNLOAD_CONCURRENCY < 2:
+        return [download_file(url, path) for url, path in zip(urls, paths)]
+
+    context = current_job()
+    aborted = threading.Event()
+    with ThreadPoolExecutor(max_workers=min(DOWNLOAD_CONCURRENCY, len(urls)), thread_name_prefix='input') as pool:
+        futures = [pool.submit(run_in_job, context, _download_in_group, url, path, aborted) for url, path in zip(urls, paths)]
+        error = None
+        try:
+            for future in as_completed(futures):
+                future.result()
+        except BaseException as e:
+            # The first input to fail; the others fail with DownloadAborted after it
+            error = e
+            aborted.set()
+            for future in futures:
+                future.cancel()
+    if error is not None:
+        for future in futures:
+            if future.done() and not future.cancelled() and future.exception() is None and os.path.exists(future.result()):
+                os.remove(future.result())
+        raise error
+    return [future.result() for future in futures]
+
+def needs_seeking(head):
+    """Whether a file starting with the bytes `head` can't be decoded front to back.
+
+    That is the case for MP4 and QuickTime files whose index (moov box)
+    follows the media data, which ffmpeg can only open by seeking to the
+    end. Other containers, and MP4s written with faststart, are read in
+    order. If the index isn't found in `head`, the file is assumed to need
+    seeking.
+    """
+    if head[4:8] not in MP4_BOXES:
+        return False
+    offset = 0
+    while offset + 8 <= len(head):
+        size = int.from_bytes(head[offset:offset + 4], 'big')
+        box = head[offset + 4:offset + 8]
+        if box == b'moov':
+            return False
+        if box == b'mdat':
+            return True
+        if size == 1 and offset + 16 <= len(head):
+            size = int.from_bytes(head[offset + 8:offset + 16], 'big')
+        if size < 8:
+            break
+        offset += size
+    return True
+
+def _feed(pipe, head, chunks, response, feeder):
+    """Write a streamed input into ffmpeg's pipe. Stops quietly if ffmpeg stops reading."""
+    try:
+        with os.fdopen(pipe, 'wb') as f:
+            f.write(head)
+            feeder["bytes"] += len(head)
+            for chunk in chunks:
+                f.write(chunk)
+                feeder["bytes"] += len(chunk)
+    except BrokenPipeError:
+        pass
+    except BaseException as e:
+        feeder["error"] = e
+    finally:
+        response.close()
+
+@contextmanager
+def streamed_input(url, storage_path="/tmp/"):
+    """Give ffmpeg a remote input while it downloads, instead of after.
+
+    Yields `(path, pass_fds)`: the input to pass to ffmpeg's `-i`, and the
+    file descriptors the ffmpeg process must inherit (`pass_fds` of
+    run_subprocess). The input is fed through a pipe by the pooled
+    downloader, with the same resume logic as download_file. Inputs that
+    need seeking, inputs already in the input cache, and all inputs unless
+    STREAM_INPUTS is on are downloaded to `storage_path` first, through the
+    input cache. The local copy is removed on exit. A streamed input never
+    reaches the input cache, so the next job reading the same URL downloads
+    it again; that is why streaming is opt-in.
+
+    Only use it for ffmpeg commands that read their input once, front to
+    back. If the download fails part way, the error is raised on exit even
+    if ffmpeg succeeded on the truncated input.
+    """
+    response = None
+    if STREAM_INPUTS and not (input_cache.enabled and input_cache.latest(url)[0]):
+        started = time.time()
+        stats = {"url": url, "bytes": 0, "connections": 1, "resumes": 0, "restarts": 0, "cache": None, "streamed": True}
+        source = source_url(url)
+        response = _get(source)
+        response.raise_for_status()
+        chunks = _body_chunks(response, source, stats)
+        head = b''
+        for chunk in chunks:
+            head += chunk
+            if len(head) >= STREAM_PEEK_SIZE:
+                break
+        if needs_seeking(head):
+            logger.info(f"Downloading {url} before processing, it can't be read front to back")
+            chunks.close()
+            response.close()
+            response = None
+
+    if response is None:
+        path = download_file(url, storage_path)
+        try:
+            yield path, ()
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+        return
 
-def delete_old_files():
-    now = time.time()
-    for filename in os.listdir(STORAGE_PATH):
-        file_path = os.path.join(STORAGE_PATH, filename)
-        if os.path.isfile(file_path) and os.stat(file_path).st_mtime < now - 3600:
-            os.remove(file_path)
+    read_fd, write_fd = os.pipe()
+    feeder = {"bytes": 0, "error": None}
+    # The feeder carries on with the chunks that follow the peeked head
+    feeder_thread = threading.Thread(
+        target=run_in_job, args=(current_job(), _feed, write_fd, head, chunks, response, feeder),
+        name='input-stream', daemon=True
+    )
+    feeder_thread.start()
+    try:
+        yield f"pipe:{read_fd}", (read_fd,)
+    finally:
+        # ffmpeg has exited, so the feeder's next write fails and it stops
+        os.close(read_fd)
+        feeder_thread.join()
+        # Recorded even when ffmpeg failed, so the job's timing shows how far the input got
+        stats["bytes"] = feeder["bytes"]
+        inc("nca_downloaded_bytes_total", stats["bytes"])
+        _record(stats, None, started)
+    if feeder["error"] is not None:
+        raise feeder["error"]
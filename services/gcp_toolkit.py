@@ -1,8 +1,12 @@
 import os
 import json
 import logging
+from datetime import timedelta
+from requests.adapters import HTTPAdapter
 from google.oauth2 import service_account
+from google.auth.transport.requests import AuthorizedSession
 from google.cloud import storage
+from google.cloud.storage import transfer_manager
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -11,6 +15,7 @@ logger = logging.getLogger(__name__)
 # GCS environment variables
 GCP_BUCKET_NAME = os.getenv('GCP_BUCKET_NAME')
 STORAGE_PATH = "/tmp/"
+UPLOAD_POOL_SIZE = int(os.environ.get('UPLOAD_POOL_SIZE', 32))
 gcs_client = None
 
 def initialize_gcp_client():
@@ -29,7 +34,10 @@ def initialize_gcp_client():
             credentials_info,
             scopes=GCS_SCOPES
         )
-        return storage.Client(credentials=gcs_credentials)
+        # One client per process: its pooled connections are reused by every upload, from any thread
+        http = AuthorizedSession(gcs_credentials)
+        http.mount('https://', HTTPAdapter(pool_connections=UPLOAD_POOL_SIZE, pool_maxsize=UPLOAD_POOL_SIZE))
+        return storage.Client(credentials=gcs_credentials, _http=http)
     except Exception as e:
         logger.error(f"Failed to initialize GCS client: {e}")
         return None
@@ -37,7 +45,8 @@ def initialize_gcp_client():
 # Initialize the GCS client
 gcs_client = initialize_gcp_client()
 
-def upload_to_gcs(file_path, bucket_name=GCP_BUCKET_NAME):
+def upload_to_gcs(file_path, bucket_name=GCP_BUCKET_NAME, part_size=None, parallelism=1):
+    """Upload a file, in parts of `part_size` bytes sent `parallelism` at a time if it is larger than one part."""
     if not gcs_client:
         raise ValueError("GCS client is not initialized. Skipping file upload.")
 
@@ -45,9 +54,21 @@ def upload_to_gcs(file_path, bucket_name=GCP_BUCKET_NAME):
         logger.info(f"Uploading file to Google Cloud Storage: {file_path}")
         bucket = gcs_client.bucket(bucket_name)
         blob = bucket.blob(os.path.basename(file_path))
-        blob.upload_from_filename(file_path)
+        if part_size and os.path.getsize(file_path) > part_size:
+            # XML API multipart upload: GCS assembles the parts, no temporary objects to compose and delete
+            transfer_manager.upload_chunks_concurrently(file_path, blob, chunk_size=part_size,
+                                                        worker_type=transfer_manager.THREAD, max_workers=parallelism)
+        else:
+            blob.upload_from_filename(file_path)
         logger.info(f"File uploaded successfully to GCS: {blob.public_url}")
         return blob.public_url
     except Exception as e:
         logger.error(f"Error uploading file to GCS: {e}")
         raise
+
+def signed_download_url(bucket_name, blob_name, expiration):
+    """HTTPS URL that reads a GCS object with the service account's credentials for `expiration` seconds."""
+    if not gcs_client:
+        raise ValueError("GCS client is not initialized. Cannot read gs:// URLs.")
+    blob = gcs_client.bucket(bucket_name).blob(blob_name)
+    return blob.generate_signed_url(version="v4", expiration=timedelta(seconds=expiration), method="GET")
@@ -0,0 +1,57 @@
+import os
+import json
+import time
+import hashlib
+
+IDEMPOTENCY_MODE = os.environ.get('IDEMPOTENCY_MODE', 'id')
+IDEMPOTENCY_TTL = int(os.environ.get('IDEMPOTENCY_TTL', 24 * 3600))
+IDEMPOTENCY_WAIT_INTERVAL = 0.5
+
+# Fields that change how or where a result is delivered, not what it is
+DELIVERY_FIELDS = ('webhook_url', 'priority', 'deadline', 'timeout')
+
+def idempotency_key(endpoint, data, header=None, tenant=None, deterministic=True):
+    """Key identifying requests that produce the same result, or None if deduplication is off.
+
+    An Idempotency-Key header wins. Otherwise the key is a hash of the
+    validated payload without the delivery fields, so retries with a
+    different webhook still match. In `id` mode only requests with an `id`
+    field are deduplicated, and the payload is hashed along with it: a
+    client reusing an id for other inputs or options gets a new job. In
+    `payload` mode any two equal payloads match, and a URL whose content
+    changed in between still gets the old result. Keys
+    are scoped to the `tenant` name, so one tenant's request never matches
+    another tenant's job. Endpoints that aren't `deterministic`, whose
+    result isn't fully determined by their payload, are only deduplicated
+    by the header.
+    """
+    if IDEMPOTENCY_MODE == 'off':
+        return None
+    if not header and not deterministic:
+        return None
+    if header:
+        basis = {"idempotency_key": header}
+    elif IDEMPOTENCY_MODE == 'id' and not data.get('id'):
+        return None
+    else:
+        basis = {k: v for k, v in data.items() if k not in DELIVERY_FIELDS}
+    canonical = json.dumps([endpoint, tenant, basis], sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+def wait_for_job(job_store, job_id, timeout=None, wakeup=None):
+    """Block until a job reaches a terminal state and return it.
+
+    Gives up after `timeout` seconds and returns the job as it is then. A job
+    run by another worker is noticed on the next poll of the job store; one
+    run in this process can set the `wakeup` event to end the wait at once.
+    """
+    end = time.time() + timeout if timeout is not None else None
+    while True:
+        job = job_store.get(job_id)
+        if job is None or job['finished_at'] is not None or (end is not None and time.time() >= end):
+            return job
+        interval = IDEMPOTENCY_WAIT_INTERVAL if end is None else max(0, min(IDEMPOTENCY_WAIT_INTERVAL, end - time.time()))
+        if wakeup is not None:
+            wakeup.wait(interval)
+        else:
+            time.sleep(interval)
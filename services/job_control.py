@@ -0,0 +1,342 @@
+import os
+import sys
+import glob
+import time
+import logging
+import threading
+import subprocess
+from services.metrics import stage_timer
+from services import scratch
+from services import media_probe
+
+logger = logging.getLogger(__name__)
+
+STORAGE_PATH = scratch.STORAGE_PATH
+DEFAULT_JOB_TIMEOUT = float(os.environ.get('DEFAULT_JOB_TIMEOUT', 0))
+WATCHDOG_INTERVAL = float(os.environ.get('WATCHDOG_INTERVAL', 1))
+# Minimum seconds between progress updates written to the job store for one job
+PROGRESS_INTERVAL = float(os.environ.get('PROGRESS_INTERVAL', 1))
+# Seconds a child process gets to exit after SIGTERM before it is killed
+PROCESS_KILL_GRACE = 5
+
+# Response codes reported for jobs that were stopped before finishing
+STOP_CODES = {
+    'cancelled': 499,
+    'timeout': 408,
+    'quota': 507
+}
+# State recorded for jobs stopped for a reason that isn't a state of its own
+STOP_STATES = {
+    'quota': 'failed'
+}
+
+class JobCancelled(Exception):
+    """Raised inside a job that was cancelled or ran past its timeout."""
+    def __init__(self, reason):
+        super().__init__(f"Job {reason}")
+        self.reason = reason
+
+class JobContext:
+    """Tracks the child processes, scratch files and progress of one running job so it can be stopped and followed."""
+    def __init__(self, job_id, timeout=None, store=None, workspace=None):
+        self.job_id = job_id
+        self.store = store
+        self.workspace = workspace
+        self.stage = None
+        self.progress_at = 0
+        self.deadline = time.time() + timeout if timeout else None
+        self.reason = None
+        self.message = None
+        self.processes = set()
+        self.files = set()
+        self.uploaded_bytes = 0
+        self.downloads = []
+        self.uploads = []
+        self.lock = threading.Lock()
+
+    @property
+    def stopped(self):
+        return self.reason is not None
+
+    @property
+    def state(self):
+        """The job state to record for a stopped job, or None if it wasn't stopped."""
+        return STOP_STATES.get(self.reason, self.reason)
+
+    def stop(self, reason, message=None):
+        """Mark the job as stopped and terminate its child processes."""
+        with self.lock:
+            if self.reason is not None:
+                return
+            self.reason = reason
+            self.message = message or reason
+            processes = list(self.processes)
+        logger.info(f"Job {self.job_id}: Stopping job ({reason})")
+        for process in processes:
+            terminate_process(process)
+
+    def checkpoint(self):
+        if self.reason is not None:
+            raise JobCancelled(self.reason)
+
+    def report_progress(self, stage, progress=None):
+        """Record the current stage and percent complete, at most every PROGRESS_INTERVAL seconds per stage."""
+        now = time.time()
+        if stage == self.stage and now - self.progress_at < PROGRESS_INTERVAL and progress != 100:
+            return
+        self.stage = stage
+        self.progress_at = now
+        if self.store is None:
+            return
+        try:
+            self.store.set_progress(self.job_id, stage, None if progress is None else round(min(progress, 100), 1))
+        except Exception as e:
+            logger.warning(f"Job {self.job_id}: Failed to record progress - {str(e)}")
+
+    def cleanup_files(self):
+        """Remove the job's workspace and the files it downloaded or created under STORAGE_PATH."""
+        paths = set(self.files) | set(glob.glob(os.path.join(STORAGE_PATH, f"{self.job_id}*")))
+        for path in paths:
+            try:
+                if os.path.isfile(path):
+                    os.remove(path)
+            except OSError as e:
+                logger.warning(f"Job {self.job_id}: Could not remove {path} - {str(e)}")
+        if self.workspace is not None:
+            scratch.remove_workspace(self.workspace)
+
+_local = threading.local()
+_contexts = {}
+_contexts_lock = threading.Lock()
+
+def start_job(job_id, timeout=None, store=None):
+    """Create the context and workspace for a job about to run on the calling thread; progress is recorded in `store`."""
+    context = JobContext(job_id, timeout or DEFAULT_JOB_TIMEOUT, store, scratch.create_workspace(job_id))
+    _local.context = context
+    with _contexts_lock:
+        _contexts[job_id] = context
+    return context
+
+def end_job(context):
+    _local.context = None
+    with _contexts_lock:
+        _contexts.pop(context.job_id, None)
+
+def current_job():
+    return getattr(_local, 'context', None)
+
+def scratch_dir():
+    """Directory for the scratch files of the current job: its own workspace, or STORAGE_PATH outside a job."""
+    context = current_job()
+    if context is not None and context.workspace is not None:
+        return context.workspace
+    return STORAGE_PATH
+
+def run_in_job(context, func, *args, **kwargs):
+    """Run `func` on the calling thread as part of the job of `context`, e.g. in a thread pool the job started."""
+    previous = getattr(_local, 'context', None)
+    _local.context = context
+    try:
+        return func(*args, **kwargs)
+    finally:
+        _local.context = previous
+
+def stop_job(job_id, reason):
+    """Stop a job running in this process. Returns False if it isn't running here."""
+    with _contexts_lock:
+        context = _contexts.get(job_id)
+    if context is None:
+        return False
+    context.stop(reason)
+    return True
+
+def checkpoint():
+    """Raise JobCancelled if the current job has been cancelled or timed out."""
+    context = current_job()
+    if context is not None:
+        context.checkpoint()
+
+def report_progress(stage, progress=None):
+    """Report the current job's stage and percent complete (0-100, or None if unknown)."""
+    context = current_job()
+    if context is not None:
+        context.report_progress(stage, progress)
+
+def register_file(path):
+    """Remember a scratch file of the current job so it is removed if the job is stopped."""
+    context = current_job()
+    if context is not None:
+        context.files.add(path)
+
+def add_uploaded_bytes(size):
+    """Count bytes the current job uploaded to cloud storage."""
+    context = current_job()
+    if context is not None:
+        context.uploaded_bytes += size
+
+def record_download(stats):
+    """Add the stats of a finished input download to the current job's timing."""
+    context = current_job()
+    if context is not None:
+        context.downloads.append(stats)
+
+def record_upload(stats):
+    """Add the stats of a finished output upload to the current job's timing."""
+    context = current_job()
+    if context is not None:
+        context.uploads.append(stats)
+
+def terminate_process(process):
+    if process.poll() is not None:
+        return
+    process.terminate()
+    def kill_if_alive():
+        if process.poll() is None:
+            process.kill()
+    timer = threading.Timer(PROCESS_KILL_GRACE, kill_if_alive)
+    timer.daemon = True
+    timer.start()
+
+def parse_time(value):
+    """Seconds in an ffmpeg time value ("90", "90.5" or "00:01:30.5"), or None."""
+    try:
+        seconds = 0.0
+        for part in str(value).split(':'):
+            seconds = seconds * 60 + float(part)
+        return seconds
+    except ValueError:
+        return None
+
+def ffmpeg_duration(cmd):
+    """Expected duration of an ffmpeg command's output in seconds: its -t, else its longest local input."""
+    for i, arg in enumerate(cmd[:-1]):
+        if arg == '-t':
+            return parse_time(cmd[i + 1])
+    durations = []
+    for i, arg in enumerate(cmd[:-1]):
+        if arg == '-i' and os.path.isfile(cmd[i + 1]):
+            try:
+                duration = media_probe.probe(cmd[i + 1]).duration
+            except media_probe.ProbeError:
+                duration = None
+            if duration:
+                durations.append(duration)
+    return max(durations) if durations else None
+
+def follow_ffmpeg_progress(fd, context, duration):
+    """Turn ffmpeg `-progress` key=value output read from `fd` into job progress reports."""
+    with os.fdopen(fd) as progress:
+        for line in progress:
+            key, _, value = line.strip().partition('=')
+            if key == 'out_time_us' and duration:
+                try:
+                    context.report_progress('ffmpeg', int(value) / 1e6 / duration * 100)
+                except ValueError:
+                    pass
+            elif key == 'progress' and value == 'end':
+                context.report_progress('ffmpeg', 100)
+
+def run_subprocess(cmd, check=False, capture_output=False, timeout=None, **kwargs):
+    """Drop-in replacement for subprocess.run whose child is terminated if the current job is stopped.
+
+    ffmpeg commands run as part of a job also report their progress through
+    an extra `-progress` pipe.
+    """
+    if capture_output:
+        kwargs['stdout'] = subprocess.PIPE
+        kwargs['stderr'] = subprocess.PIPE
+    # Own session, so signals meant for the worker (e.g. a process group SIGTERM during a drain) don't hit the job
+    kwargs.setdefault('start_new_session', True)
+    context = current_job()
+    checkpoint()
+    progress_fd = None
+    if context is not None and context.store is not None and os.path.basename(str(cmd[0])) == 'ffmpeg':
+        context.report_progress('ffmpeg')
+        duration = ffmpeg_duration(cmd)
+        progress_fd, write_fd = os.pipe()
+        cmd = [cmd[0], '-progress', f'pipe:{write_fd}'] + list(cmd[1:])
+        kwargs['pass_fds'] = tuple(kwargs.get('pass_fds', ())) + (write_fd,)
+    with stage_timer(os.path.basename(str(cmd[0]))), subprocess.Popen(cmd, **kwargs) as process:
+        if progress_fd is not None:
+            os.close(write_fd)
+            threading.Thread(target=follow_ffmpeg_progress, args=(progress_fd, context, duration), daemon=True).start()
+        if context is not None:
+            with context.lock:
+                context.processes.add(process)
+            if context.stopped:
+                terminate_process(process)
+        try:
+            stdout, stderr = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            raise
+        finally:
+            if context is not None:
+                with context.lock:
+                    context.processes.discard(process)
+    checkpoint()
+    if check and process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, cmd, stdout, stderr)
+    return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+
+def run_ffmpeg(stream, capture_stdout=False, capture_stderr=False, overwrite_output=False, pass_fds=()):
+    """Run an ffmpeg-python stream like `stream.run()`, but under the current job's control."""
+    import ffmpeg
+    result = run_subprocess(
+        ffmpeg.compile(stream, overwrite_output=overwrite_output),
+        stdout=subprocess.PIPE if capture_stdout else None,
+        stderr=subprocess.PIPE if capture_stderr else None,
+        pass_fds=pass_fds
+    )
+    if result.returncode:
+        raise ffmpeg.Error('ffmpeg', result.stdout, result.stderr)
+    return result.stdout, result.stderr
+
+def install_whisper_hook():
+    """Let Whisper transcriptions stop between segments when their job is stopped.
+
+    Whisper reports progress through a tqdm bar once per decoded segment, so
+    its transcribe module gets a tqdm whose update() is a job checkpoint.
+    """
+    module = sys.modules.get('whisper.transcribe')
+    if module is None or getattr(module, '_job_control_hooked', False):
+        return
+    tqdm_module = module.tqdm
+
+    class JobProgressBar(tqdm_module.tqdm):
+        def update(self, n=1):
+            checkpoint()
+            # tqdm doesn't count when it's disabled, as it is unless Whisper runs verbose
+            self.job_done = getattr(self, 'job_done', 0) + (n or 0)
+            if self.total:
+                report_progress('whisper', self.job_done / self.total * 100)
+            return super().update(n)
+
+    class TqdmShim:
+        tqdm = JobProgressBar
+
+    module.tqdm = TqdmShim
+    module._job_control_hooked = True
+
+def start_watchdog(job_store):
+    """Stop jobs in this process that ran past their timeout or scratch quota, or were cancelled through the job store."""
+    def watch():
+        while True:
+            time.sleep(WATCHDOG_INTERVAL)
+            try:
+                now = time.time()
+                with _contexts_lock:
+                    contexts = list(_contexts.values())
+                for context in contexts:
+                    if context.deadline is not None and now > context.deadline:
+                        context.stop('timeout')
+                    elif context.workspace is not None and scratch.over_quota(context.workspace):
+                        context.stop('quota', f"Job exceeded its scratch space quota of {scratch.JOB_SCRATCH_QUOTA_MB} MB")
+                if contexts:
+                    for job_id in job_store.cancel_requests():
+                        stop_job(job_id, 'cancelled')
+            except Exception as e:
+                logger.error(f"Job watchdog error - {str(e)}")
+
+    threading.Thread(target=watch, name="job-watchdog", daemon=True).start()
@@ -0,0 +1,151 @@
+import os
+import time
+import logging
+import threading
+from services.batch import send_job_webhooks
+
+logger = logging.getLogger(__name__)
+
+QUEUE_POLL_INTERVAL = float(os.environ.get('QUEUE_POLL_INTERVAL', 0.5))
+# Seconds between checks for jobs left running by workers that exited
+RECOVER_INTERVAL = 60
+
+class Job:
+    """A job claimed from the job store."""
+    def __init__(self, record):
+        self.job_id = record['job_id']
+        self.task = record['task']
+        self.data = record['data']
+        self.kwargs = record['kwargs']
+        self.queued_at = record['queued_at']
+        self.started_at = record['started_at']
+        self.endpoint = record['endpoint']
+        self.lane = record['lane']
+        self.priority = record['priority']
+        self.deadline = record['deadline']
+        self.tenant = record['tenant']
+
+class WorkerSlot:
+    """Bookkeeping for a single executor thread."""
+    def __init__(self, slot_id):
+        self.slot_id = slot_id
+        self.job_id = None
+        self.job_started_at = None
+        self.busy_time = 0.0
+        self.jobs_run = 0
+
+class JobExecutor:
+    """Runs queued jobs on a fixed pool of worker threads.
+
+    Slots claim jobs from the shared job store, so work queued by any gunicorn
+    worker in the container is picked up by whichever slot is idle first.
+    Each job is handed to `handler(job, slot)`. The heavy lifting in this API
+    happens in ffmpeg and Whisper, which release the GIL, so threads are
+    enough to keep several cores busy from one gunicorn worker.
+    """
+    def __init__(self, handler, store, workers=1):
+        self.handler = handler
+        self.store = store
+        self.slots = [WorkerSlot(i) for i in range(max(1, workers))]
+        self.started_at = time.time()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition()
+        self.draining = threading.Event()
+        self.last_recover = time.time()
+
+    def start(self):
+        for slot in self.slots:
+            threading.Thread(target=self._run, args=(slot,), name=f"job-worker-{slot.slot_id}", daemon=True).start()
+
+    def notify(self):
+        """Wake an idle slot in this process after a job was queued."""
+        with self.wakeup:
+            self.wakeup.notify()
+
+    def qsize(self):
+        return self.store.queue_length()
+
+    def _claim(self):
+        if self.draining.is_set():
+            return None
+        try:
+            if time.time() - self.last_recover > RECOVER_INTERVAL:
+                self.last_recover = time.time()
+                _, finished, completed_batches = self.store.recover()
+                send_job_webhooks(self.store, finished, completed_batches)
+            record = self.store.claim()
+        except Exception as e:
+            logger.error(f"Failed to claim a job from the job store - {str(e)}")
+            record = None
+        if record is None:
+            # Jobs queued by other workers are only seen on the next poll
+            with self.wakeup:
+                self.wakeup.wait(QUEUE_POLL_INTERVAL)
+            return None
+        return Job(record)
+
+    def _run(self, slot):
+        while not self.draining.is_set():
+            job = self._claim()
+            if job is None:
+                continue
+            started_at = time.time()
+            with self.lock:
+                slot.job_id = job.job_id
+                slot.job_started_at = started_at
+            try:
+                self.handler(job, slot)
+            except Exception as e:
+                logger.error(f"Job {job.job_id}: Unhandled error in worker slot {slot.slot_id} - {str(e)}", exc_info=True)
+            finally:
+                with self.lock:
+                    slot.busy_time += time.time() - started_at
+                    slot.jobs_run += 1
+                    slot.job_id = None
+                    slot.job_started_at = None
+
+    def running_jobs(self):
+        with self.lock:
+            return [slot.job_id for slot in self.slots if slot.job_id is not None]
+
+    def drain(self, timeout):
+        """Stop claiming jobs and wait up to `timeout` seconds for running ones to finish.
+
+        Returns the IDs of the jobs still running afterwards.
+        """
+        self.draining.set()
+        with self.wakeup:
+            self.wakeup.notify_all()
+        end = time.time() + timeout
+        while self.running_jobs() and time.time() < end:
+            time.sleep(min(0.5, max(0, end - time.time())))
+        return self.running_jobs()
+
+    def stats(self):
+        """Return queue length and per-slot utilization since the executor started."""
+        now = time.time()
+        uptime = max(now - self.started_at, 1e-9)
+        slots = []
+        with self.lock:
+            for slot in self.slots:
+                busy_time = slot.busy_time
+                if slot.job_started_at is not None:
+                    busy_time += now - slot.job_started_at
+                slots.append({
+                    "slot": slot.slot_id,
+                    "job_id": slot.job_id,
+                    "busy": slot.job_id is not None,
+                    "jobs_run": slot.jobs_run,
+                    "busy_time": round(busy_time, 3),
+                    "utilization": round(busy_time / uptime, 3)
+                })
+        return {
+            "draining": self.draining.is_set(),
+            "workers": len(slots),
+            "busy_workers": sum(1 for s in slots if s["busy"]),
+            "queue_length": self.qsize(),
+            "utilization": round(sum(s["utilization"] for s in slots) / len(slots), 3),
+            "uptime": round(uptime, 3),
+            "slots": slots,
+            "lanes": self.store.lane_stats()
+        }
@@ -0,0 +1,43 @@
+import os
+import json
+
+# Target queue latency per endpoint lane, in seconds. A job's default deadline
+# is its enqueue time plus its lane budget, so short conversions overtake long
+# transcriptions without starving them: once a long job's budget has elapsed
+# it is the most urgent job in the queue.
+LANE_BUDGETS = {
+    '/v1/toolkit/test': 30,
+    '/v1/media/transform/mp3': 60,
+    '/media-to-mp3': 60,
+    '/v1/image/transform/video': 120,
+    '/image-to-video': 120,
+    '/extract-keyframes': 120,
+    '/v1/code/execute/python': 120,
+    '/v1/video/concatenate': 300,
+    '/combine-videos': 300,
+    '/audio-mixing': 300,
+    '/v1/ffmpeg/compose': 600,
+    '/gdrive-upload': 900,
+    '/v1/video/caption': 1800,
+    '/caption-video': 1800,
+    '/v1/media/transcribe': 3600,
+    '/transcribe-media': 3600,
+}
+LANE_BUDGETS.update(json.loads(os.environ.get('LANE_BUDGETS', '{}')))
+DEFAULT_LANE_BUDGET = float(os.environ.get('DEFAULT_LANE_BUDGET', 600))
+
+# Queue-time statistics per lane cover jobs started within this many seconds
+LANE_STATS_WINDOW = int(os.environ.get('LANE_STATS_WINDOW', 3600))
+
+def lane_budget(lane):
+    return LANE_BUDGETS.get(lane, DEFAULT_LANE_BUDGET)
+
+def job_lane(endpoint):
+    return endpoint
+
+def job_priority(data):
+    return data.get('priority', 0)
+
+def job_deadline(data, lane, queued_at):
+    """Absolute deadline of a job: the client's `deadline` if given, else its lane budget."""
+    return queued_at + data.get('deadline', lane_budget(lane))
@@ -0,0 +1,631 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+import psutil
+from services.job_scheduler import job_lane, job_priority, job_deadline, LANE_STATS_WINDOW
+from services.idempotency import IDEMPOTENCY_TTL
+
+logger = logging.getLogger(__name__)
+
+JOB_DB_PATH = os.environ.get('JOB_DB_PATH', '/tmp/jobs.db')
+JOB_RETENTION = int(os.environ.get('JOB_RETENTION', 7 * 24 * 3600))
+
+TERMINAL_STATES = ('done', 'failed', 'cancelled', 'timeout')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    task TEXT NOT NULL,
+    endpoint TEXT NOT NULL,
+    data TEXT NOT NULL,
+    kwargs TEXT NOT NULL DEFAULT '{}',
+    webhook_url TEXT,
+    state TEXT NOT NULL,
+    owner TEXT,
+    queued_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    code INTEGER,
+    result TEXT,
+    error TEXT,
+    lane TEXT,
+    priority INTEGER NOT NULL DEFAULT 0,
+    deadline REAL,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    idempotency_key TEXT,
+    stage TEXT,
+    progress REAL,
+    updated_at REAL,
+    tenant TEXT NOT NULL DEFAULT '',
+    weight REAL NOT NULL DEFAULT 1,
+    fair_charge REAL
+);
+CREATE TABLE IF NOT EXISTS job_webhooks (
+    job_id TEXT NOT NULL,
+    webhook_url TEXT NOT NULL,
+    PRIMARY KEY (job_id, webhook_url)
+);
+CREATE TABLE IF NOT EXISTS batches (
+    batch_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    webhook_url TEXT,
+    tenant TEXT NOT NULL DEFAULT '',
+    created_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE TABLE IF NOT EXISTS batch_jobs (
+    batch_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    job_id TEXT NOT NULL,
+    PRIMARY KEY (batch_id, position)
+);
+CREATE TABLE IF NOT EXISTS tenant_usage (
+    tenant TEXT PRIMARY KEY,
+    vtime REAL NOT NULL
+);
+"""
+
+# Columns added after the first release, created on databases that predate them (new ones get them from SCHEMA)
+MIGRATIONS = [
+    ("lane", "TEXT"),
+    ("priority", "INTEGER NOT NULL DEFAULT 0"),
+    ("deadline", "REAL"),
+    ("cancel_requested", "INTEGER NOT NULL DEFAULT 0"),
+    ("idempotency_key", "TEXT"),
+    ("stage", "TEXT"),
+    ("progress", "REAL"),
+    ("updated_at", "REAL"),
+    ("tenant", "TEXT NOT NULL DEFAULT ''"),
+    ("weight", "REAL NOT NULL DEFAULT 1"),
+    ("fair_charge", "REAL"),
+]
+
+# Batch jobs are asynchronous even without a webhook: their results are collected by the batch
+IN_BATCH = "EXISTS (SELECT 1 FROM batch_jobs WHERE batch_jobs.job_id = jobs.job_id) AS in_batch"
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state);
+CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (state, priority DESC, deadline);
+CREATE INDEX IF NOT EXISTS jobs_tenant_queue ON jobs (state, tenant, priority DESC, deadline);
+CREATE INDEX IF NOT EXISTS jobs_lane_started ON jobs (lane, started_at);
+CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished_at);
+CREATE INDEX IF NOT EXISTS jobs_idempotency ON jobs (idempotency_key, state);
+CREATE INDEX IF NOT EXISTS batch_jobs_job ON batch_jobs (job_id);
+"""
+
+_owners = {}
+
+def process_owner(pid=None):
+    """Identify a worker process by PID and start time, so a reused PID is not mistaken for its predecessor."""
+    if pid is None:
+        pid = os.getpid()
+        if pid not in _owners:
+            _owners[pid] = process_owner(pid)
+        return _owners[pid]
+    process = psutil.Process(pid)
+    return f"{process.pid}:{process.create_time()}"
+
+def owner_alive(owner):
+    try:
+        pid = int(owner.split(':')[0])
+        return process_owner(pid) == owner
+    except (psutil.Error, ValueError, AttributeError):
+        return False
+
+class SQLiteStore:
+    """Tables in the SQLite database shared by every worker in the container.
+
+    Each thread gets its own connection, in autocommit mode with rows that
+    can be read by index or column name. The database is switched to WAL so
+    readers never block the writer.
+    """
+    def __init__(self, path=JOB_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        for attempt in range(100):
+            try:
+                self._connect().execute("PRAGMA journal_mode=WAL")
+                break
+            except sqlite3.OperationalError:
+                # Switching to WAL ignores the busy timeout while another worker is setting up the database
+                if attempt == 99:
+                    raise
+                time.sleep(0.1)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+class JobStore(SQLiteStore):
+    """Persistent record of every job, kept in a local SQLite database.
+
+    The table doubles as the job queue for the whole container: every
+    gunicorn worker enqueues into it and every executor slot claims the next
+    job from it, so an idle worker picks up work accepted by a busy sibling.
+    Writes are small and autocommitted.
+    """
+    def __init__(self, path=JOB_DB_PATH):
+        super().__init__(path)
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+        # Every worker starts at once: only one of them may check and add the missing columns
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            columns = {row['name'] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for column, definition in MIGRATIONS:
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {definition}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.executescript(INDEXES)
+        # Same value in every worker sharing this database
+        self.queue_id = os.stat(path).st_ino
+
+    def create(self, job_id, task, endpoint, data, kwargs=None, state='queued', queued_at=None, idempotency_key=None,
+               tenant='', weight=1):
+        """Record a new job. Returns None, or the existing job if `idempotency_key` matches one (see find_duplicate).
+
+        `tenant` and `weight` identify the client the job is scheduled for (see claim).
+        """
+        queued_at = queued_at or time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            duplicate = self._find_duplicate(conn, idempotency_key, data.get('webhook_url'))
+            if duplicate is None:
+                self._join(conn, tenant)
+                self._insert(conn, job_id, task, endpoint, data, kwargs, state, queued_at, idempotency_key, tenant, weight)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return duplicate
+
+    @staticmethod
+    def _insert(conn, job_id, task, endpoint, data, kwargs, state, queued_at, idempotency_key, tenant, weight):
+        lane = job_lane(endpoint)
+        conn.execute(
+            "INSERT INTO jobs (job_id, task, endpoint, data, kwargs, webhook_url, state, owner, queued_at, "
+            "started_at, lane, priority, deadline, idempotency_key, tenant, weight) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, task, endpoint, json.dumps(data), json.dumps(kwargs or {}), data.get('webhook_url'),
+             state, process_owner() if state == 'running' else None, queued_at,
+             time.time() if state == 'running' else None, lane, job_priority(data),
+             job_deadline(data, lane, queued_at), idempotency_key, tenant, weight)
+        )
+
+    def create_batch(self, batch_id, data, jobs, tenant='', weight=1):
+        """Record a batch and queue its jobs in a single transaction.
+
+        `jobs` are dicts with the job_id, task, endpoint, data and
+        idempotency_key of each item. Items that duplicate a job in flight or
+        recently done are linked to that job instead (see find_duplicate).
+        Returns the job ID of every item, in order.
+        """
+        queued_at = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._join(conn, tenant)
+            conn.execute("INSERT INTO batches (batch_id, data, webhook_url, tenant, created_at) VALUES (?, ?, ?, ?, ?)",
+                         (batch_id, json.dumps(data), data.get('webhook_url'), tenant, queued_at))
+            job_ids = []
+            for position, job in enumerate(jobs):
+                duplicate = self._find_duplicate(conn, job['idempotency_key'], job['data'].get('webhook_url'))
+                if duplicate is None:
+                    self._insert(conn, job['job_id'], job['task'], job['endpoint'], job['data'], None, 'queued',
+                                 queued_at, job['idempotency_key'], tenant, weight)
+                job_id = duplicate['job_id'] if duplicate else job['job_id']
+                conn.execute("INSERT INTO batch_jobs (batch_id, position, job_id) VALUES (?, ?, ?)",
+                             (batch_id, position, job_id))
+                job_ids.append(job_id)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return job_ids
+
+    def _complete_batches(self, conn, batch_ids):
+        """Mark the batches whose jobs have all finished. Returns those that weren't marked before."""
+        completed = []
+        for batch_id in batch_ids:
+            pending = conn.execute(
+                f"SELECT 1 FROM batch_jobs JOIN jobs USING (job_id) WHERE batch_id = ? "
+                f"AND jobs.state NOT IN {TERMINAL_STATES} LIMIT 1", (batch_id,)
+            ).fetchone()
+            if pending is None and conn.execute(
+                "UPDATE batches SET finished_at = ? WHERE batch_id = ? AND finished_at IS NULL", (time.time(), batch_id)
+            ).rowcount:
+                completed.append(batch_id)
+        return completed
+
+    def complete_batch(self, batch_id):
+        """Mark a batch finished if all its jobs are. Returns True if this call did so."""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            completed = self._complete_batches(conn, [batch_id])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return bool(completed)
+
+    def batch(self, batch_id):
+        """A batch with the current state of its jobs, in order, or None if it doesn't exist."""
+        conn = self._connect()
+        row = conn.execute("SELECT * FROM batches WHERE batch_id = ?", (batch_id,)).fetchone()
+        if row is None:
+            return None
+        batch = dict(row)
+        batch['data'] = json.loads(batch['data'])
+        batch['jobs'] = []
+        for (job_id,) in conn.execute("SELECT job_id FROM batch_jobs WHERE batch_id = ? ORDER BY position", (batch_id,)):
+            job = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            # A linked job of another batch may already have been purged
+            batch['jobs'].append(self._to_dict(job) if job else {"job_id": job_id, "state": None})
+        return batch
+
+    def find_duplicate(self, idempotency_key, webhook_url=None):
+        """Return a queued, running, or recently done job with this idempotency key, or None.
+
+        If the job is still in flight, `webhook_url` is attached to it so it
+        is notified too when the job finishes.
+        """
+        if idempotency_key is None:
+            return None
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            duplicate = self._find_duplicate(conn, idempotency_key, webhook_url)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return duplicate
+
+    def _find_duplicate(self, conn, idempotency_key, webhook_url):
+        if idempotency_key is None:
+            return None
+        row = conn.execute(
+            "SELECT * FROM jobs WHERE idempotency_key = ? AND (state IN ('queued', 'running') "
+            "OR (state = 'done' AND finished_at >= ?)) ORDER BY queued_at DESC LIMIT 1",
+            (idempotency_key, time.time() - IDEMPOTENCY_TTL)
+        ).fetchone()
+        if row is None:
+            return None
+        if row['state'] != 'done' and webhook_url and webhook_url != row['webhook_url']:
+            conn.execute("INSERT OR IGNORE INTO job_webhooks (job_id, webhook_url) VALUES (?, ?)",
+                         (row['job_id'], webhook_url))
+        return self._to_dict(row)
+
+    def webhooks(self, job_id):
+        """Every webhook to notify when a job finishes: its own plus those of attached duplicates."""
+        job = self.get(job_id)
+        urls = [job['webhook_url']] if job and job['webhook_url'] else []
+        urls.extend(row[0] for row in self._connect().execute(
+            "SELECT webhook_url FROM job_webhooks WHERE job_id = ? ORDER BY rowid", (job_id,)
+        ))
+        return urls
+
+    def _join(self, conn, tenant):
+        """Bring the virtual time of a tenant that had no jobs up to that of the busy tenants.
+
+        Without this, a tenant that was idle while others kept the slots busy
+        would have the slots to itself until its virtual time caught up.
+        """
+        if conn.execute("SELECT 1 FROM jobs WHERE tenant = ? AND state IN ('queued', 'running') LIMIT 1",
+                        (tenant,)).fetchone():
+            return
+        floor = conn.execute(
+            "SELECT MIN(vtime) FROM tenant_usage WHERE tenant IN "
+            "(SELECT DISTINCT tenant FROM jobs WHERE state IN ('queued', 'running'))"
+        ).fetchone()[0]
+        if floor is not None:
+            conn.execute("INSERT INTO tenant_usage (tenant, vtime) VALUES (?, ?) "
+                         "ON CONFLICT (tenant) DO UPDATE SET vtime = MAX(vtime, excluded.vtime)", (tenant, floor))
+
+    @staticmethod
+    def _charge(conn, tenant, amount):
+        conn.execute("INSERT INTO tenant_usage (tenant, vtime) VALUES (?, ?) "
+                     "ON CONFLICT (tenant) DO UPDATE SET vtime = vtime + excluded.vtime", (tenant, amount))
+
+    def claim(self):
+        """Atomically take the next queued job for this process, or None if the queue is empty.
+
+        Weighted fair queueing across tenants: the job comes from the tenant
+        with the least weighted run time (its virtual time), and within that
+        tenant the highest priority, then earliest deadline wins. Claiming a
+        job charges its tenant the lane's recent average run time divided by
+        its weight; finish() corrects the charge to the actual run time.
+        """
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            tenant = conn.execute(
+                "SELECT queued.tenant FROM (SELECT DISTINCT tenant FROM jobs WHERE state = 'queued') AS queued "
+                "LEFT JOIN tenant_usage USING (tenant) ORDER BY COALESCE(tenant_usage.vtime, 0) LIMIT 1"
+            ).fetchone()
+            row = None if tenant is None else conn.execute(
+                "SELECT * FROM jobs WHERE state = 'queued' AND tenant = ? ORDER BY priority DESC, deadline, queued_at LIMIT 1",
+                (tenant[0],)
+            ).fetchone()
+            if row is not None:
+                started_at = time.time()
+                cost = conn.execute(
+                    "SELECT AVG(finished_at - started_at) FROM jobs WHERE lane = ? AND finished_at >= ? "
+                    "AND started_at IS NOT NULL", (row['lane'], started_at - LANE_STATS_WINDOW)
+                ).fetchone()[0] or 1
+                conn.execute("UPDATE jobs SET state = 'running', owner = ?, started_at = ?, fair_charge = ? WHERE job_id = ?",
+                             (process_owner(), started_at, cost, row['job_id']))
+                self._charge(conn, row['tenant'], cost / row['weight'])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        job = self._to_dict(row)
+        job.update(state='running', started_at=started_at)
+        return job
+
+    def set_progress(self, job_id, stage, progress=None):
+        """Record the stage a running job is in and its percent complete (None if unknown)."""
+        self._connect().execute(
+            "UPDATE jobs SET stage = ?, progress = ?, updated_at = ? WHERE job_id = ? AND state = 'running'",
+            (stage, progress, time.time(), job_id)
+        )
+
+    def finish(self, job_id, code, result, state=None):
+        """Record the final response payload of a job. Returns the IDs of the batches it was the last job of."""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            completed = self._finish(conn, job_id, code, result, state)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return completed
+
+    def _finish(self, conn, job_id, code, result, state=None):
+        state = state or ('done' if code == 200 else 'failed')
+        error = None if code == 200 else str(result.get('message'))
+        finished_at = time.time()
+        row = conn.execute("SELECT tenant, weight, started_at, fair_charge FROM jobs WHERE job_id = ?",
+                           (job_id,)).fetchone()
+        conn.execute(
+            "UPDATE jobs SET state = ?, finished_at = ?, code = ?, result = ?, error = ? WHERE job_id = ?",
+            (state, finished_at, code, json.dumps(result, default=str), error, job_id)
+        )
+        if row is not None and row['fair_charge'] is not None:
+            # Replace the estimate charged at claim time with the actual run time
+            self._charge(conn, row['tenant'], (finished_at - row['started_at'] - row['fair_charge']) / row['weight'])
+        return self._complete_batches(conn, [batch_id for (batch_id,) in conn.execute(
+            "SELECT DISTINCT batch_id FROM batch_jobs WHERE job_id = ?", (job_id,))])
+
+    def _abandon(self, conn, row, code, message, state=None):
+        """Finish a job no worker will complete. Returns its result payload and the batches it completed."""
+        now = time.time()
+        result = {
+            "endpoint": row['endpoint'],
+            "code": code,
+            "id": json.loads(row['data']).get('id'),
+            "job_id": row['job_id'],
+            "response": None,
+            "message": message,
+            "queue_time": round((row['started_at'] or now) - row['queued_at'], 3),
+            "total_time": round(now - row['queued_at'], 3)
+        }
+        return result, self._finish(conn, row['job_id'], code, result, state)
+
+    def cancel(self, job_id):
+        """Cancel a job. Returns the job as it was before, or None if it doesn't exist.
+
+        A queued job is marked cancelled straight away. A running job is only
+        flagged; the worker running it stops it on its next watchdog pass.
+        Finished jobs are left untouched.
+        """
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is not None and row['state'] == 'queued':
+                conn.execute(
+                    "UPDATE jobs SET state = 'cancelled', finished_at = ?, code = 499, error = 'cancelled' WHERE job_id = ?",
+                    (time.time(), job_id)
+                )
+            elif row is not None and row['state'] == 'running':
+                conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE job_id = ?", (job_id,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return self._to_dict(row) if row else None
+
+    def cancel_requests(self):
+        """IDs of jobs running in this process that a client asked to cancel."""
+        return [row[0] for row in self._connect().execute(
+            "SELECT job_id FROM jobs WHERE state = 'running' AND cancel_requested = 1 AND owner = ?",
+            (process_owner(),)
+        )]
+
+    def get(self, job_id):
+        row = self._connect().execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def queue_length(self, lane=None):
+        if lane is None:
+            return self._connect().execute("SELECT COUNT(*) FROM jobs WHERE state = 'queued'").fetchone()[0]
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM jobs WHERE state = 'queued' AND lane = ?", (lane,)
+        ).fetchone()[0]
+
+    def active_counts(self):
+        """Number of queued and running jobs per lane, as {lane: {"queued": n, "running": n}}."""
+        counts = {}
+        for row in self._connect().execute(
+            "SELECT lane, state, COUNT(*) AS count FROM jobs WHERE state IN ('queued', 'running') GROUP BY lane, state"
+        ):
+            counts.setdefault(row['lane'], {"queued": 0, "running": 0})[row['state']] = row['count']
+        return counts
+
+    def running_count(self):
+        return self._connect().execute("SELECT COUNT(*) FROM jobs WHERE state = 'running'").fetchone()[0]
+
+    def average_run_time(self, window=LANE_STATS_WINDOW):
+        """Mean run time of jobs finished in the last `window` seconds, or None if there were none."""
+        return self._connect().execute(
+            "SELECT AVG(finished_at - started_at) FROM jobs WHERE finished_at >= ? AND started_at IS NOT NULL",
+            (time.time() - window,)
+        ).fetchone()[0]
+
+    def lane_stats(self, lane=None, window=LANE_STATS_WINDOW):
+        """Queued count and queue-time statistics of jobs started in the last `window` seconds, per lane."""
+        conn = self._connect()
+        where, params = ("AND lane = ?", (lane,)) if lane is not None else ("", ())
+        stats = {}
+        for row in conn.execute(
+            f"SELECT lane, COUNT(*) AS jobs, AVG(started_at - queued_at) AS avg_queue_time, "
+            f"MAX(started_at - queued_at) AS max_queue_time FROM jobs "
+            f"WHERE started_at >= ? {where} GROUP BY lane", (time.time() - window,) + params
+        ):
+            stats[row['lane']] = {
+                "queued": 0,
+                "jobs": row['jobs'],
+                "avg_queue_time": round(row['avg_queue_time'], 3),
+                "max_queue_time": round(row['max_queue_time'], 3)
+            }
+        for row in conn.execute(
+            f"SELECT lane, COUNT(*) AS queued FROM jobs WHERE state = 'queued' {where} GROUP BY lane", params
+        ):
+            stats.setdefault(row['lane'], {"jobs": 0, "avg_queue_time": 0, "max_queue_time": 0})
+            stats[row['lane']]["queued"] = row['queued']
+        if lane is not None:
+            return stats.get(lane, {"queued": 0, "jobs": 0, "avg_queue_time": 0, "max_queue_time": 0})
+        return stats
+
+    def _requeue(self, conn, row):
+        """Put a running job back in the queue and refund what claiming it charged its tenant."""
+        conn.execute("UPDATE jobs SET state = 'queued', owner = NULL, started_at = NULL, fair_charge = NULL WHERE job_id = ?",
+                     (row['job_id'],))
+        if row['fair_charge'] is not None:
+            self._charge(conn, row['tenant'], -row['fair_charge'] / row['weight'])
+
+    def tenant_stats(self, window=LANE_STATS_WINDOW):
+        """Queued and running jobs, queue-time statistics of jobs started in the last `window` seconds, per tenant."""
+        conn = self._connect()
+        stats = {}
+        def entry(tenant):
+            return stats.setdefault(tenant, {"queued": 0, "running": 0, "jobs": 0, "avg_queue_time": 0, "max_queue_time": 0})
+        for row in conn.execute(
+            "SELECT tenant, COUNT(*) AS jobs, AVG(started_at - queued_at) AS avg_queue_time, "
+            "MAX(started_at - queued_at) AS max_queue_time FROM jobs WHERE started_at >= ? GROUP BY tenant",
+            (time.time() - window,)
+        ):
+            entry(row['tenant']).update(jobs=row['jobs'], avg_queue_time=round(row['avg_queue_time'], 3),
+                                        max_queue_time=round(row['max_queue_time'], 3))
+        for row in conn.execute(
+            "SELECT tenant, state, COUNT(*) AS count FROM jobs WHERE state IN ('queued', 'running') GROUP BY tenant, state"
+        ):
+            entry(row['tenant'])[row['state']] = row['count']
+        return stats
+
+    def release(self, job_ids):
+        """Hand running jobs of this process back to the queue, or fail them if they are synchronous.
+
+        Used when a worker shuts down before its jobs finish. Returns the
+        number of jobs requeued, the result payloads of the jobs failed and
+        the IDs of the batches those completed, for the caller to send
+        their webhooks.
+        """
+        conn = self._connect()
+        owner = process_owner()
+        requeued, finished, completed = 0, [], []
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for job_id in job_ids:
+                row = conn.execute(f"SELECT *, {IN_BATCH} FROM jobs WHERE job_id = ? AND state = 'running' AND owner = ?",
+                                   (job_id, owner)).fetchone()
+                if row is None:
+                    continue
+                if row['webhook_url'] or row['in_batch']:
+                    self._requeue(conn, row)
+                    requeued += 1
+                else:
+                    result, batches = self._abandon(conn, row, 503, "Worker shut down before the job finished")
+                    finished.append(result)
+                    completed.extend(batches)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return requeued, finished, completed
+
+    def recover(self):
+        """Release running jobs whose owning worker process is gone.
+
+        Async jobs (those with a webhook or in a batch) go back to the queue
+        for any worker to claim. Sync jobs can't be resumed, so they are
+        marked failed; a request waiting for one in another worker picks up
+        the failure from the store. Jobs a client asked to cancel are marked
+        cancelled. Returns the number of jobs requeued, the result payloads
+        of the jobs failed or cancelled and the IDs of the batches those
+        completed, for the caller to send their webhooks.
+        """
+        conn = self._connect()
+        owner = process_owner()
+        requeued, finished, completed = 0, [], []
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(f"SELECT *, {IN_BATCH} FROM jobs WHERE state = 'running' AND owner != ?",
+                                (owner,)).fetchall()
+            for row in rows:
+                if owner_alive(row['owner']):
+                    continue
+                if row['cancel_requested']:
+                    result, batches = self._abandon(conn, row, 499, "cancelled", state='cancelled')
+                elif row['webhook_url'] or row['in_batch']:
+                    self._requeue(conn, row)
+                    requeued += 1
+                    continue
+                else:
+                    result, batches = self._abandon(conn, row, 500, "Worker exited before the job finished")
+                finished.append(result)
+                completed.extend(batches)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return requeued, finished, completed
+
+    def purge(self, older_than=JOB_RETENTION):
+        """Delete finished jobs older than `older_than` seconds."""
+        conn = self._connect()
+        cursor = conn.execute(
+            f"DELETE FROM jobs WHERE state IN {TERMINAL_STATES} AND finished_at < ?", (time.time() - older_than,)
+        )
+        conn.execute("DELETE FROM job_webhooks WHERE job_id NOT IN (SELECT job_id FROM jobs)")
+        conn.execute("DELETE FROM batches WHERE finished_at < ?", (time.time() - older_than,))
+        conn.execute("DELETE FROM batch_jobs WHERE batch_id NOT IN (SELECT batch_id FROM batches)")
+        return cursor.rowcount
+
+    @staticmethod
+    def _to_dict(row):
+        job = dict(row)
+        job['data'] = json.loads(job['data'])
+        job['kwargs'] = json.loads(job['kwargs'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
@@ -0,0 +1,118 @@
+import os
+import json
+import logging
+import threading
+import subprocess
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+PROBE_CACHE_SIZE = int(os.environ.get('PROBE_CACHE_SIZE', 512))
+# Seconds ffprobe may take to read the headers of a file
+PROBE_TIMEOUT = 60
+
+class ProbeError(Exception):
+    """ffprobe could not read a file."""
+
+class MediaInfo:
+    """What ffprobe reports about a media file: its format and streams."""
+    def __init__(self, data):
+        self.data = data
+        self.format = data.get('format', {})
+        self.streams = data.get('streams', [])
+
+    def _streams(self, codec_type):
+        return [stream for stream in self.streams if stream.get('codec_type') == codec_type]
+
+    @property
+    def duration(self):
+        """Duration in seconds, from the container or else the longest stream, or None if unknown."""
+        def seconds(value):
+            try:
+                return float(value)
+            except (TypeError, ValueError):
+                return None
+        duration = seconds(self.format.get('duration'))
+        if duration is not None:
+            return duration
+        durations = [d for d in (seconds(stream.get('duration')) for stream in self.streams) if d is not None]
+        return max(durations) if durations else None
+
+    @property
+    def bit_rate(self):
+        try:
+            return int(self.format['bit_rate'])
+        except (KeyError, ValueError):
+            return None
+
+    @property
+    def video(self):
+        """The first video stream, or None."""
+        streams = self._streams('video')
+        return streams[0] if streams else None
+
+    @property
+    def audio(self):
+        """The first audio stream, or None."""
+        streams = self._streams('audio')
+        return streams[0] if streams else None
+
+    @property
+    def resolution(self):
+        """(width, height) of the first video stream, or None."""
+        video = self.video
+        if video is None or not video.get('width') or not video.get('height'):
+            return None
+        return int(video['width']), int(video['height'])
+
+    @property
+    def codecs(self):
+        """Codec name of the first stream of each type, e.g. {"video": "h264", "audio": "aac"}."""
+        codecs = {}
+        for stream in self.streams:
+            codecs.setdefault(stream.get('codec_type'), stream.get('codec_name', 'unknown'))
+        return codecs
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def _cache_key(path):
+    # Hard links share an inode, so every job's link to an input cache entry shares one probe
+    stat = os.stat(path)
+    return (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+def probe(path):
+    """Inspect a media file with a single ffprobe run, cached until the file changes.
+
+    Raises ProbeError if ffprobe can't read it.
+    """
+    try:
+        key = _cache_key(path)
+    except OSError as e:
+        raise ProbeError(f"Cannot probe {path} - {str(e)}")
+    with _cache_lock:
+        info = _cache.get(key)
+        if info is not None:
+            _cache.move_to_end(key)
+            return info
+
+    # Imported here because job_control probes the inputs of ffmpeg commands with this module
+    from services import job_control
+    cmd = ['ffprobe', '-v', 'error', '-print_format', 'json', '-show_format', '-show_streams', path]
+    try:
+        # Killed with the rest of the job's processes if the job is stopped
+        result = job_control.run_subprocess(cmd, capture_output=True, text=True, timeout=PROBE_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        raise ProbeError(f"Cannot probe {path} - {str(e)}")
+    if result.returncode:
+        raise ProbeError(f"Cannot probe {path} - {result.stderr.strip()}")
+    try:
+        info = MediaInfo(json.loads(result.stdout))
+    except ValueError as e:
+        raise ProbeError(f"Cannot parse ffprobe output for {path} - {str(e)}")
+
+    with _cache_lock:
+        _cache[key] = info
+        while len(_cache) > PROBE_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return info
@@ -0,0 +1,165 @@
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from services.job_store import SQLiteStore, JOB_DB_PATH
+from services import scratch
+
+logger = logging.getLogger(__name__)
+
+# Histogram bucket upper bounds, in seconds
+TIME_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+# Finer bounds for single requests, such as the upload of one keyframe
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+# name: (type, help)
+METRICS = {
+    "nca_job_queue_seconds": ("histogram", "Time jobs spent waiting in the queue before they started running."),
+    "nca_job_run_seconds": ("histogram", "Time jobs spent running."),
+    "nca_jobs_total": ("counter", "Finished jobs by endpoint, tenant and final state."),
+    "nca_jobs_rejected_total": ("counter", "Jobs rejected by admission control or rate limits, by endpoint, tenant and response code."),
+    "nca_stage_seconds": ("histogram", "Duration of processing stages (ffmpeg, ffprobe, whisper, download, upload)."),
+    "nca_downloaded_bytes_total": ("counter", "Bytes of input media downloaded."),
+    "nca_uploaded_bytes_total": ("counter", "Bytes of output files uploaded to cloud storage."),
+    "nca_upload_seconds": ("histogram", "Duration of single file uploads to cloud storage, by provider and result."),
+    "nca_webhooks_total": ("counter", "Webhook deliveries by result."),
+    "nca_result_cache_total": ("counter", "Result cache lookups by result (hit, miss, uncacheable)."),
+    "nca_input_cache_total": ("counter", "Input downloads by input cache result (hit, miss, uncacheable)."),
+    "nca_scratch_removed_bytes_total": ("counter", "Bytes of job scratch files removed, by reason (job, orphan, stale)."),
+    "nca_scratch_bytes": ("gauge", "Bytes used by the workspaces of running jobs."),
+    "nca_queue_depth": ("gauge", "Jobs waiting in the queue, by lane."),
+    "nca_tenant_queue_depth": ("gauge", "Jobs waiting in the queue, by tenant."),
+    "nca_jobs_running": ("gauge", "Jobs currently running in the container."),
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metrics (
+    name TEXT NOT NULL,
+    labels TEXT NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (name, labels)
+);
+"""
+
+class MetricsStore(SQLiteStore):
+    """Counters and histograms shared by every gunicorn worker in the container.
+
+    Values live in a table next to the jobs in the job store database, so a
+    scrape served by any worker sees the totals of all of them. Every
+    observation is one small transaction; observations happen once per job
+    or stage, not per frame or chunk.
+    """
+    def __init__(self, path=JOB_DB_PATH):
+        super().__init__(path)
+        self._connect().executescript(SCHEMA)
+
+    def _add(self, conn, name, labels, amount):
+        conn.execute(
+            "INSERT INTO metrics (name, labels, value) VALUES (?, ?, ?) "
+            "ON CONFLICT (name, labels) DO UPDATE SET value = value + excluded.value",
+            (name, json.dumps(labels, sort_keys=True), amount)
+        )
+
+    def inc(self, name, amount=1, **labels):
+        self._add(self._connect(), name, labels, amount)
+
+    def observe(self, name, value, buckets=TIME_BUCKETS, **labels):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for bound in buckets:
+                self._add(conn, f"{name}_bucket", dict(labels, le=str(bound)), 1 if value <= bound else 0)
+            self._add(conn, f"{name}_bucket", dict(labels, le="+Inf"), 1)
+            self._add(conn, f"{name}_sum", labels, value)
+            self._add(conn, f"{name}_count", labels, 1)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def samples(self):
+        return [(name, json.loads(labels), value) for name, labels, value in
+                self._connect().execute("SELECT name, labels, value FROM metrics ORDER BY name, labels")]
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = MetricsStore()
+    return _store
+
+def inc(name, amount=1, **labels):
+    """Increment a counter. Metrics never make the work they measure fail."""
+    try:
+        get_store().inc(name, amount, **labels)
+    except Exception as e:
+        logger.warning(f"Failed to record metric {name} - {str(e)}")
+
+def observe(name, value, buckets=TIME_BUCKETS, **labels):
+    """Add an observation to a histogram. A histogram must always be observed with the same buckets."""
+    try:
+        get_store().observe(name, value, buckets, **labels)
+    except Exception as e:
+        logger.warning(f"Failed to record metric {name} - {str(e)}")
+
+def record_job(endpoint, state, queue_time, run_time, tenant=None):
+    labels = {"endpoint": endpoint, "tenant": tenant} if tenant else {"endpoint": endpoint}
+    observe("nca_job_queue_seconds", queue_time, **labels)
+    observe("nca_job_run_seconds", run_time, **labels)
+    inc("nca_jobs_total", state=state, **labels)
+
+@contextmanager
+def stage_timer(stage):
+    """Time a processing stage, whether it succeeds or not."""
+    start = time.time()
+    try:
+        yield
+    finally:
+        observe("nca_stage_seconds", time.time() - start, stage=stage)
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in labels.values())
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(labels.keys(), escaped)) + "}"
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+def _sort_key(sample):
+    name, labels, _ = sample
+    other = sorted((k, v) for k, v in labels.items() if k != "le")
+    le = labels.get("le")
+    return (name, other, float(le) if le is not None else 0)
+
+def _base_name(name):
+    for suffix in ("_bucket", "_sum", "_count"):
+        if name.endswith(suffix) and name[:-len(suffix)] in METRICS:
+            return name[:-len(suffix)]
+    return name
+
+def render(job_store):
+    """Return all metrics in the Prometheus text exposition format."""
+    samples = {}
+    for name, labels, value in get_store().samples():
+        samples.setdefault(_base_name(name), []).append((name, labels, value))
+
+    samples["nca_queue_depth"] = [("nca_queue_depth", {"lane": lane}, stats["queued"])
+                                  for lane, stats in sorted(job_store.lane_stats().items())]
+    samples["nca_tenant_queue_depth"] = [("nca_tenant_queue_depth", {"tenant": tenant}, stats["queued"])
+                                         for tenant, stats in sorted(job_store.tenant_stats().items())]
+    samples["nca_jobs_running"] = [("nca_jobs_running", {}, job_store.running_count())]
+    samples["nca_scratch_bytes"] = [("nca_scratch_bytes", {}, scratch.scratch_usage())]
+
+    lines = []
+    for metric, (metric_type, help_text) in METRICS.items():
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {metric_type}")
+        for name, labels, value in sorted(samples.get(metric, []), key=_sort_key):
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
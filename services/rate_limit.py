@@ -0,0 +1,57 @@
+import time
+import logging
+import threading
+from services.job_store import SQLiteStore, JOB_DB_PATH
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rate_limits (
+    tenant TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+class RateLimiter(SQLiteStore):
+    """Token buckets per tenant, shared by every gunicorn worker through the job store database."""
+    def __init__(self, path=JOB_DB_PATH):
+        super().__init__(path)
+        self._connect().executescript(SCHEMA)
+
+    def take(self, tenant, tokens=1):
+        """Take tokens from the tenant's bucket. Returns 0, or the seconds until they are available.
+
+        Taking more than the bucket holds (a large batch) only needs a full
+        bucket and leaves it in debt, so the tenant's average rate still holds.
+        """
+        if tenant.rate <= 0:
+            return 0
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated_at FROM rate_limits WHERE tenant = ?", (tenant.name,)).fetchone()
+            available = tenant.burst if row is None else min(tenant.burst, row[0] + (now - row[1]) * tenant.rate)
+            needed = min(tokens, tenant.burst)
+            wait = 0 if available >= needed else (needed - available) / tenant.rate
+            if not wait:
+                available -= tokens
+            conn.execute("INSERT OR REPLACE INTO rate_limits (tenant, tokens, updated_at) VALUES (?, ?, ?)",
+                         (tenant.name, available, now))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+def get_limiter():
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = RateLimiter()
+    return _limiter
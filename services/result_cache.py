@@ -0,0 +1,170 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+import requests
+from functools import wraps
+from urllib.parse import urlparse
+from services.job_store import SQLiteStore, JOB_DB_PATH
+from services.idempotency import DELIVERY_FIELDS
+from services import job_control
+from services.metrics import inc
+from services.file_management import headers_fingerprint, get_session, source_url
+from version import BUILD_NUMBER
+
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE = os.environ.get('RESULT_CACHE', 'false').lower() == 'true'
+RESULT_CACHE_TTL = int(os.environ.get('RESULT_CACHE_TTL', 7 * 24 * 3600))
+RESULT_CACHE_MAX_MB = int(os.environ.get('RESULT_CACHE_MAX_MB', 10240))
+HEAD_TIMEOUT = 10
+# Schemes of inputs fetched by URL, whose content is fingerprinted
+URL_SCHEMES = ('http', 'https', 'gs', 's3')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS result_cache (
+    key TEXT PRIMARY KEY,
+    result TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS result_cache_used ON result_cache (used_at);
+"""
+
+def content_fingerprint(url):
+    """Identify the content behind a URL from its HEAD response, or None if the server gives nothing to go on.
+
+    gs:// and s3:// URIs are read through a signed URL, which is only valid
+    for GET, so their headers come from a one-byte ranged GET instead.
+    """
+    try:
+        fetch_url = source_url(url)
+        if fetch_url == url:
+            response = get_session().head(url, allow_redirects=True, timeout=HEAD_TIMEOUT)
+            headers = response.headers
+        else:
+            with get_session().get(fetch_url, headers={'Range': 'bytes=0-0'}, stream=True, timeout=HEAD_TIMEOUT) as response:
+                headers = dict(response.headers)
+            if response.status_code == 206:
+                headers['Content-Length'] = response.headers.get('Content-Range', '').rpartition('/')[2]
+        response.raise_for_status()
+    except (requests.RequestException, ValueError) as e:
+        logger.info(f"Cannot fingerprint {url} for the result cache - {str(e)}")
+        return None
+    return headers_fingerprint(headers)
+
+class ResultCache(SQLiteStore):
+    """Maps a hash of a normalized request and its input content to the result it produced.
+
+    Entries expire after RESULT_CACHE_TTL seconds, and the least recently
+    used entries are forgotten once the outputs they point to add up to more
+    than RESULT_CACHE_MAX_MB. The uploaded files themselves are never deleted.
+    The table lives in the job store database so all workers share it.
+    """
+    def __init__(self, path=JOB_DB_PATH, ttl=RESULT_CACHE_TTL, max_bytes=RESULT_CACHE_MAX_MB * 1024 * 1024):
+        super().__init__(path)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._connect().executescript(SCHEMA)
+
+    def get(self, key):
+        conn = self._connect()
+        row = conn.execute("SELECT result FROM result_cache WHERE key = ? AND created_at >= ?",
+                           (key, time.time() - self.ttl)).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE result_cache SET used_at = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, key, result, size):
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("INSERT OR REPLACE INTO result_cache (key, result, size, created_at, used_at) VALUES (?, ?, ?, ?, ?)",
+                         (key, json.dumps(result), size, now, now))
+            conn.execute("DELETE FROM result_cache WHERE created_at < ?", (now - self.ttl,))
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM result_cache").fetchone()[0]
+            if total > self.max_bytes:
+                for old_key, old_size in conn.execute(
+                    "SELECT key, size FROM result_cache ORDER BY used_at").fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    conn.execute("DELETE FROM result_cache WHERE key = ?", (old_key,))
+                    total -= old_size
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResultCache()
+    return _cache
+
+def result_key(name, data, url_fields, defaults=None):
+    """Cache key of a request, or None if an input's content can't be identified.
+
+    A `url_fields` value that isn't a URL (such as inline captions) is part
+    of the settings instead.
+    """
+    urls = [field for field in url_fields if data.get(field) and urlparse(str(data[field])).scheme in URL_SCHEMES]
+    settings = dict(defaults or {})
+    settings.update({k: v for k, v in data.items() if k not in DELIVERY_FIELDS and k not in urls and k != 'id'})
+    inputs = {}
+    for field in urls:
+        fingerprint = content_fingerprint(data[field])
+        if fingerprint is None:
+            return None
+        inputs[field] = fingerprint
+    canonical = json.dumps([BUILD_NUMBER, name, settings, inputs], sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+def cache_result(url_fields, defaults=None):
+    """Reuse the result of a deterministic task when the same settings are applied to the same input content.
+
+    Opt-in with RESULT_CACHE=true. `url_fields` name the payload fields that
+    may hold input URLs, whose content is identified by a HEAD request; `defaults` are
+    merged into the settings so omitted and explicit default values match.
+    Only successful results are stored.
+    """
+    def decorator(f):
+        name = f"{f.__module__}.{f.__name__}"
+
+        @wraps(f)
+        def wrapper(job_id, data, *args, **kwargs):
+            if not RESULT_CACHE:
+                return f(job_id=job_id, data=data, *args, **kwargs)
+            try:
+                key = result_key(name, data, url_fields, defaults)
+                cached = get_cache().get(key) if key else None
+            except Exception as e:
+                logger.warning(f"Job {job_id}: Result cache lookup failed - {str(e)}")
+                key, cached = None, None
+            if cached is not None:
+                logger.info(f"Job {job_id}: Result cache hit")
+                inc("nca_result_cache_total", result="hit")
+                return cached['response'], cached['endpoint'], 200
+            inc("nca_result_cache_total", result="miss" if key else "uncacheable")
+
+            context = job_control.current_job()
+            uploaded_before = context.uploaded_bytes if context else 0
+            response = f(job_id=job_id, data=data, *args, **kwargs)
+            if key and response[2] == 200 and not (context and context.stopped):
+                size = context.uploaded_bytes - uploaded_before if context else 0
+                try:
+                    get_cache().put(key, {"response": response[0], "endpoint": response[1]}, size)
+                except Exception as e:
+                    logger.warning(f"Job {job_id}: Failed to store result in cache - {str(e)}")
+            return response
+        return wrapper
+    return decorator
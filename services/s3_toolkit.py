@@ -1,10 +1,15 @@
 import os
 import boto3
 import logging
+import threading
+from botocore.config import Config
+from boto3.s3.transfer import TransferConfig
 from urllib.parse import urlparse
 
 logger = logging.getLogger(__name__)
 
+UPLOAD_POOL_SIZE = int(os.environ.get('UPLOAD_POOL_SIZE', 32))
+
 def parse_s3_url(s3_url):
     """Parse S3 URL to extract bucket name, region, and endpoint URL."""
     parsed_url = urlparse(s3_url)
@@ -20,25 +25,54 @@ def parse_s3_url(s3_url):
     
     return bucket_name, region, endpoint_url
 
-def upload_to_s3(file_path, s3_url, access_key, secret_key):
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_client(s3_url, access_key, secret_key):
+    """The S3 client for an endpoint and key pair, shared by every thread of the process.
+
+    boto3 clients are thread-safe and keep up to UPLOAD_POOL_SIZE connections
+    open, so successive uploads skip the session setup and TLS handshakes.
+    """
+    _, region, endpoint_url = parse_s3_url(s3_url)
+    key = (endpoint_url, region, access_key, secret_key)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            # Sessions aren't thread-safe; each one only ever creates this client
+            session = boto3.Session(
+                aws_access_key_id=access_key,
+                aws_secret_access_key=secret_key,
+                region_name=region
+            )
+            config = Config(signature_version='s3v4', max_pool_connections=UPLOAD_POOL_SIZE,
+                            retries={'max_attempts': 5, 'mode': 'standard'})
+            client = session.client('s3', endpoint_url=endpoint_url, config=config)
+            _clients[key] = client
+    return client
+
+def upload_to_s3(file_path, s3_url, access_key, secret_key, part_size=None, parallelism=1):
+    """Upload a file, in parts of `part_size` bytes sent `parallelism` at a time if it is larger than one part."""
     # Parse the S3 URL into bucket, region, and endpoint
     bucket_name, region, endpoint_url = parse_s3_url(s3_url)
-    
-    session = boto3.Session(
-        aws_access_key_id=access_key,
-        aws_secret_access_key=secret_key,
-        region_name=region
-    )
-    
-    client = session.client('s3', endpoint_url=endpoint_url)
+    client = get_client(s3_url, access_key, secret_key)
+    config = None
+    if part_size:
+        config = TransferConfig(multipart_threshold=part_size + 1, multipart_chunksize=part_size,
+                                max_concurrency=parallelism, use_threads=parallelism > 1)
 
     try:
-        # Upload the file to the specified S3 bucket
-        with open(file_path, 'rb') as data:
-            client.upload_fileobj(data, bucket_name, os.path.basename(file_path), ExtraArgs={'ACL': 'public-read'})
+        # Upload the file to the specified S3 bucket; parts are read from disk by each thread
+        client.upload_file(file_path, bucket_name, os.path.basename(file_path),
+                           ExtraArgs={'ACL': 'public-read'}, Config=config)
 
         file_url = f"{endpoint_url}/{bucket_name}/{os.path.basename(file_path)}"
         return file_url
     except Exception as e:
         logger.error(f"Error uploading file to S3: {e}")
         raise
+
+def presigned_download_url(bucket_name, key, s3_url, access_key, secret_key, expiration):
+    """HTTPS URL that reads an object of `bucket_name` with the configured keys for `expiration` seconds."""
+    client = get_client(s3_url, access_key, secret_key)
+    return client.generate_presigned_url('get_object', Params={'Bucket': bucket_name, 'Key': key}, ExpiresIn=expiration)
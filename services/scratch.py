@@ -0,0 +1,158 @@
+import os
+import re
+import time
+import uuid
+import shutil
+import logging
+import threading
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+STORAGE_PATH = os.environ.get('STORAGE_PATH', '/tmp/')
+SCRATCH_PATH = os.environ.get('SCRATCH_PATH', os.path.join(STORAGE_PATH, 'jobs'))
+JOB_SCRATCH_QUOTA_MB = int(os.environ.get('JOB_SCRATCH_QUOTA_MB', 0))
+SCRATCH_QUOTA_MB = int(os.environ.get('SCRATCH_QUOTA_MB', 0))
+SCRATCH_JANITOR_INTERVAL = float(os.environ.get('SCRATCH_JANITOR_INTERVAL', 60))
+SCRATCH_MAX_AGE = int(os.environ.get('SCRATCH_MAX_AGE', 3600))
+
+# Seconds a workspace must have been left alone before the janitor considers it orphaned
+ORPHAN_GRACE = 60
+# Loose files under STORAGE_PATH named after a job or download ID, left by code that ran outside a workspace
+LOOSE_FILE = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}')
+
+def workspace_path(job_id, attempt):
+    return os.path.join(SCRATCH_PATH, job_id, attempt)
+
+def create_workspace(job_id):
+    """Create the scratch directory of one attempt at a job and return its path.
+
+    Every attempt gets its own directory, named after the process that runs
+    it, so a worker that is still winding down a requeued job never touches
+    the files of the attempt that took it over.
+    """
+    path = workspace_path(job_id, f"{os.getpid()}-{uuid.uuid4().hex[:12]}")
+    for _ in range(3):
+        try:
+            os.makedirs(path, exist_ok=True)
+            return path
+        except FileNotFoundError:
+            # The job's directory was removed by the previous attempt between the two mkdirs
+            continue
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def _owner_alive(attempt):
+    """Whether the process that created a workspace attempt is still running."""
+    pid, _, _ = attempt.partition('-')
+    try:
+        os.kill(int(pid), 0)
+    except (ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def directory_size(path):
+    """Bytes used by the files under `path`. Files removed while counting are skipped."""
+    total = 0
+    try:
+        entries = list(os.scandir(path))
+    except (FileNotFoundError, NotADirectoryError):
+        return 0
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                total += directory_size(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                total += entry.stat(follow_symlinks=False).st_size
+        except FileNotFoundError:
+            pass
+    return total
+
+def remove_workspace(path, reason='job'):
+    """Delete one workspace attempt and everything in it, and its job's directory if now empty. Returns the bytes freed."""
+    size = directory_size(path)
+    shutil.rmtree(path, ignore_errors=True)
+    try:
+        os.rmdir(os.path.dirname(path))
+    except OSError:
+        # Another attempt at the job has its workspace there
+        pass
+    if size:
+        metrics.inc("nca_scratch_removed_bytes_total", size, reason=reason)
+    return size
+
+_usage = {"bytes": 0, "at": 0}
+
+def scratch_usage(max_age=5):
+    """Bytes used by all workspaces in the container, counted at most every `max_age` seconds."""
+    now = time.time()
+    if now - _usage["at"] > max_age:
+        _usage.update(bytes=directory_size(SCRATCH_PATH), at=now)
+    return _usage["bytes"]
+
+def over_quota(path):
+    """Whether a job's workspace holds more than JOB_SCRATCH_QUOTA_MB."""
+    return JOB_SCRATCH_QUOTA_MB > 0 and directory_size(path) > JOB_SCRATCH_QUOTA_MB * 1024 * 1024
+
+def sweep(job_store):
+    """Remove what jobs left behind: orphaned workspace attempts, and stale loose files.
+
+    Running jobs remove their own workspace when they finish, whatever the
+    outcome; this catches the workspaces of workers that were killed, and
+    of jobs that are no longer running. Returns the bytes freed.
+    """
+    freed = 0
+    now = time.time()
+    try:
+        jobs = [entry for entry in os.scandir(SCRATCH_PATH) if entry.is_dir(follow_symlinks=False)]
+    except FileNotFoundError:
+        jobs = []
+    for job_entry in jobs:
+        try:
+            attempts = list(os.scandir(job_entry.path))
+            if not attempts and now - job_entry.stat().st_mtime >= ORPHAN_GRACE:
+                os.rmdir(job_entry.path)
+                continue
+        except OSError:
+            continue
+        job = None
+        for entry in attempts:
+            try:
+                if not entry.is_dir() or now - entry.stat().st_mtime < ORPHAN_GRACE:
+                    continue
+            except FileNotFoundError:
+                continue
+            if _owner_alive(entry.name):
+                job = job or job_store.get(job_entry.name)
+                if job is not None and job['state'] == 'running':
+                    continue
+            logger.info(f"Removing orphaned workspace {entry.name} of job {job_entry.name}")
+            freed += remove_workspace(entry.path, reason='orphan')
+
+    for entry in os.scandir(STORAGE_PATH):
+        try:
+            if (entry.is_file(follow_symlinks=False) and LOOSE_FILE.match(entry.name)
+                    and now - entry.stat().st_mtime > SCRATCH_MAX_AGE):
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                metrics.inc("nca_scratch_removed_bytes_total", size, reason='stale')
+                freed += size
+        except FileNotFoundError:
+            pass
+    return freed
+
+def start_janitor(job_store):
+    """Sweep orphaned workspaces and stale files every SCRATCH_JANITOR_INTERVAL seconds."""
+    def run():
+        while True:
+            try:
+                freed = sweep(job_store)
+                if freed:
+                    logger.info(f"Scratch janitor freed {freed / (1024 * 1024):.1f} MB")
+            except Exception as e:
+                logger.error(f"Scratch janitor error - {str(e)}")
+            time.sleep(SCRATCH_JANITOR_INTERVAL)
+
+    threading.Thread(target=run, name="scratch-janitor", daemon=True).start()
@@ -0,0 +1,57 @@
+import json
+import logging
+from config import API_KEY, API_KEYS
+
+logger = logging.getLogger(__name__)
+
+# Name of the tenant that authenticates with API_KEY
+DEFAULT_TENANT = 'default'
+
+class Tenant:
+    """A client of the API, identified by its API key.
+
+    `weight` is its share of the job slots when several tenants have jobs
+    queued. `rate` is the number of jobs per second it may submit on average,
+    with bursts of up to `burst` jobs; a rate of 0 means no limit.
+    """
+    def __init__(self, name, weight=1, rate=0, burst=None):
+        self.name = name
+        self.weight = float(weight)
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1, rate))
+        if self.weight <= 0:
+            raise ValueError(f"API key weight of tenant {name} must be positive")
+
+def load_tenants(api_key=API_KEY, api_keys=API_KEYS):
+    """Map every accepted API key to its tenant.
+
+    `api_keys` is a JSON object mapping keys to {"name", "weight", "rate",
+    "burst"}; API_KEY, when set, belongs to the `default` tenant. Every key
+    needs a name of its own: jobs, quotas and metrics are keyed by tenant
+    name, and a name derived from the key would expose part of it.
+    """
+    tenants = {}
+    if api_key:
+        tenants[api_key] = Tenant(DEFAULT_TENANT)
+    names = {DEFAULT_TENANT} if api_key else set()
+    for index, (key, settings) in enumerate(json.loads(api_keys or '{}').items()):
+        name = settings.get('name')
+        if not isinstance(name, str) or not name.strip():
+            raise ValueError(f"API_KEYS entry {index} has no name")
+        if name in names:
+            raise ValueError(f"API_KEYS tenant name {name!r} is used by more than one key")
+        names.add(name)
+        tenants[key] = Tenant(name, settings.get('weight', 1), settings.get('rate', 0), settings.get('burst'))
+    return tenants
+
+TENANTS = load_tenants()
+
+def owns(tenant, record):
+    """Whether a job or batch was submitted by `tenant`. Records from before tenants existed belong to the default tenant."""
+    return (record.get('tenant') or DEFAULT_TENANT) == tenant.name
+
+def tenant_for_key(api_key):
+    """The tenant an API key belongs to, or None if the key isn't accepted."""
+    if not api_key:
+        return None
+    return TENANTS.get(api_key)
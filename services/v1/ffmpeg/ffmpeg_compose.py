@@ -1,9 +1,8 @@
 import os
 import subprocess
-import json
-from services.file_management import download_file
-
-STORAGE_PATH = "/tmp/"
+from services.file_management import download_files
+from services.job_control import run_subprocess, scratch_dir
+from services.media_probe import probe
 
 def get_extension_from_format(format_name):
     # Mapping of common format names to file extensions
@@ -42,7 +41,7 @@ def get_metadata(filename, metadata_requests, job_id):
         try:
             env = os.environ.copy()
             env['PATH'] = '/usr/local/bin:' + env.get('PATH', '')
-            subprocess.run(thumbnail_command, check=True, capture_output=True, text=True, env=env)
+            run_subprocess(thumbnail_command, check=True, capture_output=True, text=True, env=env)
             if os.path.exists(thumbnail_filename):
                 metadata['thumbnail'] = thumbnail_filename  # Return local path instead of URL
         except subprocess.CalledProcessError as e:
@@ -52,29 +51,16 @@ def get_metadata(filename, metadata_requests, job_id):
         metadata['filesize'] = os.path.getsize(filename)
 
     if metadata_requests.get('encoder') or metadata_requests.get('duration') or metadata_requests.get('bitrate'):
-        ffprobe_command = [
-            'ffprobe',
-            '-v', 'quiet',
-            '-print_format', 'json',
-            '-show_format',
-            '-show_streams',
-            filename
-        ]
-        result = subprocess.run(ffprobe_command, capture_output=True, text=True)
-        probe_data = json.loads(result.stdout)
+        info = probe(filename)
         
         if metadata_requests.get('duration'):
-            metadata['duration'] = float(probe_data['format']['duration'])
+            metadata['duration'] = info.duration
         if metadata_requests.get('bitrate'):
-            metadata['bitrate'] = int(probe_data['format']['bit_rate'])
+            metadata['bitrate'] = info.bit_rate
         
         if metadata_requests.get('encoder'):
-            metadata['encoder'] = {}
-            for stream in probe_data['streams']:
-                if stream['codec_type'] == 'video':
-                    metadata['encoder']['video'] = stream.get('codec_name', 'unknown')
-                elif stream['codec_type'] == 'audio':
-                    metadata['encoder']['audio'] = stream.get('codec_name', 'unknown')
+            metadata['encoder'] = {codec_type: codec for codec_type, codec in info.codecs.items()
+                                   if codec_type in ('video', 'audio')}
 
     return metadata
 
@@ -91,13 +77,13 @@ def process_ffmpeg_compose(data, job_id, return_command=False):
             command.append(str(option["argument"]))
     
     # Add inputs
-    for input_data in data["inputs"]:
+    input_paths = download_files([input_data["file_url"] for input_data in data["inputs"]], scratch_dir())
+    for input_data, input_path in zip(data["inputs"], input_paths):
         if "options" in input_data:
             for option in input_data["options"]:
                 command.append(option["option"])
                 if "argument" in option and option["argument"] is not None:
                     command.append(str(option["argument"]))
-        input_path = download_file(input_data["file_url"], STORAGE_PATH)
         command.extend(["-i", input_path])
     
     # Add filters
@@ -114,7 +100,7 @@ def process_ffmpeg_compose(data, job_id, return_command=False):
                 break
         
         extension = get_extension_from_format(format_name) if format_name else 'mp4'
-        output_filename = os.path.join(STORAGE_PATH, f"{job_id}_output_{i}.{extension}")
+        output_filename = os.path.join(scratch_dir(), f"{job_id}_output_{i}.{extension}")
         output_filenames.append(output_filename)
         
         for option in output["options"]:
@@ -127,13 +113,12 @@ def process_ffmpeg_compose(data, job_id, return_command=False):
     try:
         env = os.environ.copy()
         env['PATH'] = '/usr/local/bin:' + env.get('PATH', '')
-        subprocess.run(command, check=True, capture_output=True, text=True, env=env)
+        run_subprocess(command, check=True, capture_output=True, text=True, env=env)
     except subprocess.CalledProcessError as e:
         raise Exception(f"FFmpeg command failed: {e.stderr}")
     
     # Clean up input files
-    for input_data in data["inputs"]:
-        input_path = os.path.join(STORAGE_PATH, os.path.basename(input_data["file_url"]))
+    for input_path in input_paths:
         if os.path.exists(input_path):
             os.remove(input_path)
     
@@ -2,15 +2,15 @@ import os
 import subprocess
 import logging
 from services.file_management import download_file
+from services.job_control import run_subprocess, scratch_dir
 from PIL import Image
 
-STORAGE_PATH = "/tmp/"
 logger = logging.getLogger(__name__)
 
 def process_image_to_video(image_url, length, frame_rate, zoom_speed, job_id, webhook_url=None):
     try:
         # Download the image file
-        image_path = download_file(image_url, STORAGE_PATH)
+        image_path = download_file(image_url, scratch_dir())
         logger.info(f"Downloaded image to {image_path}")
 
         # Get image dimensions using Pillow
@@ -19,7 +19,7 @@ def process_image_to_video(image_url, length, frame_rate, zoom_speed, job_id, we
         logger.info(f"Original image dimensions: {width}x{height}")
 
         # Prepare the output path
-        output_path = os.path.join(STORAGE_PATH, f"{job_id}.mp4")
+        output_path = os.path.join(scratch_dir(), f"{job_id}.mp4")
 
         # Determine orientation and set appropriate dimensions
         if width > height:
@@ -47,7 +47,7 @@ def process_image_to_video(image_url, length, frame_rate, zoom_speed, job_id, we
         logger.info(f"Running FFmpeg command: {' '.join(cmd)}")
 
         # Run FFmpeg command
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = run_subprocess(cmd, capture_output=True, text=True)
         if result.returncode != 0:
             logger.error(f"FFmpeg command failed. Error: {result.stderr}")
             raise subprocess.CalledProcessError(result.returncode, cmd, result.stdout, result.stderr)
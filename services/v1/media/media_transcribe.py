@@ -1,23 +1,31 @@
 import os
+import numpy as np
 import whisper
 import srt
 from datetime import timedelta
 from whisper.utils import WriteSRT, WriteVTT
-from services.file_management import download_file
+from services.file_management import streamed_input
+from services.job_control import run_subprocess, scratch_dir
+from services.metrics import stage_timer
 import logging
 
 # Set up logging
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
-# Set the default local storage directory
-STORAGE_PATH = "/tmp/"
+def load_audio(media_url):
+    """Decode the audio of a media URL the way whisper.load_audio does, while it downloads."""
+    with streamed_input(media_url, os.path.join(scratch_dir(), 'input_media')) as (input_filename, pass_fds):
+        cmd = ['ffmpeg', '-nostdin', '-threads', '0', '-i', input_filename,
+               '-f', 's16le', '-ac', '1', '-acodec', 'pcm_s16le', '-ar', str(whisper.audio.SAMPLE_RATE), '-']
+        result = run_subprocess(cmd, capture_output=True, check=True, pass_fds=pass_fds)
+    return np.frombuffer(result.stdout, np.int16).flatten().astype(np.float32) / 32768.0
 
 def process_transcribe_media(media_url, task, include_text, include_srt, include_segments, word_timestamps, response_type, language, job_id):
     """Transcribe or translate media and return the transcript/translation, SRT or VTT file path."""
     logger.info(f"Starting {task} for media URL: {media_url}")
-    input_filename = download_file(media_url, os.path.join(STORAGE_PATH, 'input_media'))
-    logger.info(f"Downloaded media to local file: {input_filename}")
+    audio = load_audio(media_url)
+    logger.info(f"Decoded {len(audio) / whisper.audio.SAMPLE_RATE:.1f}s of audio")
 
     try:
         model_size = "base"
@@ -35,7 +43,8 @@ def process_transcribe_media(media_url, task, include_text, include_srt, include
         if language:
             options["language"] = language
 
-        result = model.transcribe(input_filename, **options)
+        with stage_timer("whisper"):
+            result = model.transcribe(audio, **options)
         
         text = None
         srt_text = None
@@ -59,29 +68,27 @@ def process_transcribe_media(media_url, task, include_text, include_srt, include
         if include_segments is True:
             segments_json = result['segments']
 
-        os.remove(input_filename)
-        logger.info(f"Removed local file: {input_filename}")
         logger.info(f"{task.capitalize()} successful, output type: {response_type}")
 
         if response_type == "direct":
             return text, srt_text, segments_json
         else:
             if include_text is True:
-                text_filename = os.path.join(STORAGE_PATH, f"{job_id}.txt")
+                text_filename = os.path.join(scratch_dir(), f"{job_id}.txt")
                 with open(text_filename, 'w', encoding='utf-8') as f:
                     f.write(text)
             else:
                 text_filename = None
             
             if include_srt is True:
-                srt_filename = os.path.join(STORAGE_PATH, f"{job_id}.srt")
+                srt_filename = os.path.join(scratch_dir(), f"{job_id}.srt")
                 with open(srt_filename, 'w', encoding='utf-8') as f:
                     f.write(srt_text)
             else:
                 srt_filename = None
 
             if include_segments is True:
-                segments_filename = os.path.join(STORAGE_PATH, f"{job_id}.json")
+                segments_filename = os.path.join(scratch_dir(), f"{job_id}.json")
                 with open(segments_filename, 'w', encoding='utf-8') as f:
                     f.write(str(segments_json))
             else:
@@ -7,6 +7,9 @@ from datetime import timedelta
 import srt
 import re
 from services.file_management import download_file
+from services.metrics import stage_timer
+from services.job_control import run_ffmpeg, scratch_dir
+from services.media_probe import probe
 from services.cloud_storage import upload_file  # Ensure this import is present
 import requests  # Ensure requests is imported for webhook handling
 from urllib.parse import urlparse
@@ -20,8 +23,6 @@ if not logger.hasHandlers():
     handler.setFormatter(formatter)
     logger.addHandler(handler)
 
-STORAGE_PATH = "/tmp/"
-
 POSITION_ALIGNMENT_MAP = {
     "bottom_left": 1,
     "bottom_center": 2,
@@ -54,7 +55,8 @@ def generate_transcription(video_path, language='auto'):
         }
         if language != 'auto':
             transcription_options['language'] = language
-        result = model.transcribe(video_path, **transcription_options)
+        with stage_timer("whisper"):
+            result = model.transcribe(video_path, **transcription_options)
         logger.info(f"Transcription generated successfully for video: {video_path}")
         return result
     except Exception as e:
@@ -63,11 +65,9 @@ def generate_transcription(video_path, language='auto'):
 
 def get_video_resolution(video_path):
     try:
-        probe = ffmpeg.probe(video_path)
-        video_streams = [s for s in probe['streams'] if s['codec_type'] == 'video']
-        if video_streams:
-            width = int(video_streams[0]['width'])
-            height = int(video_streams[0]['height'])
+        resolution = probe(video_path).resolution
+        if resolution:
+            width, height = resolution
             logger.info(f"Video resolution determined: {width}x{height}")
             return width, height
         else:
@@ -668,7 +668,7 @@ def process_captioning_v1(video_url, captions, settings, replace, job_id, langua
 
         # Download the video
         try:
-            video_path = download_file(video_url, STORAGE_PATH)
+            video_path = download_file(video_url, scratch_dir())
             logger.info(f"Job {job_id}: Video downloaded to {video_path}")
         except Exception as e:
             logger.error(f"Job {job_id}: Video download error: {str(e)}")
@@ -722,7 +722,7 @@ def process_captioning_v1(video_url, captions, settings, replace, job_id, langua
 
         # Save the subtitle content
         subtitle_filename = f"{job_id}.{subtitle_type}"
-        subtitle_path = os.path.join(STORAGE_PATH, subtitle_filename)
+        subtitle_path = os.path.join(scratch_dir(), subtitle_filename)
         try:
             with open(subtitle_path, 'w', encoding='utf-8') as f:
                 f.write(subtitle_content)
@@ -733,15 +733,15 @@ def process_captioning_v1(video_url, captions, settings, replace, job_id, langua
 
         # Prepare output filename and path
         output_filename = f"{job_id}_captioned.mp4"
-        output_path = os.path.join(STORAGE_PATH, output_filename)
+        output_path = os.path.join(scratch_dir(), output_filename)
 
         # Process video with subtitles using FFmpeg
         try:
-            ffmpeg.input(video_path).output(
+            run_ffmpeg(ffmpeg.input(video_path).output(
                 output_path,
                 vf=f"subtitles='{subtitle_path}'",
                 acodec='copy'
-            ).run(overwrite_output=True)
+            ), overwrite_output=True)
             logger.info(f"Job {job_id}: FFmpeg processing completed. Output saved to {output_path}")
         except ffmpeg.Error as e:
             stderr_output = e.stderr.decode('utf8') if e.stderr else 'Unknown error'
@@ -1,28 +1,203 @@
-import requests
+import os
+import time
+import heapq
+import random
 import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
 from urllib.parse import urlparse, parse_qs
+from services.metrics import inc
 
 logger = logging.getLogger(__name__)
 
+WEBHOOK_THREADS = int(os.environ.get('WEBHOOK_THREADS', 4))
+WEBHOOK_QUEUE_SIZE = int(os.environ.get('WEBHOOK_QUEUE_SIZE', 1000))
+WEBHOOK_TIMEOUT = float(os.environ.get('WEBHOOK_TIMEOUT', 10))
+WEBHOOK_MAX_RETRIES = int(os.environ.get('WEBHOOK_MAX_RETRIES', 5))
+WEBHOOK_RETRY_BACKOFF = float(os.environ.get('WEBHOOK_RETRY_BACKOFF', 2))
+WEBHOOK_RETRY_BACKOFF_MAX = float(os.environ.get('WEBHOOK_RETRY_BACKOFF_MAX', 300))
+WEBHOOK_HOST_CONCURRENCY = int(os.environ.get('WEBHOOK_HOST_CONCURRENCY', 2))
+
+# Seconds to wait before trying again when a host already has WEBHOOK_HOST_CONCURRENCY deliveries in flight
+HOST_BUSY_DELAY = 0.1
+
+def prepare_webhook(webhook_url, data):
+    """Move the query parameters of a webhook URL into the payload. Returns the clean URL."""
+    # Extract query parameters from the webhook URL
+    parsed_url = urlparse(webhook_url)
+    query_params = parse_qs(parsed_url.query)
+
+    # Add query parameters to the data payload
+    # Convert from lists to single values (parse_qs returns lists)
+    for key, value in query_params.items():
+        if value and len(value) > 0:
+            data[key] = value[0]
+
+    # Remove query parameters from the URL
+    return webhook_url.split('?')[0]
+
+class Delivery:
+    """One webhook waiting to be sent."""
+    def __init__(self, url, data):
+        self.url = url
+        self.host = urlparse(url).netloc
+        self.data = data
+        self.attempts = 0
+        self.queued_at = time.time()
+
+class WebhookDispatcher:
+    """Sends webhooks from background threads so job workers never wait on a receiver.
+
+    Deliveries wait in a bounded, time-ordered queue. Sender threads share one
+    pooled requests.Session, keep at most WEBHOOK_HOST_CONCURRENCY requests in
+    flight per host, and retry connection errors, timeouts, 429 and 5xx
+    responses with exponential backoff and jitter.
+    """
+    def __init__(self, threads=WEBHOOK_THREADS, max_queue=WEBHOOK_QUEUE_SIZE):
+        self.threads = max(1, threads)
+        self.max_queue = max_queue
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.threads, pool_maxsize=self.threads)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.pending = []  # heap of (due time, sequence, delivery)
+        self.sequence = 0
+        self.host_in_flight = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.started = False
+        self.metrics = {
+            "sent": 0,
+            "failed": 0,
+            "retried": 0,
+            "dropped": 0,
+            "in_flight": 0,
+            "total_latency": 0.0,
+            "last_error": None
+        }
+
+    def start(self):
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+        for i in range(self.threads):
+            threading.Thread(target=self._run, name=f"webhook-sender-{i}", daemon=True).start()
+
+    def submit(self, url, data):
+        """Queue a webhook. Returns False if the queue is full and it was dropped."""
+        self.start()
+        delivery = Delivery(url, data)
+        with self.lock:
+            dropped = len(self.pending) >= self.max_queue
+            if dropped:
+                self.metrics["dropped"] += 1
+            else:
+                self._schedule(delivery, time.time())
+        if dropped:
+            logger.error(f"Webhook queue full ({self.max_queue}), dropping webhook to {url} for job {data.get('job_id')}")
+            inc("nca_webhooks_total", result="dropped")
+            return False
+        return True
+
+    def _schedule(self, delivery, due):
+        self.sequence += 1
+        heapq.heappush(self.pending, (due, self.sequence, delivery))
+        self.wakeup.notify()
+
+    def _next(self):
+        """Block until a delivery is due and its host has a free slot, then reserve the slot."""
+        with self.lock:
+            while True:
+                now = time.time()
+                if self.pending and self.pending[0][0] <= now:
+                    due, _, delivery = heapq.heappop(self.pending)
+                    if self.host_in_flight.get(delivery.host, 0) >= WEBHOOK_HOST_CONCURRENCY:
+                        self._schedule(delivery, now + HOST_BUSY_DELAY)
+                        continue
+                    self.host_in_flight[delivery.host] = self.host_in_flight.get(delivery.host, 0) + 1
+                    self.metrics["in_flight"] += 1
+                    return delivery
+                self.wakeup.wait(self.pending[0][0] - now if self.pending else None)
+
+    def _run(self):
+        while True:
+            delivery = self._next()
+            error = None
+            retry = False
+            try:
+                delivery.attempts += 1
+                response = self.session.post(delivery.url, json=delivery.data, timeout=WEBHOOK_TIMEOUT)
+                if response.status_code == 429 or response.status_code >= 500:
+                    retry = True
+                response.raise_for_status()
+            except requests.RequestException as e:
+                error = str(e)
+                if not isinstance(e, requests.HTTPError):
+                    retry = True
+            except Exception as e:
+                error = str(e)
+            self._done(delivery, error, retry)
+
+    def _done(self, delivery, error, retry):
+        with self.lock:
+            self.metrics["in_flight"] -= 1
+            self.host_in_flight[delivery.host] -= 1
+            if self.host_in_flight[delivery.host] == 0:
+                del self.host_in_flight[delivery.host]
+            if error is None:
+                result = "sent"
+                self.metrics["sent"] += 1
+                self.metrics["total_latency"] += time.time() - delivery.queued_at
+                logger.info(f"Webhook sent to {delivery.url} for job {delivery.data.get('job_id')}")
+            elif retry and delivery.attempts <= WEBHOOK_MAX_RETRIES:
+                result = "retried"
+                self.metrics["retried"] += 1
+                delay = min(WEBHOOK_RETRY_BACKOFF_MAX, WEBHOOK_RETRY_BACKOFF * 2 ** (delivery.attempts - 1))
+                delay *= random.uniform(0.5, 1.0)
+                logger.warning(f"Webhook to {delivery.url} failed (attempt {delivery.attempts}), retrying in {delay:.1f}s: {error}")
+                self._schedule(delivery, time.time() + delay)
+            else:
+                result = "failed"
+                self.metrics["failed"] += 1
+                self.metrics["last_error"] = error
+                logger.error(f"Webhook failed after {delivery.attempts} attempts: {error}")
+            self.wakeup.notify_all()
+        inc("nca_webhooks_total", result=result)
+
+    def flush(self, timeout):
+        """Wait up to `timeout` seconds for queued and in-flight webhooks. Returns True if none are left."""
+        end = time.time() + timeout
+        with self.lock:
+            while self.pending or self.metrics["in_flight"]:
+                remaining = end - time.time()
+                if remaining <= 0:
+                    return False
+                self.wakeup.wait(min(remaining, 0.1))
+        return True
+
+    def stats(self):
+        with self.lock:
+            sent = self.metrics["sent"]
+            return {
+                "queued": len(self.pending),
+                "max_queue": self.max_queue,
+                "in_flight": self.metrics["in_flight"],
+                "sent": sent,
+                "retried": self.metrics["retried"],
+                "failed": self.metrics["failed"],
+                "dropped": self.metrics["dropped"],
+                "avg_delivery_time": round(self.metrics["total_latency"] / sent, 3) if sent else None,
+                "last_error": self.metrics["last_error"]
+            }
+
+dispatcher = WebhookDispatcher()
+
 def send_webhook(webhook_url, data):
-    """Send a POST request to a webhook URL with the provided data."""
-    try:
-        # Extract query parameters from the webhook URL
-        parsed_url = urlparse(webhook_url)
-        query_params = parse_qs(parsed_url.query)
-        
-        # Add query parameters to the data payload
-        # Convert from lists to single values (parse_qs returns lists)
-        for key, value in query_params.items():
-            if value and len(value) > 0:
-                data[key] = value[0]
-        
-        # Remove query parameters from the URL
-        clean_url = webhook_url.split('?')[0]
-        
-        logger.info(f"Attempting to send webhook to {clean_url} with data: {data}")
-        response = requests.post(clean_url, json=data)
-        response.raise_for_status()
-        logger.info(f"Webhook sent: {data}")
-    except requests.RequestException as e:
-        logger.error(f"Webhook failed: {e}")
+    """Queue a POST request to a webhook URL with the provided data; it is sent in the background."""
+    if not webhook_url:
+        return False
+    clean_url = prepare_webhook(webhook_url, data)
+    logger.info(f"Queueing webhook to {clean_url} with data: {data}")
+    return dispatcher.submit(clean_url, data)
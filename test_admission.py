@@ -0,0 +1,109 @@
+import os
+import sys
+import tempfile
+from collections import namedtuple
+
+# Add the current directory to the Python path
+sys.path.append('.')
+
+import services.admission as admission
+from services.job_store import JobStore
+from services.rate_limit import RateLimiter
+
+Disk = namedtuple('Disk', 'free')
+Memory = namedtuple('Memory', 'available')
+Tenant = namedtuple('Tenant', 'name weight rate burst')
+MB = 1024 * 1024
+
+def make_store():
+    return JobStore(os.path.join(tempfile.mkdtemp(), 'jobs.db'))
+
+def set_resources(monkeypatch, disk_mb, memory_mb, load=0.0):
+    monkeypatch.setattr(admission.psutil, 'disk_usage', lambda path: Disk(disk_mb * MB))
+    monkeypatch.setattr(admission.psutil, 'virtual_memory', lambda: Memory(memory_mb * MB))
+    monkeypatch.setattr(admission.psutil, 'getloadavg', lambda: (load, load, load))
+    monkeypatch.setattr(admission.psutil, 'cpu_count', lambda: 4)
+
+def test_admits_when_resources_are_available(monkeypatch):
+    set_resources(monkeypatch, disk_mb=100000, memory_mb=16000)
+    assert admission.check_admission(make_store(), '/v1/video/caption') is None
+
+def test_rejects_when_job_would_fill_the_disk(monkeypatch):
+    set_resources(monkeypatch, disk_mb=2500, memory_mb=16000)
+    store = make_store()
+    # A small conversion still fits, a large concatenation does not
+    assert admission.check_admission(store, '/v1/media/transform/mp3') is None
+    rejection = admission.check_admission(store, '/v1/video/concatenate')
+    assert rejection.code == 503
+    assert admission.RETRY_AFTER_MIN <= rejection.retry_after <= admission.RETRY_AFTER_MAX
+
+def test_costs_of_a_batch_add_up(monkeypatch):
+    set_resources(monkeypatch, disk_mb=100000, memory_mb=3000)
+    monkeypatch.setattr(admission, 'JOB_SLOTS', 2)
+    store = make_store()
+    # One transcription fits in memory, two at once don't
+    assert admission.check_admission(store, ['/v1/media/transcribe']) is None
+    assert admission.check_admission(store, ['/v1/media/transcribe', '/v1/toolkit/test']) is None
+    rejection = admission.check_admission(store, ['/v1/media/transcribe', '/v1/media/transcribe', '/v1/toolkit/test'])
+    assert rejection.code == 503
+    assert "memory" in rejection.message
+
+def test_jobs_already_accepted_are_charged_before_they_use_anything(monkeypatch):
+    set_resources(monkeypatch, disk_mb=6000, memory_mb=3000)
+    monkeypatch.setattr(admission, 'JOB_SLOTS', 3)
+    monkeypatch.setattr(admission.scratch, 'scratch_usage', lambda: 0)
+    store = make_store()
+    assert admission.check_admission(store, '/v1/video/concatenate') is None
+    store.create("running-job", "task", "/v1/video/concatenate", {}, state='running')
+    # The running concatenation hasn't written its 4000 MB yet
+    assert admission.check_admission(store, '/v1/video/concatenate').code == 503
+    # Once it has, it is not counted twice
+    set_resources(monkeypatch, disk_mb=2000, memory_mb=3000)
+    monkeypatch.setattr(admission.scratch, 'scratch_usage', lambda: 4000 * MB)
+    assert admission.check_admission(store, '/v1/media/transform/mp3') is None
+
+    # A queued job holds no memory yet, but will once one of the two free slots starts it
+    set_resources(monkeypatch, disk_mb=100000, memory_mb=3000)
+    assert admission.check_admission(store, '/v1/media/transcribe') is None
+    store.create("queued-job", "task", "/v1/media/transcribe", {"webhook_url": "https://example.com/hook"})
+    rejection = admission.check_admission(store, '/v1/media/transcribe')
+    assert rejection.code == 503
+    assert "memory" in rejection.message
+
+def test_queued_jobs_are_only_charged_for_the_slots_they_can_start_in(monkeypatch):
+    set_resources(monkeypatch, disk_mb=100000, memory_mb=5200)
+    monkeypatch.setattr(admission, 'JOB_SLOTS', 1)
+    store = make_store()
+    # One caption job runs at a time, however many are queued
+    for i in range(4):
+        assert admission.check_admission(store, '/v1/video/caption') is None
+        store.create(f"caption-{i}", "task", "/v1/video/caption", {"webhook_url": "https://example.com/hook"})
+    assert admission.check_admission(store, ['/v1/video/caption'] * 3) is None
+
+def test_rejects_when_memory_is_short(monkeypatch):
+    set_resources(monkeypatch, disk_mb=100000, memory_mb=2000)
+    rejection = admission.check_admission(make_store(), '/v1/media/transcribe')
+    assert rejection.code == 503
+    assert "memory" in rejection.message
+
+def test_queue_length_and_load_limits(monkeypatch):
+    set_resources(monkeypatch, disk_mb=100000, memory_mb=16000, load=20.0)
+    monkeypatch.setattr(admission, 'MAX_QUEUE_LENGTH', 1)
+    monkeypatch.setattr(admission, 'MAX_LOAD_PER_CPU', 2.0)
+    store = make_store()
+    store.create("queued-job", "task", "/v1/toolkit/test", {"webhook_url": "https://example.com/hook"})
+
+    assert admission.check_admission(store, '/v1/toolkit/test').code == 429
+    # Sync requests are not counted against the queue, but still see the load limit
+    rejection = admission.check_admission(store, '/v1/toolkit/test', queued=False)
+    assert rejection.code == 429
+    assert "MAX_LOAD_PER_CPU" in rejection.message
+
+def test_rate_limit_is_a_token_bucket_per_tenant():
+    limiter = RateLimiter(os.path.join(tempfile.mkdtemp(), 'jobs.db'))
+    acme = Tenant(name="acme", weight=1, rate=0.5, burst=2)
+    assert limiter.take(acme) == 0
+    assert limiter.take(acme) == 0
+    assert 1.5 < limiter.take(acme) <= 2
+    assert limiter.take(acme._replace(name="other")) == 0
+    assert limiter.take(acme._replace(rate=0)) == 0
@@ -0,0 +1,77 @@
+import os
+import sys
+import tempfile
+import threading
+
+os.environ.setdefault('API_KEY', 'test_api_key')
+
+# Add the current directory to the Python path
+sys.path.append('.')
+
+from services import cloud_storage, job_control, metrics, s3_toolkit
+from services.job_store import JobStore
+from services.metrics import MetricsStore
+
+def test_uploads_share_one_provider_and_client_and_are_timed(monkeypatch):
+    path = os.path.join(tempfile.mkdtemp(), 'jobs.db')
+    monkeypatch.setattr(metrics, '_store', MetricsStore(path))
+    monkeypatch.setattr(cloud_storage, '_provider', None)
+    monkeypatch.delenv('GCP_BUCKET_NAME', raising=False)
+    monkeypatch.setenv('S3_ENDPOINT_URL', 'https://renders.nyc3.digitaloceanspaces.com')
+    monkeypatch.setenv('S3_ACCESS_KEY', 'access')
+    monkeypatch.setenv('S3_SECRET_KEY', 'secret')
+
+    clients = []
+    def upload_to_s3(file_path, s3_url, access_key, secret_key, part_size=None, parallelism=1):
+        clients.append(s3_toolkit.get_client(s3_url, access_key, secret_key))
+        return f"https://renders.nyc3.digitaloceanspaces.com/{os.path.basename(file_path)}"
+    monkeypatch.setattr(cloud_storage, 'upload_to_s3', upload_to_s3)
+
+    files = []
+    for i in range(8):
+        file_path = os.path.join(tempfile.mkdtemp(), f"frame_{i}.jpg")
+        with open(file_path, 'wb') as f:
+            f.write(b"j" * 100)
+        files.append(file_path)
+    providers = []
+    threads = [threading.Thread(target=lambda p=p: providers.append(cloud_storage.get_storage_provider()) or cloud_storage.upload_file(p))
+               for p in files]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(set(map(id, providers))) == 1
+    assert len(clients) == 8 and len(set(map(id, clients))) == 1
+    lines = metrics.render(JobStore(path)).splitlines()
+    assert 'nca_upload_seconds_count{provider="s3",result="ok"} 8' in lines
+    # Uploads of small files get finer buckets than whole jobs
+    assert any(line.startswith('nca_upload_seconds_bucket{le="0.01",provider="s3",result="ok"}') for line in lines)
+
+def test_large_outputs_are_uploaded_in_parts_and_timed(monkeypatch):
+    monkeypatch.setattr(metrics, '_store', MetricsStore(os.path.join(tempfile.mkdtemp(), 'jobs.db')))
+    monkeypatch.setattr(cloud_storage, '_provider', cloud_storage.S3CompatibleProvider())
+    monkeypatch.setattr(cloud_storage, 'UPLOAD_PART_SIZE', 1024 * 1024)
+    calls = []
+    def upload_to_s3(file_path, s3_url, access_key, secret_key, part_size=None, parallelism=1):
+        calls.append((os.path.getsize(file_path), part_size, parallelism))
+        return f"https://renders.nyc3.digitaloceanspaces.com/{os.path.basename(file_path)}"
+    monkeypatch.setattr(cloud_storage, 'upload_to_s3', upload_to_s3)
+
+    big = os.path.join(tempfile.mkdtemp(), "concatenated.mp4")
+    with open(big, 'wb') as f:
+        f.truncate(5 * 1024 * 1024 + 1)
+    context = job_control.start_job("upload-job")
+    try:
+        cloud_storage.upload_file(big)
+    finally:
+        job_control.end_job(context)
+
+    assert calls == [(5 * 1024 * 1024 + 1, 1024 * 1024, cloud_storage.UPLOAD_PARALLELISM)]
+    [stats] = context.uploads
+    assert stats["url"].endswith("/concatenated.mp4")
+    assert stats["bytes"] == 5 * 1024 * 1024 + 1 and stats["parts"] == 6
+    assert stats["seconds"] >= 0
+
+    # Parts grow so that no file needs more parts than the providers accept
+    assert cloud_storage.upload_parts(20000 * 1024 * 1024) == (10000, 2 * 1024 * 1024)
@@ -0,0 +1,253 @@
+import os
+import sys
+import struct
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Add the current directory to the Python path
+sys.path.append('.')
+
+from services import file_management, job_control
+import pytest
+import requests
+from services.file_management import InputCache, download_file, download_files, streamed_input, needs_seeking
+from services.job_control import run_subprocess
+
+def start_media_server(files, etags, bodies_sent, drop_after=None):
+    """Serve `files`; the first response of a file in `drop_after` is cut off after that many bytes."""
+    drop_after = dict(drop_after or {})
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            name = self.path.split('?')[0].lstrip('/')
+            if name not in files:
+                self.send_error(404)
+                return
+            etag = etags.get(name)
+            body = files[name]
+            if etag and self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            start = 0
+            end = len(body) - 1
+            if self.headers.get('Range') and self.headers.get('If-Range') == etag:
+                first, last = self.headers['Range'].split('=')[1].split('-')
+                start, end = int(first), int(last or end)
+                self.send_response(206)
+                self.send_header('Content-Range', f"bytes {start}-{end}/{len(body)}")
+            else:
+                self.send_response(200)
+            self.send_header('Content-Length', str(end + 1 - start))
+            self.send_header('Accept-Ranges', 'bytes')
+            if etag:
+                self.send_header('ETag', etag)
+            self.end_headers()
+            cut = drop_after.pop(name, None)
+            self.wfile.write(body[start:cut] if cut is not None else body[start:end + 1])
+            bodies_sent.append(name if start == 0 else f"{name}@{start}")
+            if cut is not None:
+                self.close_connection = True
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+def test_inputs_are_downloaded_once_and_evicted_when_unused(monkeypatch):
+    scratch = tempfile.mkdtemp()
+    cache = InputCache(os.path.join(scratch, 'input_cache'), max_bytes=150)
+    monkeypatch.setattr(file_management, 'input_cache', cache)
+    files = {"intro.mp4": b"i" * 100, "music.mp3": b"m" * 100, "live.mp4": b"l" * 10}
+    etags = {"intro.mp4": '"v1"', "music.mp3": '"v1"'}
+    bodies_sent = []
+    base = start_media_server(files, etags, bodies_sent)
+
+    first = download_file(f"{base}/intro.mp4", scratch)
+    second = download_file(f"{base}/intro.mp4", scratch)
+    assert first != second
+    assert open(second, 'rb').read() == files["intro.mp4"]
+    assert bodies_sent == ["intro.mp4"]
+
+    # Jobs own their links: deleting one leaves the cached copy intact
+    os.remove(first)
+    assert open(download_file(f"{base}/intro.mp4", scratch), 'rb').read() == files["intro.mp4"]
+
+    # Over the limit, but intro.mp4 is still linked by jobs, so nothing can go yet
+    download_file(f"{base}/music.mp3", scratch)
+    assert len([p for p in os.listdir(cache.path) if not p.endswith('.json')]) == 2
+
+    # Changed content is fetched again; inputs without validators are never cached
+    etags["intro.mp4"] = '"v2"'
+    download_file(f"{base}/intro.mp4", scratch)
+    download_file(f"{base}/live.mp4", scratch)
+    download_file(f"{base}/live.mp4", scratch)
+    assert bodies_sent == ["intro.mp4", "music.mp3", "intro.mp4", "live.mp4", "live.mp4"]
+
+    # Once no job uses them, the least recently used entries are evicted
+    for name in os.listdir(scratch):
+        if name.endswith('.mp4'):
+            os.remove(os.path.join(scratch, name))
+    cache.evict()
+    assert sum(os.path.getsize(os.path.join(cache.path, p)) for p in os.listdir(cache.path)
+               if not p.endswith('.json')) <= 150
+
+    # Partial downloads of a killed worker are removed once stale; live ones count towards the size
+    abandoned, live = cache.temp_path(), cache.temp_path()
+    for path in (abandoned, live):
+        with open(path, 'wb') as f:
+            f.write(b"x" * 200)
+    os.utime(abandoned, (time.time() - file_management.STALE_DOWNLOAD_AGE - 1,) * 2)
+    cache.evict()
+    assert not os.path.exists(abandoned) and os.path.exists(live)
+    # With the live download counted, only entries still linked by jobs are left
+    assert all(os.stat(os.path.join(cache.path, p)).st_nlink > 1 for p in os.listdir(cache.path)
+               if not p.startswith('.') and not p.endswith('.json'))
+
+def test_interrupted_downloads_resume_and_are_timed(monkeypatch):
+    scratch = tempfile.mkdtemp()
+    monkeypatch.setattr(file_management, 'input_cache', InputCache(os.path.join(scratch, 'input_cache'), max_bytes=0))
+    monkeypatch.setattr(file_management, 'DOWNLOAD_RETRY_BACKOFF', 0.01)
+    monkeypatch.setattr(file_management, 'DOWNLOAD_CHUNK_SIZE', 65536)
+    files = {"long.mp4": bytes(range(256)) * 4096}
+    bodies_sent = []
+    base = start_media_server(files, {"long.mp4": '"v1"'}, bodies_sent, drop_after={"long.mp4": 300000})
+
+    context = job_control.start_job("download-job")
+    try:
+        path = download_file(f"{base}/long.mp4", scratch)
+    finally:
+        job_control.end_job(context)
+
+    assert open(path, 'rb').read() == files["long.mp4"]
+    # Picks up after the last complete chunk instead of starting over
+    assert bodies_sent == ["long.mp4", "long.mp4@262144"]
+    [stats] = context.downloads
+    assert stats["bytes"] == len(files["long.mp4"])
+    assert stats["resumes"] == 1 and stats["restarts"] == 0
+    assert stats["cache"] == "uncacheable" and stats["seconds"] >= 0
+
+def test_large_inputs_are_downloaded_in_parallel_parts(monkeypatch):
+    scratch = tempfile.mkdtemp()
+    monkeypatch.setattr(file_management, 'input_cache', InputCache(os.path.join(scratch, 'input_cache'), max_bytes=0))
+    monkeypatch.setattr(file_management, 'DOWNLOAD_PART_SIZE', 100000)
+    monkeypatch.setattr(file_management, 'DOWNLOAD_PARALLELISM', 3)
+    files = {"big.mp4": os.urandom(450000), "small.mp4": os.urandom(50000)}
+    bodies_sent = []
+    base = start_media_server(files, {"big.mp4": '"v1"', "small.mp4": '"v1"'}, bodies_sent)
+
+    context = job_control.start_job("parallel-job")
+    try:
+        big = download_file(f"{base}/big.mp4", scratch)
+        small = download_file(f"{base}/small.mp4", scratch)
+    finally:
+        job_control.end_job(context)
+
+    assert open(big, 'rb').read() == files["big.mp4"]
+    assert open(small, 'rb').read() == files["small.mp4"]
+    assert sorted(b for b in bodies_sent if b.startswith("big.mp4@")) == [
+        "big.mp4@100000", "big.mp4@200000", "big.mp4@300000", "big.mp4@400000"]
+    assert [stats["connections"] for stats in context.downloads] == [3, 1]
+
+def test_inputs_are_downloaded_concurrently_in_order(monkeypatch):
+    scratch = tempfile.mkdtemp()
+    monkeypatch.setattr(file_management, 'input_cache', InputCache(os.path.join(scratch, 'input_cache'), max_bytes=0))
+    files = {f"clip{i}.mp4": os.urandom(1000 + i) for i in range(6)}
+    base = start_media_server(files, {}, [])
+
+    paths = download_files([f"{base}/clip{i}.mp4" for i in range(6)], scratch)
+    assert [open(path, 'rb').read() for path in paths] == [files[f"clip{i}.mp4"] for i in range(6)]
+
+    # One missing input fails the whole set and leaves no downloads behind
+    before = set(os.listdir(scratch))
+    with pytest.raises(requests.HTTPError):
+        download_files([f"{base}/clip0.mp4", f"{base}/missing.mp4", f"{base}/clip1.mp4"], scratch)
+    assert set(os.listdir(scratch)) == before
+
+def mp4_box(kind, body):
+    return struct.pack('>I', len(body) + 8) + kind + body
+
+def test_inputs_are_streamed_unless_they_need_seeking(monkeypatch):
+    scratch = tempfile.mkdtemp()
+    monkeypatch.setattr(file_management, 'input_cache', InputCache(os.path.join(scratch, 'input_cache'), max_bytes=0))
+    monkeypatch.setattr(file_management, 'STREAM_INPUTS', True)
+    faststart = mp4_box(b'ftyp', b'isom') + mp4_box(b'moov', b'index') + mp4_box(b'mdat', os.urandom(500000))
+    moov_last = mp4_box(b'ftyp', b'isom') + mp4_box(b'mdat', os.urandom(500000)) + mp4_box(b'moov', b'index')
+    assert not needs_seeking(faststart[:1000])
+    assert needs_seeking(moov_last[:1000])
+    assert not needs_seeking(b'ID3\x04' + bytes(100))
+
+    files = {"faststart.mp4": faststart, "moov_last.mp4": moov_last}
+    bodies_sent = []
+    base = start_media_server(files, {}, bodies_sent)
+    read_all = 'import os, sys; fd = int(sys.argv[1]); sys.stdout.buffer.write(b"".join(iter(lambda: os.read(fd, 65536), b"")))'
+
+    context = job_control.start_job("streaming-job")
+    try:
+        with streamed_input(f"{base}/faststart.mp4", scratch) as (path, pass_fds):
+            assert path.startswith("pipe:")
+            result = run_subprocess([sys.executable, '-c', read_all, path[len("pipe:"):]], capture_output=True, pass_fds=pass_fds)
+        assert result.stdout == faststart
+
+        with streamed_input(f"{base}/moov_last.mp4", scratch) as (path, pass_fds):
+            assert pass_fds == () and open(path, 'rb').read() == moov_last
+        assert not os.path.exists(path)
+
+        # A failing ffmpeg still leaves a record of the streamed download
+        with pytest.raises(RuntimeError):
+            with streamed_input(f"{base}/faststart.mp4", scratch) as (path, pass_fds):
+                raise RuntimeError("ffmpeg failed")
+    finally:
+        job_control.end_job(context)
+    assert [stats["streamed"] for stats in context.downloads] == [True, False, True]
+
+def test_storage_uris_are_read_through_signed_urls(monkeypatch):
+    scratch = tempfile.mkdtemp()
+    monkeypatch.setattr(file_management, 'input_cache', InputCache(os.path.join(scratch, 'input_cache')))
+    files = {"renders/clip.mp4": os.urandom(1000)}
+    bodies_sent = []
+    base = start_media_server(files, {"renders/clip.mp4": '"v1"'}, bodies_sent)
+    signed = []
+
+    def signed_download_url(bucket_name, blob_name, expiration):
+        signed.append((bucket_name, blob_name))
+        return f"{base}/{blob_name}?X-Goog-Signature={len(signed)}"
+    monkeypatch.setattr(file_management.gcp_toolkit, 'signed_download_url', signed_download_url)
+    monkeypatch.setattr(file_management, 'INPUT_BUCKETS', 'gs://renders-bucket, s3://renders')
+
+    context = job_control.start_job("storage-uri-job")
+    try:
+        first = download_file("gs://renders-bucket/renders/clip.mp4", scratch)
+        second = download_file("gs://renders-bucket/renders/clip.mp4", scratch)
+    finally:
+        job_control.end_job(context)
+
+    assert first != second
+    assert open(first, 'rb').read() == open(second, 'rb').read() == files["renders/clip.mp4"]
+    assert signed == [("renders-bucket", "renders/clip.mp4")] * 2
+    # Cached under the URI, although every request is signed anew
+    assert bodies_sent == ["renders/clip.mp4"]
+    assert [stats["url"] for stats in context.downloads] == ["gs://renders-bucket/renders/clip.mp4"] * 2
+    with pytest.raises(ValueError):
+        download_file("gs://renders-bucket", scratch)
+
+    # Other buckets the service's credentials can reach are refused, before and after queueing
+    with pytest.raises(file_management.InputNotAllowed):
+        download_file("gs://other-bucket/secrets.mp4", scratch)
+    with pytest.raises(file_management.InputNotAllowed):
+        file_management.check_input_urls({"inputs": [{"file_url": "s3://renders/a.mp4"}, {"file_url": "s3://other/b.mp4"}]})
+    file_management.check_input_urls({"video_urls": [{"video_url": "s3://renders/a.mp4"}, "https://example.com/b.mp4"]})
+    assert len(signed) == 2
+
+def test_input_buckets_default_to_the_output_buckets(monkeypatch):
+    monkeypatch.setattr(file_management, 'INPUT_BUCKETS', '')
+    monkeypatch.setenv('GCP_BUCKET_NAME', 'outputs')
+    monkeypatch.setenv('S3_ENDPOINT_URL', 'https://spaces-bucket.nyc3.digitaloceanspaces.com')
+    assert file_management.input_buckets() == {"gs://outputs", "s3://spaces-bucket"}
@@ -0,0 +1,193 @@
+import os
+import sys
+import time
+import tempfile
+import threading
+import types
+
+import pytest
+import tqdm
+
+# Add the current directory to the Python path
+sys.path.append('.')
+
+from services import job_control, scratch
+from services.job_control import JobCancelled, run_subprocess
+from services.job_store import JobStore
+
+def test_stopping_a_job_kills_its_subprocess():
+    context = job_control.start_job("job-kill")
+    threading.Timer(0.5, context.stop, args=("cancelled",)).start()
+    start = time.time()
+    try:
+        run_subprocess(["sleep", "30"])
+        assert False, "expected JobCancelled"
+    except JobCancelled as e:
+        assert e.reason == "cancelled"
+    finally:
+        job_control.end_job(context)
+    assert time.time() - start < 5
+    assert not context.processes
+
+def test_stopped_job_removes_its_scratch_files():
+    scratch = tempfile.mkdtemp()
+    path = os.path.join(scratch, "input.mp4")
+    open(path, 'w').close()
+    context = job_control.start_job("job-files")
+    job_control.register_file(path)
+    job_control.end_job(context)
+    context.stop("timeout")
+    context.cleanup_files()
+    assert not os.path.exists(path)
+
+def test_run_subprocess_outside_a_job_behaves_like_run():
+    result = run_subprocess(["echo", "hello"], capture_output=True, text=True)
+    assert result.returncode == 0
+    assert result.stdout.strip() == "hello"
+
+def test_cancel_in_the_store():
+    store = JobStore(os.path.join(tempfile.mkdtemp(), 'jobs.db'))
+    store.create("job-1", "task", "/v1/test", {"webhook_url": "https://example.com/hook"})
+    store.create("job-2", "task", "/v1/test", {"webhook_url": "https://example.com/hook"})
+    store.create("done", "task", "/v1/test", {}, state='running')
+    store.finish("done", 200, {"code": 200})
+    assert store.claim()["job_id"] == "job-1"
+
+    # Queued jobs are cancelled at once and never claimed
+    assert store.cancel("job-2")["state"] == "queued"
+    assert store.get("job-2")["state"] == "cancelled"
+    assert store.claim() is None
+
+    # Running jobs are flagged for the worker that owns them
+    assert store.cancel("job-1")["state"] == "running"
+    assert store.cancel_requests() == ["job-1"]
+    assert store.cancel("done")["state"] == "done"
+    assert store.cancel("missing") is None
+
+def test_progress_is_recorded_in_the_store():
+    store = JobStore(os.path.join(tempfile.mkdtemp(), 'jobs.db'))
+    store.create("job-1", "task", "/v1/test", {}, state='running')
+    context = job_control.start_job("job-1", store=store)
+    try:
+        job_control.report_progress("download", 10)
+        job_control.report_progress("download", 20)  # throttled
+        assert (store.get("job-1")["stage"], store.get("job-1")["progress"]) == ("download", 10)
+
+        # ffmpeg -progress output, measured against the -t duration
+        assert job_control.ffmpeg_duration(["ffmpeg", "-i", "missing.mp4", "-t", "00:01:40", "out.mp4"]) == 100
+        read_fd, write_fd = os.pipe()
+        os.write(write_fd, b"frame=10\nout_time_us=N/A\nout_time_us=25000000\nprogress=continue\n")
+        os.close(write_fd)
+        job_control.follow_ffmpeg_progress(read_fd, context, 100)
+        assert (store.get("job-1")["stage"], store.get("job-1")["progress"]) == ("ffmpeg", 25)
+    finally:
+        job_control.end_job(context)
+
+    store.finish("job-1", 200, {"code": 200})
+    context.report_progress("upload", 100)
+    assert store.get("job-1")["stage"] == "ffmpeg"
+
+def test_ffmpeg_progress_lines_become_percentages():
+    class Context:
+        def __init__(self):
+            self.reports = []
+
+        def report_progress(self, stage, progress=None):
+            self.reports.append((stage, progress))
+
+    def follow(output, duration):
+        context = Context()
+        read_fd, write_fd = os.pipe()
+        os.write(write_fd, output)
+        os.close(write_fd)
+        job_control.follow_ffmpeg_progress(read_fd, context, duration)
+        return context.reports
+
+    output = (b"frame=1\nout_time_us=30000000\nspeed=2.1x\nprogress=continue\n"
+              b"out_time_us=N/A\nout_time_us=90000000\nprogress=continue\nout_time_us=120000000\nprogress=end\n")
+    assert follow(output, 120) == [("ffmpeg", 25), ("ffmpeg", 75), ("ffmpeg", 100), ("ffmpeg", 100)]
+    # Without a known duration only the end is reported
+    assert follow(output, None) == [("ffmpeg", 100)]
+
+def test_whisper_progress_bar_reports_progress_and_stops_the_job(monkeypatch):
+    transcribe = types.ModuleType('whisper.transcribe')
+    transcribe.tqdm = tqdm
+    monkeypatch.setitem(sys.modules, 'whisper.transcribe', transcribe)
+    job_control.install_whisper_hook()
+    assert transcribe.tqdm.tqdm is not tqdm.tqdm
+
+    store = JobStore(os.path.join(tempfile.mkdtemp(), 'jobs.db'))
+    store.create("job-1", "task", "/v1/media/transcribe", {}, state='running')
+    context = job_control.start_job("job-1", store=store)
+    try:
+        # Whisper's bar counts frames and is disabled unless it runs verbose
+        with transcribe.tqdm.tqdm(total=4000, disable=True) as bar:
+            bar.update(1000)
+            assert (store.get("job-1")["stage"], store.get("job-1")["progress"]) == ("whisper", 25)
+            bar.update(3000)
+            assert store.get("job-1")["progress"] == 100
+            context.stop('cancelled')
+            with pytest.raises(JobCancelled):
+                bar.update(1)
+    finally:
+        job_control.end_job(context)
+
+def test_jobs_get_their_own_workspace_which_the_janitor_sweeps(monkeypatch):
+    root = tempfile.mkdtemp()
+    monkeypatch.setattr(scratch, 'STORAGE_PATH', root)
+    monkeypatch.setattr(scratch, 'SCRATCH_PATH', os.path.join(root, 'jobs'))
+    monkeypatch.setattr(scratch, 'JOB_SCRATCH_QUOTA_MB', 1)
+    store = JobStore(os.path.join(tempfile.mkdtemp(), 'jobs.db'))
+    store.create("running", "task", "/v1/test", {}, state='running')
+
+    context = job_control.start_job("running", store=store)
+    try:
+        workspace = job_control.scratch_dir()
+        assert os.path.dirname(workspace) == os.path.join(root, 'jobs', 'running')
+        with open(os.path.join(workspace, "output.mp4"), 'wb') as f:
+            f.write(bytes(2 * 1024 * 1024))
+        assert scratch.over_quota(workspace)
+        context.stop('quota', "Job exceeded its scratch space quota of 1 MB")
+        assert (context.state, job_control.STOP_CODES[context.reason]) == ('failed', 507)
+    finally:
+        job_control.end_job(context)
+    assert job_control.scratch_dir() == job_control.STORAGE_PATH
+
+    # Left behind by a killed worker, and by code that ran outside a workspace
+    dead = os.path.join(root, 'jobs', 'dead-job', '999999999-0123456789ab')
+    os.makedirs(dead)
+    stale = os.path.join(root, "0b6c1c7e-0f3a-4d5e-9a8b-7c6d5e4f3a2b.mp4")
+    kept = os.path.join(root, "jobs.db-other")
+    for path in (stale, kept):
+        open(path, 'w').close()
+    old = time.time() - 2 * scratch.SCRATCH_MAX_AGE
+    for path in (stale, kept, dead, workspace):
+        os.utime(path, (old, old))
+    scratch.sweep(store)
+    assert sorted(os.listdir(os.path.join(root, 'jobs'))) == ['running']
+    assert not os.path.exists(stale) and os.path.exists(kept)
+
+    context.cleanup_files()
+    assert not os.path.exists(workspace)
+
+def test_attempts_at_the_same_job_have_separate_workspaces(monkeypatch):
+    root = tempfile.mkdtemp()
+    monkeypatch.setattr(scratch, 'SCRATCH_PATH', os.path.join(root, 'jobs'))
+
+    # A requeued job is taken over while the worker of its first attempt is still winding down
+    first = job_control.start_job("requeued-job")
+    job_control.end_job(first)
+    second = job_control.start_job("requeued-job")
+    try:
+        assert first.workspace != second.workspace
+        open(os.path.join(first.workspace, "input.mp4"), 'w').close()
+        output = os.path.join(second.workspace, "output.mp4")
+        open(output, 'w').close()
+
+        first.cleanup_files()
+        assert not os.path.exists(first.workspace)
+        assert os.path.exists(output)
+    finally:
+        job_control.end_job(second)
+    second.cleanup_files()
+    assert os.listdir(os.path.join(root, 'jobs')) == []
@@ -0,0 +1,177 @@
+import os
+import sys
+import time
+import tempfile
+import threading
+
+os.environ.setdefault('API_KEY', 'test_api_key')
+
+# Add the current directory to the Python path
+sys.path.append('.')
+
+from services.job_executor import Job, JobExecutor, WorkerSlot
+from services.job_store import JobStore
+
+def make_store():
+    return JobStore(os.path.join(tempfile.mkdtemp(), 'jobs.db'))
+
+def queue_jobs(store, *job_ids):
+    for job_id in job_ids:
+        store.create(job_id, "routes.test.task", "/v1/toolkit/test", {"webhook_url": "https://example.com/hook"})
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+def test_jobs_run_concurrently_across_slots():
+    release = threading.Event()
+    started = []
+    finished = []
+
+    def handler(job, slot):
+        started.append((job.job_id, slot.slot_id))
+        release.wait(5)
+        finished.append(job.job_id)
+
+    store = make_store()
+    executor = JobExecutor(handler, store, workers=3)
+    queue_jobs(store, "job-0", "job-1", "job-2")
+    executor.start()
+
+    # All three jobs are running at once, each on its own slot
+    assert wait_for(lambda: len(started) == 3)
+    assert sorted(slot_id for _, slot_id in started) == [0, 1, 2]
+    assert executor.stats()["busy_workers"] == 3
+    assert executor.qsize() == 0
+
+    release.set()
+    assert wait_for(lambda: executor.stats()["busy_workers"] == 0)
+
+    stats = executor.stats()
+    assert sum(s["jobs_run"] for s in stats["slots"]) == 3
+    assert all(0 < s["utilization"] <= 1 for s in stats["slots"])
+
+def test_handler_errors_do_not_kill_the_slot():
+    done = []
+
+    def handler(job, slot):
+        if job.job_id == "bad":
+            raise RuntimeError("boom")
+        done.append(job.job_id)
+
+    store = make_store()
+    executor = JobExecutor(handler, store, workers=1)
+    queue_jobs(store, "bad", "good")
+    executor.start()
+
+    assert wait_for(lambda: done == ["good"])
+
+def test_executors_share_one_queue():
+    # Two executors on the same database stand in for two gunicorn workers
+    path = os.path.join(tempfile.mkdtemp(), 'jobs.db')
+    ran = {}
+    lock = threading.Lock()
+
+    def handler(name):
+        def run(job, slot):
+            time.sleep(0.05)
+            with lock:
+                ran[job.job_id] = name
+        return run
+
+    first = JobExecutor(handler("first"), JobStore(path), workers=2)
+    second = JobExecutor(handler("second"), JobStore(path), workers=2)
+    queue_jobs(first.store, *[f"job-{i}" for i in range(8)])
+    first.start()
+    second.start()
+
+    assert wait_for(lambda: len(ran) == 8)
+    assert set(ran.values()) == {"first", "second"}
+    assert second.qsize() == 0
+
+def test_drain_stops_claiming_and_releases_unfinished_jobs():
+    release = threading.Event()
+    started = []
+
+    def handler(job, slot):
+        started.append(job.job_id)
+        release.wait(5)
+
+    store = make_store()
+    executor = JobExecutor(handler, store, workers=1)
+    queue_jobs(store, "job-0", "job-1")
+    executor.start()
+    assert wait_for(lambda: started == ["job-0"])
+
+    assert executor.drain(0.2) == ["job-0"]
+    assert store.release(["job-0"]) == (1, [], [])
+    release.set()
+    assert executor.drain(2) == []
+    time.sleep(0.2)
+    assert started == ["job-0"]
+    assert store.get("job-0")["state"] == "queued"
+    assert store.queue_length() == 2
+
+def test_jobs_whose_workspace_cannot_be_created_fail(monkeypatch):
+    from app import app
+    from services import scratch
+
+    def create_workspace(job_id):
+        raise OSError(28, "No space left on device")
+    monkeypatch.setattr(scratch, 'create_workspace', create_workspace)
+    app.job_store.create("no-workspace", "routes.test.task", "/v1/toolkit/test", {}, state='running')
+
+    app.executor.handler(Job(app.job_store.get("no-workspace")), WorkerSlot(0))
+    job = app.job_store.get("no-workspace")
+    assert (job["state"], job["code"]) == ("failed", 500)
+    assert "workspace" in job["error"]
+
+def test_drain_only_requeues_jobs_that_stopped(monkeypatch):
+    from app import create_app
+    from app_utils import TASKS
+    from services import job_control
+    app_module = sys.modules['app']
+    monkeypatch.setattr(app_module, 'JOB_STOP_GRACE', 0.5)
+    app = create_app()
+    release = threading.Event()
+
+    def stoppable(job_id, data):
+        while True:
+            job_control.checkpoint()
+            time.sleep(0.01)
+
+    def stuck(job_id, data):
+        # Ignores the stop, then finishes its upload after the grace period
+        release.wait(10)
+        return "https://example.com/out.mp3", "/v1/toolkit/test", 200
+    monkeypatch.setitem(TASKS, "tests.stoppable", stoppable)
+    monkeypatch.setitem(TASKS, "tests.stuck", stuck)
+
+    threads = []
+    for job_id in ("stoppable", "stuck"):
+        app.job_store.create(job_id, f"tests.{job_id}", "/v1/toolkit/test", {"webhook_url": "https://example.com/hook"},
+                             state='running')
+        slot = WorkerSlot(len(app.executor.slots))
+        slot.job_id = job_id
+        app.executor.slots.append(slot)
+
+        def run(job_id=job_id, slot=slot):
+            try:
+                app.executor.handler(Job(app.job_store.get(job_id)), slot)
+            finally:
+                slot.job_id = None
+        threads.append(threading.Thread(target=run))
+        threads[-1].start()
+
+    app.drain(0.2)
+    assert app.job_store.get("stoppable")["state"] == "queued"
+    # Not handed to another worker while it may still finish here
+    assert app.job_store.get("stuck")["state"] == "running"
+
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    job = app.job_store.get("stuck")
+    assert (job["state"], job["code"]) == ("done", 200)
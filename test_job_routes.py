@@ -0,0 +1,205 @@
+import os
+import json
+import sys
+import tempfile
+import threading
+import time
+import types
+from collections import namedtuple
+
+import pytest
+
+os.environ.setdefault('API_KEY', 'test_api_key')
+
+# Add the current directory to the Python path
+sys.path.append('.')
+
+from flask import Flask
+from app_utils import validate_payload, queue_task_wrapper, queued_endpoints
+from services import admission, batch
+from services import tenants
+from services.job_store import JobStore
+from services.tenants import Tenant, load_tenants
+from routes.v1.toolkit.job_status import v1_toolkit_job_status_bp
+from routes.v1.toolkit.job_cancel import v1_toolkit_job_cancel_bp
+from routes.v1.toolkit import job_events
+from routes.v1.toolkit.job_events import v1_toolkit_job_events_bp
+from routes.v1.toolkit.batch import v1_toolkit_batch_bp
+from routes.v1.toolkit.queue_status import v1_toolkit_queue_status_bp
+
+def test_tenants_only_see_their_own_jobs_and_batches(monkeypatch):
+    monkeypatch.setattr(tenants, 'TENANTS', {"key-a": Tenant("acme"), "key-b": Tenant("globex")})
+    app = Flask(__name__)
+    for blueprint in (v1_toolkit_job_status_bp, v1_toolkit_job_cancel_bp, v1_toolkit_job_events_bp, v1_toolkit_batch_bp):
+        app.register_blueprint(blueprint)
+    app.job_store = JobStore(os.path.join(tempfile.mkdtemp(), 'jobs.db'))
+    app.job_store.create("job-a", "task", "/v1/media/transform/mp3", {"webhook_url": "https://a.example.com"}, tenant="acme")
+    app.job_store.create_batch("batch-a", {}, [{"job_id": "batch-job-a", "task": "task", "endpoint": "/v1/media/transform/mp3",
+                                                "data": {}, "idempotency_key": None}], tenant="acme")
+    client = app.test_client()
+
+    for key, code in (("key-b", 404), ("key-a", 200)):
+        headers = {"X-API-Key": key}
+        assert client.post('/v1/toolkit/job/status', json={"job_id": "job-a"}, headers=headers).status_code == code
+        assert client.get('/v1/toolkit/job/job-a/events', headers=headers).status_code == code
+        assert client.get('/v1/toolkit/batch/batch-a', headers=headers).status_code == code
+    assert client.post('/v1/toolkit/job/cancel', json={"job_id": "job-a"}, headers={"X-API-Key": "key-b"}).status_code == 404
+    assert app.job_store.get("job-a")["state"] == "queued"
+
+def test_every_api_key_needs_a_name_of_its_own():
+    assert load_tenants("main", '{"sk-live-1": {"name": "acme", "weight": 2}}')["sk-live-1"].name == "acme"
+    for api_keys in ('{"sk-live-1": {"weight": 2}}',
+                     '{"sk-live-1": {"name": "acme"}, "sk-live-2": {"name": "acme"}}',
+                     '{"sk-live-1": {"name": "default"}}'):
+        with pytest.raises(ValueError):
+            load_tenants("main", api_keys)
+
+def test_queue_status_only_reports_the_callers_tenant(monkeypatch):
+    class Executor:
+        def stats(self):
+            return {}
+    monkeypatch.setattr(tenants, 'TENANTS', {"key-a": Tenant("acme"), "key-b": Tenant("globex")})
+    app = Flask(__name__)
+    app.register_blueprint(v1_toolkit_queue_status_bp)
+    app.executor = Executor()
+    app.job_store = JobStore(os.path.join(tempfile.mkdtemp(), 'jobs.db'))
+    app.job_store.create("job-a", "task", "/v1/media/transform/mp3", {}, tenant="acme")
+    app.job_store.create("job-b", "task", "/v1/media/transform/mp3", {}, tenant="globex")
+
+    response = app.test_client().get('/v1/toolkit/queue/status', headers={"X-API-Key": "key-a"})
+    assert list(response.get_json()["tenants"]) == ["acme"]
+
+def events_app(monkeypatch):
+    monkeypatch.setattr(tenants, 'TENANTS', {"key-a": Tenant("acme")})
+    monkeypatch.setattr(job_events, 'POLL_INTERVAL', 0.05)
+    app = Flask(__name__)
+    app.register_blueprint(v1_toolkit_job_events_bp)
+    app.job_store = JobStore(os.path.join(tempfile.mkdtemp(), 'jobs.db'))
+    app.job_store.create("job-a", "task", "/v1/media/transform/mp3", {"webhook_url": "https://a.example.com"}, tenant="acme")
+    return app
+
+def test_long_poll_returns_when_progress_changes(monkeypatch):
+    app = events_app(monkeypatch)
+    client = app.test_client()
+    app.job_store.claim()
+    first = client.get('/v1/toolkit/job/job-a/events', headers={"X-API-Key": "key-a"}).get_json()
+    assert (first["state"], first["progress"]) == ("running", None)
+
+    def make_progress():
+        time.sleep(0.3)
+        app.job_store.set_progress("job-a", "ffmpeg", 40)
+    threading.Thread(target=make_progress).start()
+    started = time.time()
+    event = client.get(f'/v1/toolkit/job/job-a/events?since={first["updated_at"]}&wait=10',
+                       headers={"X-API-Key": "key-a"}).get_json()
+    assert 0.2 < time.time() - started < 5
+    assert (event["state"], event["stage"], event["progress"]) == ("running", "ffmpeg", 40)
+
+    # Nothing changes after `since`: the wait runs out and the same state comes back
+    again = client.get(f'/v1/toolkit/job/job-a/events?since={event["updated_at"]}&wait=0.2',
+                       headers={"X-API-Key": "key-a"}).get_json()
+    assert again["updated_at"] == event["updated_at"]
+
+def test_event_stream_ends_with_the_terminal_state(monkeypatch):
+    app = events_app(monkeypatch)
+    app.job_store.claim()
+    app.job_store.set_progress("job-a", "ffmpeg", 50)
+
+    def finish():
+        time.sleep(0.3)
+        app.job_store.finish("job-a", 200, {"code": 200, "response": "https://example.com/out.mp3"})
+    threading.Thread(target=finish).start()
+    response = app.test_client().get('/v1/toolkit/job/job-a/events',
+                                     headers={"X-API-Key": "key-a", "Accept": "text/event-stream"})
+    assert response.mimetype == 'text/event-stream'
+    events = [dict(line.split(": ", 1) for line in block.split("\n"))
+              for block in response.get_data(as_text=True).strip().split("\n\n") if block.startswith("id:")]
+    assert [event["event"] for event in events] == ["progress", "done"]
+    progress, done = (json.loads(event["data"]) for event in events)
+    assert (progress["state"], progress["progress"]) == ("running", 50)
+    assert done["state"] == "done"
+    assert done["result"]["response"] == "https://example.com/out.mp3"
+
+def batch_app(monkeypatch, memory_mb=16000):
+    Disk, Memory = namedtuple('Disk', 'free'), namedtuple('Memory', 'available')
+    monkeypatch.setattr(admission.psutil, 'disk_usage', lambda path: Disk(100000 * 1024 * 1024))
+    monkeypatch.setattr(admission.psutil, 'virtual_memory', lambda: Memory(memory_mb * 1024 * 1024))
+    monkeypatch.setattr(admission, 'JOB_SLOTS', 2)
+    monkeypatch.setattr(tenants, 'TENANTS', {"key-a": Tenant("acme")})
+    sent = []
+    monkeypatch.setattr(batch, 'send_webhook', lambda url, payload: sent.append((url, payload)))
+
+    app = Flask(__name__)
+    app.register_blueprint(v1_toolkit_batch_bp)
+
+    @app.route('/v1/media/transform/mp3', methods=['POST'])
+    @validate_payload({
+        "type": "object",
+        "properties": {"media_url": {"type": "string"}, "webhook_url": {"type": "string"}, "id": {"type": "string"}},
+        "required": ["media_url"],
+        "additionalProperties": False
+    })
+    @queue_task_wrapper(bypass_queue=False)
+    def convert_media(job_id, data):
+        pass
+
+    app.queued_endpoints = queued_endpoints(app)
+    app.executor = types.SimpleNamespace(draining=threading.Event(), notify=lambda: None, qsize=lambda: 0)
+    app.job_store = JobStore(os.path.join(tempfile.mkdtemp(), 'jobs.db'))
+    return app, sent
+
+def mp3_request(name):
+    return {"endpoint": "/v1/media/transform/mp3", "payload": {"media_url": f"https://example.com/{name}.mp4", "id": name}}
+
+def test_batches_are_validated_and_admitted_as_a_whole(monkeypatch):
+    # Room for one conversion at a time, not two
+    app, _ = batch_app(monkeypatch, memory_mb=admission.MIN_FREE_MEMORY_MB + 300)
+    client = app.test_client()
+    headers = {"X-API-Key": "key-a"}
+
+    for body, message in (({"requests": []}, "Invalid payload"),
+                          ({"requests": [dict(mp3_request("a"), extra=1)]}, "Invalid payload"),
+                          ({"requests": [mp3_request("a")], "webhook_mode": "sometimes"}, "Invalid payload"),
+                          ({"requests": [mp3_request("a"), {"endpoint": "/v1/nope", "payload": {}}]}, "requests[1] has unknown endpoint"),
+                          ({"requests": [{"endpoint": "/v1/media/transform/mp3", "payload": {"id": "a"}}]}, "requests[0]")):
+        response = client.post('/v1/toolkit/batch', json=body, headers=headers)
+        assert response.status_code == 400
+        assert message in response.get_json()["message"]
+
+    response = client.post('/v1/toolkit/batch', json={"requests": [mp3_request("a"), mp3_request("b")]}, headers=headers)
+    assert response.status_code == 503
+    assert "memory" in response.get_json()["message"]
+    assert int(response.headers["Retry-After"]) >= admission.RETRY_AFTER_MIN
+    assert app.job_store.queue_length() == 0
+    assert client.post('/v1/toolkit/batch', json={"requests": [mp3_request("a")]}, headers=headers).status_code == 202
+
+def test_batch_results_are_sent_per_batch_or_per_item(monkeypatch):
+    app, sent = batch_app(monkeypatch)
+    client = app.test_client()
+    headers = {"X-API-Key": "key-a"}
+
+    response = client.post('/v1/toolkit/batch', json={"requests": [mp3_request("a"), mp3_request("b")], "id": "nightly",
+                                                      "webhook_url": "https://example.com/batch"}, headers=headers)
+    assert response.status_code == 202
+    batch_id, job_ids = response.get_json()["batch_id"], response.get_json()["job_ids"]
+    # In the default mode only the batch has a webhook
+    assert [app.job_store.get(job_id)["data"].get("webhook_url") for job_id in job_ids] == [None, None]
+
+    app.job_store.finish(job_ids[0], 200, {"code": 200, "response": "https://example.com/a.mp3"})
+    assert client.get(f'/v1/toolkit/batch/{batch_id}', headers=headers).get_json()["pending"] == 1
+    completed = app.job_store.finish(job_ids[1], 500, {"code": 500, "message": "boom"})
+    batch.send_job_webhooks(app.job_store, [], completed)
+    assert [url for url, _ in sent] == ["https://example.com/batch"]
+    result = client.get(f'/v1/toolkit/batch/{batch_id}', headers=headers).get_json()
+    assert result == sent[0][1]
+    assert (result["id"], result["state"], result["message"]) == ("nightly", "done", "1 of 2 requests failed")
+    assert [(item["id"], item["code"], item["response"], item["message"]) for item in result["items"]] == \
+        [("a", 200, "https://example.com/a.mp3", None), ("b", 500, None, "boom")]
+
+    # In items mode every job reports to the webhook itself, and there is no aggregated webhook
+    response = client.post('/v1/toolkit/batch', json={"requests": [mp3_request("c")], "webhook_mode": "items",
+                                                      "webhook_url": "https://example.com/items"}, headers=headers)
+    job_id = response.get_json()["job_ids"][0]
+    assert app.job_store.webhooks(job_id) == ["https://example.com/items"]
+    batch.send_job_webhooks(app.job_store, [], app.job_store.finish(job_id, 200, {"code": 200, "job_id": job_id}))
+    assert [url for url, _ in sent] == ["https://example.com/batch"]
@@ -0,0 +1,239 @@
+import os
+import sys
+import time
+import sqlite3
+import subprocess
+import tempfile
+import threading
+
+# Add the current directory to the Python path
+sys.path.append('.')
+
+from services.job_store import JobStore
+from services import idempotency
+from services.idempotency import idempotency_key, wait_for_job
+
+def make_store():
+    return JobStore(os.path.join(tempfile.mkdtemp(), 'jobs.db'))
+
+def test_workers_starting_together_create_and_migrate_the_database_once():
+    # A database from before the migrated columns, and a fresh one
+    old = os.path.join(tempfile.mkdtemp(), 'jobs.db')
+    conn = sqlite3.connect(old)
+    conn.execute("CREATE TABLE jobs (job_id TEXT PRIMARY KEY, task TEXT NOT NULL, endpoint TEXT NOT NULL, data TEXT NOT NULL, "
+                 "kwargs TEXT NOT NULL DEFAULT '{}', webhook_url TEXT, state TEXT NOT NULL, owner TEXT, queued_at REAL NOT NULL, "
+                 "started_at REAL, finished_at REAL, code INTEGER, result TEXT, error TEXT)")
+    conn.close()
+    fresh = os.path.join(tempfile.mkdtemp(), 'jobs.db')
+    for path in (old, fresh):
+        workers = [subprocess.Popen([sys.executable, '-c', 'import sys; sys.path.append("."); '
+                                     'from services.job_store import JobStore; JobStore(sys.argv[1])', path])
+                   for _ in range(4)]
+        assert [worker.wait() for worker in workers] == [0] * 4
+        columns = {row[1] for row in sqlite3.connect(path).execute("PRAGMA table_info(jobs)")}
+        assert {"lane", "cancel_requested", "tenant", "fair_charge"} <= columns
+
+def test_job_lifecycle_is_recorded():
+    store = make_store()
+    data = {"media_url": "https://example.com/a.mp4", "webhook_url": "https://example.com/hook", "id": "abc"}
+    store.create("job-1", "routes.test.task", "/v1/test", data)
+    assert store.get("job-1")["state"] == "queued"
+
+    job = store.claim()
+    assert job["job_id"] == "job-1"
+    assert store.get("job-1")["state"] == "running"
+    assert store.get("job-1")["started_at"] is not None
+    assert store.claim() is None
+
+    store.finish("job-1", 200, {"code": 200, "response": "https://example.com/out.mp3"})
+    job = store.get("job-1")
+    assert job["state"] == "done"
+    assert job["data"] == data
+    assert job["result"]["response"] == "https://example.com/out.mp3"
+
+    store.finish("job-1", 500, {"code": 500, "message": "boom"})
+    assert store.get("job-1")["error"] == "boom"
+    assert store.get("missing") is None
+
+def test_claim_order_follows_priority_then_deadline():
+    store = make_store()
+    now = time.time()
+    store.create("transcribe", "task", "/v1/media/transcribe", {}, queued_at=now - 10)
+    store.create("mp3", "task", "/v1/media/transform/mp3", {}, queued_at=now)
+    store.create("urgent", "task", "/v1/media/transcribe", {"deadline": 1}, queued_at=now)
+    store.create("vip", "task", "/v1/media/transcribe", {"priority": 5}, queued_at=now)
+
+    assert store.queue_length() == 4
+    assert store.queue_length("/v1/media/transcribe") == 3
+    order = [store.claim()["job_id"] for _ in range(4)]
+    assert order == ["vip", "urgent", "mp3", "transcribe"]
+
+    stats = store.lane_stats()
+    assert stats["/v1/media/transcribe"]["jobs"] == 3
+    assert stats["/v1/media/transcribe"]["queued"] == 0
+    assert stats["/v1/media/transcribe"]["max_queue_time"] >= 10
+
+def test_recover_requeues_jobs_of_dead_workers():
+    store = make_store()
+    store.create("async-job", "routes.test.task", "/v1/test", {"webhook_url": "https://example.com/hook"})
+    store.create("sync-job", "routes.test.task", "/v1/test", {}, state='running')
+    store.create("live-job", "routes.test.task", "/v1/test", {"webhook_url": "https://example.com/hook"})
+    store.claim()
+    store.claim()
+
+    # Pretend the first two belonged to a worker that has since exited
+    conn = store._connect()
+    conn.execute("UPDATE jobs SET owner = '999999999:1.0' WHERE job_id IN ('async-job', 'sync-job')")
+
+    requeued, finished, completed_batches = store.recover()
+    assert requeued == 1
+    assert store.get("async-job")["state"] == "queued"
+    assert store.get("sync-job")["state"] == "failed"
+    # The failed job's payload comes back for its webhooks, and is what a waiting request reads
+    assert [result["job_id"] for result in finished] == ["sync-job"]
+    assert store.get("sync-job")["result"] == finished[0]
+    assert finished[0]["code"] == 500
+    assert completed_batches == []
+    # Jobs owned by a live worker (this process) are left alone
+    assert store.get("live-job")["state"] == "running"
+    assert store.recover() == (0, [], [])
+
+def test_duplicates_attach_to_in_flight_jobs_and_reuse_done_ones(monkeypatch):
+    monkeypatch.setattr(idempotency, 'IDEMPOTENCY_MODE', 'payload')
+    store = make_store()
+    key = idempotency_key("/v1/media/transform/mp3", {"media_url": "https://example.com/a.mp4", "webhook_url": "https://a.example.com"})
+    assert key == idempotency_key("/v1/media/transform/mp3", {"media_url": "https://example.com/a.mp4", "webhook_url": "https://b.example.com", "priority": 5})
+    assert key != idempotency_key("/v1/media/transform/mp3", {"media_url": "https://example.com/b.mp4"})
+
+    assert store.create("job-1", "task", "/v1/media/transform/mp3", {"webhook_url": "https://a.example.com"}, idempotency_key=key) is None
+    duplicate = store.create("job-2", "task", "/v1/media/transform/mp3", {"webhook_url": "https://b.example.com"}, idempotency_key=key)
+    assert duplicate["job_id"] == "job-1"
+    assert store.get("job-2") is None
+    assert store.find_duplicate(key, "https://a.example.com")["job_id"] == "job-1"
+    assert store.webhooks("job-1") == ["https://a.example.com", "https://b.example.com"]
+
+    store.claim()
+    store.finish("job-1", 200, {"code": 200, "response": "https://example.com/out.mp3"})
+    assert store.find_duplicate(key, "https://c.example.com")["result"]["response"] == "https://example.com/out.mp3"
+    assert len(store.webhooks("job-1")) == 2
+
+    # Failed jobs are not reused
+    other = idempotency_key("/v1/media/transform/mp3", {"media_url": "https://example.com/b.mp4"})
+    store.create("job-3", "task", "/v1/media/transform/mp3", {}, state='running', idempotency_key=other)
+    store.finish("job-3", 500, {"code": 500, "message": "boom"})
+    assert store.find_duplicate(other) is None
+
+def test_requests_are_deduplicated_by_id_by_default():
+    assert idempotency.IDEMPOTENCY_MODE == 'id'
+    data = {"media_url": "https://example.com/a.mp4"}
+    # The same URL may serve different content later, so the payload alone never matches
+    assert idempotency_key("/v1/media/transform/mp3", data, tenant="default") is None
+    assert idempotency_key("/v1/media/transform/mp3", dict(data, id="req-1"), tenant="default") == \
+        idempotency_key("/v1/media/transform/mp3", dict(data, id="req-1", webhook_url="https://example.com/hook"), tenant="default")
+    # A reused id with other inputs is a new request, not a replay of the first
+    assert idempotency_key("/v1/media/transform/mp3", dict(data, id="req-1"), tenant="default") != \
+        idempotency_key("/v1/media/transform/mp3", {"media_url": "https://example.com/b.mp4", "id": "req-1"}, tenant="default")
+    assert idempotency_key("/v1/media/transform/mp3", dict(data, id="req-1"), tenant="default") != \
+        idempotency_key("/v1/media/transform/mp3", dict(data, id="req-1", bitrate="320k"), tenant="default")
+    assert idempotency_key("/v1/media/transform/mp3", data, "retry-1", "default") is not None
+
+def test_duplicates_are_matched_within_a_tenant_only(monkeypatch):
+    monkeypatch.setattr(idempotency, 'IDEMPOTENCY_MODE', 'payload')
+    store = make_store()
+    data = {"media_url": "https://example.com/a.mp4"}
+    first = idempotency_key("/v1/media/transform/mp3", data, "retry-1", "tenant-a")
+    second = idempotency_key("/v1/media/transform/mp3", data, "retry-1", "tenant-b")
+    assert first != second
+    assert idempotency_key("/v1/media/transform/mp3", data, tenant="tenant-a") != idempotency_key("/v1/media/transform/mp3", data, tenant="tenant-b")
+
+    assert store.create("job-a", "task", "/v1/media/transform/mp3", data, idempotency_key=first, tenant="tenant-a") is None
+    assert store.create("job-b", "task", "/v1/media/transform/mp3", data, idempotency_key=second, tenant="tenant-b") is None
+    assert store.find_duplicate(second)["job_id"] == "job-b"
+
+def test_non_deterministic_endpoints_are_only_deduplicated_by_header():
+    from flask import Flask
+    from app_utils import validate_payload, queue_task_wrapper, queued_endpoints
+
+    app = Flask(__name__)
+    @app.route('/v1/code/execute/python', methods=['POST'])
+    @validate_payload({"type": "object", "properties": {"code": {"type": "string"}, "webhook_url": {"type": "string"}}})
+    @queue_task_wrapper(bypass_queue=False, deterministic=False)
+    def execute_python(job_id, data):
+        pass
+    endpoint = queued_endpoints(app)['/v1/code/execute/python']
+    assert endpoint.deterministic is False
+
+    data = {"code": "import random; print(random.random())"}
+    assert idempotency_key(endpoint.path, data, tenant="default", deterministic=False) is None
+    assert idempotency_key(endpoint.path, data, "run-1", "default", deterministic=False) == \
+        idempotency_key(endpoint.path, data, "run-1", "default", deterministic=False)
+
+def test_sync_waiters_time_out_or_wake_up_when_their_job_finishes():
+    store = make_store()
+    store.create("job-1", "task", "/v1/test", {})
+    start = time.time()
+    assert wait_for_job(store, "job-1", timeout=0.2)["state"] == "queued"
+    assert time.time() - start < 1
+
+    wakeup = threading.Event()
+    def finish():
+        store.claim()
+        store.finish("job-1", 200, {"code": 200})
+        wakeup.set()
+    threading.Timer(0.1, finish).start()
+    start = time.time()
+    assert wait_for_job(store, "job-1", timeout=10, wakeup=wakeup)["state"] == "done"
+    assert time.time() - start < 0.4
+
+def test_claims_are_shared_fairly_between_tenants_by_weight():
+    store = make_store()
+    for i in range(6):
+        store.create(f"bulk-{i}", "task", "/v1/video/concatenate", {}, queued_at=time.time() - 100 + i, tenant="bulk")
+    for i in range(3):
+        store.create(f"interactive-{i}", "task", "/v1/video/concatenate", {}, tenant="interactive", weight=2)
+    order = [store.claim()["tenant"] for _ in range(6)]
+    # Same cost per job, so twice the weight gets twice the claims despite queueing last
+    assert order.count("interactive") == 3 and order.count("bulk") == 3
+    assert order[:3].count("interactive") == 2
+
+    # A tenant joining later is not owed the slots it didn't use while idle
+    store.create("late-0", "task", "/v1/video/concatenate", {}, tenant="late")
+    store.create("late-1", "task", "/v1/video/concatenate", {}, tenant="late")
+    assert [store.claim()["tenant"] for _ in range(4)].count("late") == 2
+
+def test_batches_complete_when_their_last_job_finishes(monkeypatch):
+    monkeypatch.setattr(idempotency, 'IDEMPOTENCY_MODE', 'payload')
+    store = make_store()
+    key = idempotency_key("/v1/media/transform/mp3", {"media_url": "https://example.com/a.mp4"})
+    jobs = [{"job_id": f"job-{i}", "task": "task", "endpoint": "/v1/media/transform/mp3",
+             "data": {"media_url": "https://example.com/a.mp4"}, "idempotency_key": key} for i in range(2)]
+    jobs.append({"job_id": "job-2", "task": "task", "endpoint": "/v1/toolkit/test", "data": {}, "idempotency_key": None})
+    # The second item duplicates the first one
+    assert store.create_batch("batch-1", {"webhook_url": "https://example.com/hook"}, jobs) == ["job-0", "job-0", "job-2"]
+    assert store.complete_batch("batch-1") is False
+
+    store.claim()
+    assert store.finish("job-0", 200, {"code": 200}) == []
+    store.claim()
+    assert store.finish("job-2", 500, {"code": 500, "message": "boom"}) == ["batch-1"]
+    batch = store.batch("batch-1")
+    assert batch['finished_at'] is not None
+    assert [job['state'] for job in batch['jobs']] == ["done", "done", "failed"]
+    assert store.complete_batch("batch-1") is False
+
+def test_recover_completes_batches_of_cancelled_jobs():
+    store = make_store()
+    jobs = [{"job_id": "job-0", "task": "task", "endpoint": "/v1/toolkit/test", "data": {"id": "a"}, "idempotency_key": None}]
+    store.create_batch("batch-1", {"webhook_url": "https://example.com/hook"}, jobs)
+    store.claim()
+    store.cancel("job-0")
+
+    # The worker running the job exited before it noticed the cancellation
+    conn = store._connect()
+    conn.execute("UPDATE jobs SET owner = '999999999:1.0' WHERE job_id = 'job-0'")
+
+    requeued, finished, completed_batches = store.recover()
+    assert requeued == 0
+    assert [(result["job_id"], result["id"], result["code"]) for result in finished] == [("job-0", "a", 499)]
+    assert completed_batches == ["batch-1"]
+    assert store.get("job-0")["state"] == "cancelled"
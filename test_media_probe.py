@@ -0,0 +1,85 @@
+import os
+import sys
+import json
+import time
+import threading
+import tempfile
+import subprocess
+
+# Add the current directory to the Python path
+sys.path.append('.')
+
+from services import job_control, media_probe
+
+def fake_ffprobe(calls):
+    def run(cmd, **kwargs):
+        calls.append(cmd[-1])
+        output = {
+            "format": {"duration": "12.5", "bit_rate": "800000"},
+            "streams": [
+                {"codec_type": "video", "codec_name": "h264", "width": 1280, "height": 720},
+                {"codec_type": "audio", "codec_name": "aac"},
+            ],
+        }
+        return subprocess.CompletedProcess(cmd, 0, json.dumps(output), "")
+    return run
+
+def test_probe_is_shared_by_hard_links_until_the_file_changes(monkeypatch):
+    calls = []
+    monkeypatch.setattr(job_control, "run_subprocess", fake_ffprobe(calls))
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "input.mp4")
+    with open(path, "wb") as f:
+        f.write(b"x" * 100)
+    link = os.path.join(directory, "job_input.mp4")
+    os.link(path, link)
+
+    info = media_probe.probe(path)
+    assert info.duration == 12.5
+    assert info.bit_rate == 800000
+    assert info.resolution == (1280, 720)
+    assert info.codecs == {"video": "h264", "audio": "aac"}
+    assert media_probe.probe(link) is info
+    assert calls == [path]
+
+    with open(path, "ab") as f:
+        f.write(b"y")
+    media_probe.probe(link)
+    assert calls == [path, link]
+
+def test_duration_falls_back_to_the_longest_stream():
+    info = media_probe.MediaInfo({"format": {}, "streams": [
+        {"codec_type": "video", "duration": "9.5"}, {"codec_type": "audio", "duration": "10.25"}, {"codec_type": "data"}]})
+    assert info.duration == 10.25
+    assert media_probe.MediaInfo({"format": {"duration": "N/A"}, "streams": []}).duration is None
+
+def test_probe_runs_as_part_of_the_job(monkeypatch):
+    path = os.path.join(tempfile.mkdtemp(), "stalled.mp4")
+    open(path, 'w').close()
+    started = threading.Event()
+    run_subprocess = job_control.run_subprocess
+    def stalled_ffprobe(cmd, **kwargs):
+        # An ffprobe stuck on a stalled input
+        started.set()
+        return run_subprocess(["sleep", "30"], **kwargs)
+    monkeypatch.setattr(job_control, "run_subprocess", stalled_ffprobe)
+
+    context = job_control.start_job("probe-job")
+    threading.Timer(0.5, context.stop, args=("cancelled",)).start()
+    start = time.time()
+    try:
+        media_probe.probe(path)
+        assert False, "expected JobCancelled"
+    except job_control.JobCancelled:
+        pass
+    finally:
+        job_control.end_job(context)
+        context.cleanup_files()
+    assert started.is_set() and time.time() - start < 5
+
+def test_probe_of_a_missing_file_raises():
+    try:
+        media_probe.probe("/nonexistent/input.mp4")
+        assert False, "expected ProbeError"
+    except media_probe.ProbeError:
+        pass
@@ -0,0 +1,37 @@
+import os
+import sys
+import tempfile
+
+# Add the current directory to the Python path
+sys.path.append('.')
+
+from services import metrics
+from services.job_store import JobStore
+from services.metrics import MetricsStore
+
+def test_metrics_are_rendered_in_prometheus_format(monkeypatch):
+    path = os.path.join(tempfile.mkdtemp(), 'jobs.db')
+    job_store = JobStore(path)
+    monkeypatch.setattr(metrics, '_store', MetricsStore(path))
+
+    job_store.create("job-1", "task", "/v1/media/transform/mp3", {"webhook_url": "https://example.com/hook"})
+    metrics.record_job("/v1/media/transform/mp3", "done", 0.3, 12)
+    metrics.record_job("/v1/media/transform/mp3", "failed", 2, 700)
+    metrics.inc("nca_downloaded_bytes_total", 5 * 1024 ** 3)
+    with metrics.stage_timer("ffmpeg"):
+        pass
+
+    lines = metrics.render(job_store).splitlines()
+    assert "# TYPE nca_job_run_seconds histogram" in lines
+    assert 'nca_job_run_seconds_bucket{endpoint="/v1/media/transform/mp3",le="10"} 0' in lines
+    assert 'nca_job_run_seconds_bucket{endpoint="/v1/media/transform/mp3",le="30"} 1' in lines
+    assert 'nca_job_run_seconds_bucket{endpoint="/v1/media/transform/mp3",le="+Inf"} 2' in lines
+    assert 'nca_job_run_seconds_sum{endpoint="/v1/media/transform/mp3"} 712' in lines
+    assert 'nca_jobs_total{endpoint="/v1/media/transform/mp3",state="failed"} 1' in lines
+    assert 'nca_stage_seconds_count{stage="ffmpeg"} 1' in lines
+    assert "nca_downloaded_bytes_total 5368709120" in lines
+    assert 'nca_queue_depth{lane="/v1/media/transform/mp3"} 1' in lines
+    assert "nca_jobs_running 0" in lines
+
+    buckets = [line for line in lines if line.startswith('nca_job_queue_seconds_bucket')]
+    assert buckets[0].endswith('le="0.1"} 0') and buckets[1].endswith('le="0.5"} 1') and buckets[-1].endswith('le="+Inf"} 2')
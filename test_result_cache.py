@@ -0,0 +1,111 @@
+import os
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Add the current directory to the Python path
+sys.path.append('.')
+
+from services import result_cache
+from services.result_cache import ResultCache, cache_result
+
+def start_media_server(etags):
+    """Serve HEAD requests for /<name> with the ETag in `etags[name]`."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_HEAD(self):
+            etag = etags.get(self.path.lstrip('/'))
+            self.send_response(200)
+            if etag:
+                self.send_header('ETag', etag)
+            self.send_header('Content-Length', '100')
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+def test_results_are_reused_for_the_same_input_content(monkeypatch):
+    monkeypatch.setattr(result_cache, 'RESULT_CACHE', True)
+    monkeypatch.setattr(result_cache, '_cache', ResultCache(os.path.join(tempfile.mkdtemp(), 'jobs.db')))
+    etags = {"a.mp4": '"v1"'}
+    base = start_media_server(etags)
+    calls = []
+
+    @cache_result(url_fields=['media_url'], defaults={'bitrate': '128k'})
+    def convert(job_id, data):
+        calls.append(job_id)
+        return f"https://storage.example.com/{job_id}.mp3", "/v1/media/transform/mp3", 200
+
+    assert convert(job_id="job-1", data={"media_url": f"{base}/a.mp4"})[0].endswith("job-1.mp3")
+    # Same content and settings, different delivery options
+    assert convert(job_id="job-2", data={"media_url": f"{base}/a.mp4", "bitrate": "128k", "webhook_url": "https://example.com/hook", "id": "x"})[0].endswith("job-1.mp3")
+    assert calls == ["job-1"]
+
+    convert(job_id="job-3", data={"media_url": f"{base}/a.mp4", "bitrate": "192k"})
+    etags["a.mp4"] = '"v2"'
+    convert(job_id="job-4", data={"media_url": f"{base}/a.mp4"})
+    # Inputs without a validator are never cached
+    convert(job_id="job-5", data={"media_url": f"{base}/b.mp4"})
+    convert(job_id="job-6", data={"media_url": f"{base}/b.mp4"})
+    assert calls == ["job-1", "job-3", "job-4", "job-5", "job-6"]
+
+def test_caption_urls_are_fingerprinted_and_inline_captions_are_settings(monkeypatch):
+    monkeypatch.setattr(result_cache, 'RESULT_CACHE', True)
+    monkeypatch.setattr(result_cache, '_cache', ResultCache(os.path.join(tempfile.mkdtemp(), 'jobs.db')))
+    etags = {"a.mp4": '"v1"', "a.srt": '"s1"'}
+    base = start_media_server(etags)
+    calls = []
+
+    @cache_result(url_fields=['video_url', 'captions'])
+    def caption(job_id, data):
+        calls.append(job_id)
+        return f"https://storage.example.com/{job_id}.mp4", "/v1/video/caption", 200
+
+    caption(job_id="job-1", data={"video_url": f"{base}/a.mp4", "captions": f"{base}/a.srt"})
+    caption(job_id="job-2", data={"video_url": f"{base}/a.mp4", "captions": f"{base}/a.srt"})
+    # The subtitle file changed behind the same URL
+    etags["a.srt"] = '"s2"'
+    caption(job_id="job-3", data={"video_url": f"{base}/a.mp4", "captions": f"{base}/a.srt"})
+    caption(job_id="job-4", data={"video_url": f"{base}/a.mp4", "captions": "1\n00:00:00,000 --> 00:00:01,000\nHi"})
+    caption(job_id="job-5", data={"video_url": f"{base}/a.mp4", "captions": "1\n00:00:00,000 --> 00:00:01,000\nHi"})
+    caption(job_id="job-6", data={"video_url": f"{base}/a.mp4", "captions": "1\n00:00:00,000 --> 00:00:01,000\nBye"})
+    assert calls == ["job-1", "job-3", "job-4", "job-6"]
+
+def test_least_recently_used_entries_are_evicted_by_size():
+    cache = ResultCache(os.path.join(tempfile.mkdtemp(), 'jobs.db'), max_bytes=250)
+    cache.put("a", {"response": "a"}, 100)
+    cache.put("b", {"response": "b"}, 100)
+    assert cache.get("a") == {"response": "a"}
+    cache.put("c", {"response": "c"}, 100)
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+
+def test_storage_uris_are_fingerprinted_through_their_signed_url(monkeypatch):
+    class Handler(BaseHTTPRequestHandler):
+        # Like a signed GCS or S3 URL: valid for GET only
+        def do_HEAD(self):
+            self.send_response(403)
+            self.end_headers()
+
+        def do_GET(self):
+            assert self.headers['Range'] == 'bytes=0-0'
+            self.send_response(206)
+            self.send_header('ETag', '"v1"')
+            self.send_header('Content-Range', 'bytes 0-0/100')
+            self.send_header('Content-Length', '1')
+            self.end_headers()
+            self.wfile.write(b'x')
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    signed = f"http://127.0.0.1:{server.server_address[1]}/a.mp4?X-Goog-Signature=abc"
+    monkeypatch.setattr(result_cache, 'source_url', lambda url: signed if url.startswith('gs://') else url)
+
+    assert result_cache.content_fingerprint("gs://media/a.mp4") == 'etag:"v1":100'
@@ -0,0 +1,71 @@
+import sys
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Add the current directory to the Python path
+sys.path.append('.')
+
+from services import webhook
+from services.webhook import WebhookDispatcher
+
+def start_receiver(statuses, delay=0):
+    """Local webhook receiver answering with `statuses` in turn (200 once exhausted)."""
+    received = []
+    active = [0, 0]  # current, peak concurrent requests
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            with lock:
+                active[0] += 1
+                active[1] = max(active[1], active[0])
+            time.sleep(delay)
+            with lock:
+                active[0] -= 1
+                received.append(body)
+                status = statuses.pop(0) if statuses else 200
+            self.send_response(status)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}/hook", received, active
+
+def test_failed_webhooks_are_retried(monkeypatch):
+    monkeypatch.setattr(webhook, 'WEBHOOK_RETRY_BACKOFF', 0.05)
+    url, received, _ = start_receiver([500, 503])
+    dispatcher = WebhookDispatcher(threads=2)
+    assert dispatcher.submit(url, {"job_id": "job-1"})
+    assert dispatcher.flush(10)
+    stats = dispatcher.stats()
+    assert len(received) == 3
+    assert stats["sent"] == 1 and stats["retried"] == 2 and stats["failed"] == 0
+
+def test_client_errors_are_not_retried():
+    url, received, _ = start_receiver([404])
+    dispatcher = WebhookDispatcher(threads=1)
+    dispatcher.submit(url, {"job_id": "job-1"})
+    assert dispatcher.flush(10)
+    assert len(received) == 1
+    assert dispatcher.stats()["failed"] == 1
+
+def test_concurrency_per_host_is_limited(monkeypatch):
+    monkeypatch.setattr(webhook, 'WEBHOOK_HOST_CONCURRENCY', 2)
+    url, received, active = start_receiver([], delay=0.2)
+    dispatcher = WebhookDispatcher(threads=6)
+    for i in range(6):
+        dispatcher.submit(url, {"job_id": f"job-{i}"})
+    assert dispatcher.flush(10)
+    assert len(received) == 6
+    assert active[1] == 2
+
+def test_full_queue_drops_webhooks():
+    dispatcher = WebhookDispatcher(threads=1, max_queue=0)
+    assert not dispatcher.submit("http://127.0.0.1:9/hook", {"job_id": "job-1"})
+    assert dispatcher.stats()["dropped"] == 1